@@ -0,0 +1,261 @@
+"""
+    网格交易向量化回测
+    与 gridtradetest.GridTrade 的成交规则一致, 一次对多组网格参数同时回测:
+        每组参数的网格价格阶梯预先算好, 逐根 K 线推进时所有参数组以数组运算同时判断和成交
+        每根 K 线按 开盘 -> 最高/最低 -> 收盘 的顺序检查价格, 顺序由 K 线形态决定, 见 GridTrade.update
+    与 GridTrade 的差别: 买入扣减现金、卖出增加现金, 买入时现金不足则不成交
+
+    >>> params = param_grid(up_size=[3, 4, 5], down_size=[3, 4])               # doctest: +SKIP
+    >>> result = backtest('601717', store.load('601717'), params)              # doctest: +SKIP
+    >>> result.summary[np.argmax(result.summary['returns'])]                   # doctest: +SKIP
+"""
+import itertools
+
+import numpy as np
+
+from utils.stockutil import ensure_price
+
+# 网格参数, 对应 GridTrade 的 upNetSize / downNetSize / upNetAmount / downNetAmount / initSize
+# 以及 网格交易策略 的 valCoefficient
+PARAM_DTYPE = np.dtype([
+    ('up_size', 'f8'),  # 网格大小(上)(%)
+    ('down_size', 'f8'),  # 网格大小(下)(%)
+    ('up_amount', 'f8'),  # 每格资金(上)
+    ('down_amount', 'f8'),  # 每格资金(下)
+    ('init_size', 'f8'),  # 底仓买入量(份)
+    ('val_coefficient', 'f8'),  # 每格资金随网格数的增长系数(%), 第 n 网的资金为 每格资金 * (1 + 系数 / 100) ^ |n|
+])
+DEFAULT_PARAMS = dict(up_size=4, down_size=3, up_amount=10000, down_amount=10000, init_size=3, val_coefficient=0)
+
+# 成交记录, num 为正买入, 为负卖出, net 为成交后所在的网格
+TRADE_DTYPE = np.dtype([('param', 'i8'), ('bar', 'i8'), ('timestamp', 'f8'), ('price', 'f8'), ('num', 'f8'),
+                        ('net', 'i8')])
+SUMMARY_DTYPE = np.dtype([('equity', 'f8'), ('returns', 'f8'), ('max_drawdown', 'f8'), ('trades', 'i8'),
+                          ('buys', 'i8'), ('sells', 'i8'), ('cash', 'f8'), ('position', 'f8'), ('net', 'i8')])
+
+# 每根 K 线的检查顺序, 依次为 (检查的价格字段, 1 买 / -1 卖)
+_OPEN_SELL = (('open', -1),)
+_OPEN_BUY = (('open', 1),)
+# 最低价高于下网格 / 最高价低于上网格 / 收盘价低于最后一网价格 / 其它
+_ROUTES = (
+    (('high', -1), ('close', 1)),
+    (('low', 1), ('close', -1)),
+    (('high', -1), ('low', 1), ('close', -1)),
+    (('low', 1), ('high', -1), ('close', 1)),
+)
+
+
+def param_grid(**values):
+    """
+        参数组合
+    :param values: 字段名 -> 取值列表, 未给出的字段取 DEFAULT_PARAMS
+    :return: np.ndarray PARAM_DTYPE, 各字段取值的笛卡尔积
+    """
+    unknown = set(values) - set(PARAM_DTYPE.names)
+    if unknown:
+        raise ValueError('未知的网格参数: {}'.format(', '.join(sorted(unknown))))
+    axes = [np.atleast_1d(values.get(name, DEFAULT_PARAMS[name])) for name in PARAM_DTYPE.names]
+    return np.array(list(itertools.product(*axes)), dtype=PARAM_DTYPE)
+
+
+def price_ladder(init_price, params, low, high):
+    """
+        网格价格阶梯, 第 j 列为第 j - offset 网的价格
+    :param init_price: float 或 np.ndarray 每组参数的底仓价格
+    :param params: np.ndarray PARAM_DTYPE
+    :param low: high: 回测区间的最低 / 最高价, 用于确定阶梯的范围
+    :return: tuple (np.ndarray 价格, shape 为 (参数组数, 网格数), offset 第 0 网所在的列)
+    """
+    init_price = np.broadcast_to(np.asarray(init_price, dtype='f8'), params.shape)
+    up = 1 + params['up_size'] / 100
+    down = 1 + params['down_size'] / 100
+    # 价格走到区间最高 / 最低时需要的网格数, 多留一格用于计算上 / 下网格价格
+    ups = max(int(np.max(np.ceil(np.log(high / init_price) / np.log(up)))) + 2, 2)
+    downs = max(int(np.max(np.ceil(np.log(init_price / low) / np.log(down)))) + 2, 2)
+    nets = np.arange(-downs, ups + 1)
+    # 与 GridTrade._computePrice 相同的算法, 保证价格逐位一致
+    rates = np.where(nets > 0, np.power(up[:, None], np.maximum(nets, 0)),
+                     1 / np.power(down[:, None], np.maximum(-nets, 0)))
+    return init_price[:, None] * rates, downs
+
+
+class GridResult:
+    def __init__(self, params, timestamps, equity, cash, position, net, trades, capital):
+        """
+        :param params: np.ndarray PARAM_DTYPE
+        :param timestamps: np.ndarray 每根 K 线的时间戳
+        :param equity: np.ndarray (参数组数, K 线数) 每根 K 线收盘时的总资产
+        :param cash: position: net: np.ndarray 回测结束时每组参数的现金 / 持仓 / 所在网格
+        :param trades: np.ndarray TRADE_DTYPE, 按参数组、成交先后排序
+        :param capital: 初始资金
+        """
+        self.params = params
+        self.timestamps = timestamps
+        self.equity = equity
+        self.cash = cash
+        self.position = position
+        self.net = net
+        self.trades = trades
+        self.capital = capital
+
+    @property
+    def summary(self):
+        """
+        :return: np.ndarray SUMMARY_DTYPE, 每组参数一行
+        """
+        summary = np.zeros(len(self.params), dtype=SUMMARY_DTYPE)
+        if self.equity.shape[1]:
+            final = self.equity[:, -1]
+            peak = np.maximum.accumulate(self.equity, axis=1)
+            summary['max_drawdown'] = np.max((peak - self.equity) / peak, axis=1)
+        else:
+            final = np.full(len(self.params), float(self.capital))
+        summary['equity'] = final
+        summary['returns'] = final / self.capital - 1
+        param = self.trades['param']
+        summary['trades'] = np.bincount(param, minlength=len(self.params))
+        summary['buys'] = np.bincount(param[self.trades['num'] > 0], minlength=len(self.params))
+        summary['sells'] = np.bincount(param[self.trades['num'] < 0], minlength=len(self.params))
+        summary['cash'] = self.cash
+        summary['position'] = self.position
+        summary['net'] = self.net
+        return summary
+
+    def trades_of(self, i):
+        """
+        :param i: 参数组序号
+        :return: np.ndarray TRADE_DTYPE 该组参数的成交记录
+        """
+        return self.trades[self.trades['param'] == i]
+
+
+class _Grid:
+    """
+        一次回测的状态, 所有数组的第一维为参数组
+    """
+
+    def __init__(self, code, params, init_price, capital, low, high):
+        self.params = params
+        self.decimals = 3 if ensure_price(code, 0.001) else 2
+        self.ladder, self.offset = price_ladder(init_price, params, low, high)
+        self.fill_ladder = np.round(self.ladder, self.decimals)
+        self.rows = np.arange(len(params))
+        self.net = np.zeros(len(params), dtype='i8')
+        self.cash = np.full(len(params), float(capital))
+        self.position = np.zeros(len(params))
+        self.trades = []
+        self.bar = 0
+        self.timestamp = 0.0
+
+    def level(self, shift):
+        """
+        :return: np.ndarray 每组参数当前网格加 shift 的价格
+        """
+        return self.ladder[self.rows, self.net + shift + self.offset]
+
+    def init_position(self, init_price):
+        """
+            以底仓价格买入 init_size 份底仓, 见 GridTrade.init
+        """
+        init_price = np.broadcast_to(np.asarray(init_price, dtype='f8'), self.params.shape)
+        price = np.round(init_price, self.decimals)
+        num = self.params['init_size'] * (self.params['down_amount'] // init_price // 100 * 100)
+        ok = num * price <= self.cash
+        self.fill(np.flatnonzero(ok), price[ok], num[ok], 0)
+
+    def check(self, price, side, mask):
+        """
+            价格越过上 / 下网格时逐格成交, 直到价格不再越过或无法成交, 见 GridTrade.checkBuy / checkSell
+        :param price: float 检查的价格
+        :param side: 1 买入(价格不高于下网格) / -1 卖出(价格不低于上网格)
+        :param mask: np.ndarray bool 参与检查的参数组
+        """
+        rows = np.flatnonzero(mask)
+        while len(rows):
+            net = self.net[rows]
+            level = self.ladder[rows, net - side + self.offset]
+            crossed = price <= level if side > 0 else price >= level
+            rows, net, level = rows[crossed], net[crossed], level[crossed]
+            if not len(rows):
+                return
+            fill_price = self.fill_ladder[rows, net - side + self.offset]
+            params = self.params[rows]
+            if side > 0:
+                amount = np.where(net > 0, params['up_amount'], params['down_amount'])
+            else:
+                amount = -np.where(net >= 0, params['up_amount'], params['down_amount'])
+            amount = amount * np.power(1 + params['val_coefficient'] / 100, np.abs(net))
+            # 与 GridTrade.calcBuyNum 一致, 数量按未取整的网格价格计算, 成交价为取整后的价格
+            num = amount // level // 100 * 100
+            if side > 0:
+                ok = num * fill_price <= self.cash[rows]
+            else:
+                ok = -num <= self.position[rows]
+            rows = rows[ok]
+            self.fill(rows, fill_price[ok], num[ok], -side)
+
+    def fill(self, rows, price, num, step):
+        if not len(rows):
+            return
+        self.cash[rows] -= price * num
+        self.position[rows] += num
+        self.net[rows] += step
+        trades = np.zeros(len(rows), dtype=TRADE_DTYPE)
+        trades['param'] = rows
+        trades['bar'] = self.bar
+        trades['timestamp'] = self.timestamp
+        trades['price'] = price
+        trades['num'] = num
+        trades['net'] = self.net[rows]
+        self.trades.append(trades)
+
+    def run_route(self, bar, route, mask):
+        for field, side in route:
+            if mask.any():
+                self.check(float(bar[field]), side, mask)
+
+    def update(self, bar):
+        """
+            一根 K 线, 见 GridTrade.update
+        """
+        sell = bar['open'] >= self.level(1)
+        self.run_route(bar, _OPEN_SELL, sell)
+        self.run_route(bar, _OPEN_BUY, ~sell & (bar['open'] <= self.level(-1)))
+
+        above = bar['low'] > self.level(-1)
+        below = ~above & (bar['high'] < self.level(1))
+        falling = ~above & ~below & (bar['close'] < self.level(0))
+        rising = ~above & ~below & ~falling
+        for route, mask in zip(_ROUTES, (above, below, falling, rising)):
+            self.run_route(bar, route, mask)
+
+
+def backtest(code, bars, params, capital=100000, init_price=None):
+    """
+        对多组网格参数同时回测
+    :param code: 股票代码, 决定成交价格的精度
+    :param bars: np.ndarray quotation.barstore.BAR_DTYPE, 按时间升序
+    :param params: np.ndarray PARAM_DTYPE, 见 param_grid
+    :param capital: 初始资金
+    :param init_price: 底仓价格, float 或每组参数一个, 缺省为第一根 K 线的开盘价
+    :return: GridResult
+    """
+    params = np.atleast_1d(np.asarray(params, dtype=PARAM_DTYPE))
+    equity = np.zeros((len(params), len(bars)))
+    if not len(bars):
+        empty = np.zeros(len(params))
+        return GridResult(params, np.zeros(0), equity, empty + capital, empty, empty.astype('i8'),
+                          np.zeros(0, dtype=TRADE_DTYPE), capital)
+    if init_price is None:
+        init_price = float(bars['open'][0])
+    grid = _Grid(code, params, init_price, capital, float(np.min(bars['low'])), float(np.max(bars['high'])))
+    grid.timestamp = float(bars['timestamp'][0])
+    grid.init_position(init_price)
+    for i, bar in enumerate(bars):
+        grid.bar, grid.timestamp = i, float(bar['timestamp'])
+        grid.update(bar)
+        equity[:, i] = grid.cash + grid.position * bar['close']
+
+    trades = np.concatenate(grid.trades) if grid.trades else np.zeros(0, dtype=TRADE_DTYPE)
+    trades = trades[np.argsort(trades['param'], kind='stable')]
+    return GridResult(params, bars['timestamp'].copy(), equity, grid.cash, grid.position, grid.net, trades, capital)
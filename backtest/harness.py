@@ -0,0 +1,162 @@
+"""
+    事件驱动回测
+    以与实盘相同的方式运行未经修改的 StrategyTemplate 策略:
+        时钟引擎使用 SteppedTime, 每个行情时间点先推进时钟并触发到期的时钟事件, 再推送行情
+        事件引擎为同步的 SyncEventEngine, 不等待线程调度, 回测速度只受 CPU 限制
+        策略事件的注册与 MainEngine 相同, 声明了 symbols / clocks 的策略只收到所关注的行情和时钟事件
+        策略的 user 缺省为 trade.PaperTrader, 按回放的行情撮合
+
+    >>> engine = BacktestEngine(capital=100000)                                # doctest: +SKIP
+    >>> engine.add_strategy('网格交易策略')                                     # doctest: +SKIP
+    >>> result = engine.run([bar_feed('150176', store.load('150176'))])        # doctest: +SKIP
+    >>> result.summary                                                          # doctest: +SKIP
+"""
+import importlib
+import logging
+import os
+import tempfile
+
+import numpy as np
+
+from engine.clock_engine import ClockEngine
+from engine.event_engine import SyncEventEngine
+from engine.flashback_engine import merge_feeds
+from engine.quotation_engine import QuotationEngine
+from engine.time_source import SteppedTime
+from main_engine import MainEngine
+from trade.papertrader import PaperTrader
+
+
+class ReplayQuotationEngine(QuotationEngine):
+    """
+        回放行情引擎, 不请求行情源, 由 BacktestEngine 调用 publish 推送回放的行情
+    """
+
+    def __init__(self, event_engine, clock_engine, event_type=QuotationEngine.EventType):
+        self.EventType = event_type
+        # 策略订阅的股票, 只做记录, 回放的股票由数据源决定
+        self._subscribed = set()
+        super().__init__(event_engine, clock_engine)
+
+    def create_quotation(self, source):
+        return None
+
+    def subscribe(self, codes):
+        self._subscribed.update(codes if type(codes) is list else [codes])
+
+    def unsubscribe(self, codes):
+        self._subscribed.difference_update(codes if type(codes) is list else [codes])
+
+    @property
+    def subscribed(self):
+        return self._subscribed
+
+    def start(self):
+        pass
+
+
+class BacktestResult:
+    def __init__(self, timestamps, equity, deals, capital):
+        """
+        :param timestamps: np.ndarray 每个回放时间点
+        :param equity: np.ndarray 每个时间点推送行情后的总资产
+        :param deals: list 成交记录
+        :param capital: 初始资金
+        """
+        self.timestamps = timestamps
+        self.equity = equity
+        self.deals = deals
+        self.capital = capital
+
+    @property
+    def summary(self):
+        """
+        :return: dict 期末总资产、收益率、最大回撤、成交次数
+        """
+        final = float(self.equity[-1]) if len(self.equity) else float(self.capital)
+        max_drawdown = 0.0
+        if len(self.equity):
+            peak = np.maximum.accumulate(self.equity)
+            max_drawdown = float(np.max((peak - self.equity) / peak))
+        return dict(equity=final, returns=final / self.capital - 1, max_drawdown=max_drawdown,
+                    trades=len(self.deals))
+
+
+class BacktestEngine:
+    """
+        回测主引擎, 提供策略所需的 MainEngine 接口
+    """
+    strategy_listen_event = MainEngine.strategy_listen_event
+    get_strategy = MainEngine.get_strategy
+    get_quotation = MainEngine.get_quotation
+
+    def __init__(self, capital=100000, user=None, tzinfo=None, start=None, quotation_event_types=('quotation',),
+                 state_dir=None):
+        """
+        :param capital: 初始资金, 只在使用缺省的模拟账户时有效
+        :param user: 交易接口, 缺省为 PaperTrader, 需要提供 on_quotation(data, timestamp)、get_balance 和 deals
+        :param tzinfo: 时区, 缺省为当地时区
+        :param start: float 回测开始的时间戳, 缺省为第一条行情的时间
+        :param quotation_event_types: 行情引擎的事件类型, 每个类型一个 ReplayQuotationEngine
+        :param state_dir: 策略临时状态文件 tmp_file_path 的目录, 缺省为本次回测新建的临时目录,
+            回测不读取也不覆盖实盘保存的策略状态
+        """
+        self.log = logging.getLogger('BacktestEngine')
+        self.capital = capital
+        self.user = user if user is not None else PaperTrader(capital, tzinfo=tzinfo)
+        self.event_engine = SyncEventEngine()
+        self.start = start
+        self.clock_engine = ClockEngine(self.event_engine, tzinfo, SteppedTime(start or 0))
+        self.quotation_engines = [ReplayQuotationEngine(self.event_engine, self.clock_engine, event_type)
+                                  for event_type in quotation_event_types]
+        self.strategy_list = list()
+        if state_dir is None:
+            self._state_dir = tempfile.TemporaryDirectory(prefix='backtest-')
+            state_dir = self._state_dir.name
+        self.state_dir = state_dir
+
+    def add_strategy(self, strategy):
+        """
+        :param strategy: 策略类, 或 strategies 目录下的模块名
+        :return: 策略实例
+        """
+        if isinstance(strategy, str):
+            strategy = importlib.import_module('.' + strategy, 'strategies').Strategy
+        if hasattr(strategy, 'tmp_file_path'):
+            # 状态文件在 initialize 中读取, 需要在创建实例前替换路径
+            tmp_file_path = os.path.join(self.state_dir, os.path.basename(strategy.tmp_file_path))
+            strategy = type(strategy.__name__, (strategy,), dict(tmp_file_path=tmp_file_path))
+        instance = strategy(user=self.user, log_handler=self.log, main_engine=self)
+        self.strategy_list.append(instance)
+        self.strategy_listen_event(instance, 'listen')
+        return instance
+
+    def run(self, feeds, end=None):
+        """
+            回放行情直到数据源结束
+        :param feeds: list 数据源, 见 engine.flashback_engine.merge_feeds
+        :param end: float 回放结束后时钟继续推进到该时间戳, 用于触发最后的收盘等时钟事件
+        :return: BacktestResult
+        """
+        timestamps = []
+        equity = []
+        for timestamp, data in merge_feeds(feeds):
+            if self.start is None:
+                # 从第一条行情的时间开始, 不补发此前的时钟事件
+                self.start = timestamp
+                self.clock_engine.time_source.set(timestamp)
+                self.clock_engine.reset()
+            self.clock_engine.step_to(timestamp)
+            self.user.on_quotation(data, timestamp)
+            for quotation_engine in self.quotation_engines:
+                quotation_engine.publish(data, timestamp)
+            timestamps.append(timestamp)
+            equity.append(self.user.get_balance()[0].asset_balance)
+        if end is not None:
+            self.clock_engine.step_to(end)
+        return BacktestResult(np.array(timestamps), np.array(equity), list(self.user.deals), self.capital)
+
+    def shutdown(self):
+        """调用各策略的 shutdown"""
+        for strategy in self.strategy_list:
+            strategy.shutdown()
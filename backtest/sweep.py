@@ -0,0 +1,204 @@
+"""
+    网格参数批量回测
+    按 股票 x 参数组合 拆分为任务, 在进程池中执行 backtest.grid.backtest
+        K 线从 BarStore 以 mmap 只读方式加载, 各进程共享操作系统的页缓存, 不复制数据
+        每个任务完成后立即把结果追加写入 csv, 中断后重新运行同一个结果文件时跳过已完成的 股票 + 参数
+        每行结果记录回测的初始资金和 K 线时间范围, 续跑时与结果文件中的设置不一致则报错, 不混写不同设置的结果
+    >>> space = {'upSize': [3, 5, 7], 'downSize': [3, 5, 7], 'valCoefficient': [0, 15], 'upVal': [10000]}
+    >>> sweep = Sweep('bars', ['150176', '601717'], space, 'sweep.csv')       # doctest: +SKIP
+    >>> table = sweep.run()                                                    # doctest: +SKIP
+    >>> top(table, 'returns', 10)                                              # doctest: +SKIP
+"""
+import csv
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from backtest.grid import PARAM_DTYPE, SUMMARY_DTYPE, backtest, param_grid
+from quotation.barstore import BarStore
+
+# 网格交易策略.json 中的字段 -> 网格参数
+CONFIG_FIELDS = {
+    'upSize': 'up_size',
+    'downSize': 'down_size',
+    'upVal': 'up_amount',
+    'downVal': 'down_amount',
+    'valCoefficient': 'val_coefficient',
+    'initHoldPosition': 'init_size',
+}
+# 回测设置, 未设置的时间范围记为 nan
+SETTING_DTYPE = np.dtype([('capital', 'f8'), ('start', 'f8'), ('end', 'f8')])
+RESULT_DTYPE = np.dtype([('code', 'U16')] + SETTING_DTYPE.descr + PARAM_DTYPE.descr + SUMMARY_DTYPE.descr)
+
+log = logging.getLogger('sweep')
+
+
+def param_space(space):
+    """
+    :param space: dict 参数名 -> 取值列表, 参数名可以是 PARAM_DTYPE 字段或 网格交易策略.json 中的字段
+    :return: np.ndarray PARAM_DTYPE, 各参数取值的笛卡尔积
+    """
+    return param_grid(**{CONFIG_FIELDS.get(name, name): values for name, values in space.items()})
+
+
+def load_results(path):
+    """
+        读取结果文件, 忽略中断时写了一半的行
+    :return: np.ndarray RESULT_DTYPE
+    """
+    if not os.path.exists(path):
+        return np.zeros(0, dtype=RESULT_DTYPE)
+    rows = []
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is not None and tuple(header) != RESULT_DTYPE.names:
+            raise ValueError('{} 的表头与当前版本的结果字段不一致'.format(path))
+        for row in reader:
+            if len(row) != len(RESULT_DTYPE.names):
+                continue
+            try:
+                rows.append((row[0],) + tuple(float(value) for value in row[1:]))
+            except ValueError:
+                continue
+    return np.array(rows, dtype=RESULT_DTYPE)
+
+
+def top(table, key='returns', n=None, ascending=False):
+    """
+    :param table: np.ndarray RESULT_DTYPE
+    :param key: 排序字段
+    :param n: 返回前 n 行, 缺省全部
+    :param ascending: 是否升序
+    :return: np.ndarray RESULT_DTYPE
+    """
+    order = np.argsort(table[key], kind='stable')
+    if not ascending:
+        order = order[::-1]
+    return table[order[:n]]
+
+
+def settings_of(capital, start=None, end=None):
+    """
+    :return: tuple SETTING_DTYPE 各字段的值
+    """
+    return tuple(np.nan if value is None else float(value) for value in (capital, start, end))
+
+
+def run_task(root, code, params, capital, start=None, end=None):
+    """
+        在子进程中执行的单个任务
+    :return: np.ndarray RESULT_DTYPE
+    """
+    bars = BarStore(root).load(code, start, end)
+    summary = backtest(code, bars, params, capital).summary
+    rows = np.zeros(len(params), dtype=RESULT_DTYPE)
+    rows['code'] = code
+    for name, value in zip(SETTING_DTYPE.names, settings_of(capital, start, end)):
+        rows[name] = value
+    for name in PARAM_DTYPE.names:
+        rows[name] = params[name]
+    for name in SUMMARY_DTYPE.names:
+        rows[name] = summary[name]
+    return rows
+
+
+class Sweep:
+    def __init__(self, root, codes, space, path, capital=100000, start=None, end=None, chunk_size=256,
+                 max_workers=None):
+        """
+        :param root: BarStore 目录
+        :param codes: list 股票代码
+        :param space: dict 参数空间, 见 param_space; 或 np.ndarray PARAM_DTYPE
+        :param path: 结果文件, csv
+        :param capital: 每次回测的初始资金
+        :param start: end: K 线时间范围, 见 BarStore.load
+        :param chunk_size: 每个任务包含的参数组合数, 同一任务内的参数一次向量化回测
+        :param max_workers: 进程数, 缺省为 CPU 核数
+        """
+        self.root = root
+        self.codes = list(codes)
+        self.params = space if isinstance(space, np.ndarray) else param_space(space)
+        self.path = path
+        self.capital = capital
+        self.start = start
+        self.end = end
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+
+    def tasks(self):
+        """
+            未完成的任务, 已写入结果文件的 股票 + 参数 不再回测
+        :return: list (股票代码, np.ndarray PARAM_DTYPE)
+        :raise ValueError: 结果文件中有初始资金或时间范围与当前设置不同的结果
+        """
+        results = load_results(self.path)
+        settings = settings_of(self.capital, self.start, self.end)
+        for name, value in zip(SETTING_DTYPE.names, settings):
+            column = results[name]
+            same = column == value if value == value else np.isnan(column)
+            if not same.all():
+                raise ValueError('{} 中已有 {}={} 的结果, 与当前设置 {} 不一致, 请使用新的结果文件'.format(
+                    self.path, name, column[~same][0], value))
+        done = {(row['code'],) + tuple(row[name] for name in PARAM_DTYPE.names) for row in results}
+        keys = [tuple(param) for param in self.params.tolist()]
+        tasks = []
+        for code in self.codes:
+            pending = self.params[[(code,) + key not in done for key in keys]]
+            for i in range(0, len(pending), self.chunk_size):
+                tasks.append((code, pending[i:i + self.chunk_size]))
+        return tasks
+
+    def run(self, callback=None):
+        """
+        :param callback: 每个任务完成时调用 callback(rows, finished, total)
+        :return: np.ndarray RESULT_DTYPE 结果文件中的全部结果
+        """
+        tasks = self.tasks()
+        total = len(tasks)
+        log.info('共 {} 个任务待回测, 结果写入 {}'.format(total, self.path))
+        if tasks:
+            _truncate_partial(self.path)
+            new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+            with open(self.path, 'a', newline='', encoding='utf-8') as f, \
+                    ProcessPoolExecutor(self.max_workers) as executor:
+                writer = csv.writer(f)
+                if new_file:
+                    writer.writerow(RESULT_DTYPE.names)
+                futures = [executor.submit(run_task, self.root, code, params, self.capital, self.start, self.end)
+                           for code, params in tasks]
+                try:
+                    for finished, future in enumerate(as_completed(futures), 1):
+                        rows = future.result()
+                        writer.writerows(rows.tolist())
+                        f.flush()
+                        if callback is not None:
+                            callback(rows, finished, total)
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+        return load_results(self.path)
+
+
+def _truncate_partial(path):
+    """
+        去掉中断时写了一半的最后一行, 避免续写的结果接在这一行后面
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb+') as f:
+        size = f.seek(0, os.SEEK_END)
+        end = size
+        while end > 0:
+            start = max(end - 4096, 0)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b'\n')
+            if newline >= 0:
+                end = start + newline + 1
+                break
+            end = start
+        if end != size:
+            f.truncate(end)
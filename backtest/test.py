@@ -0,0 +1,295 @@
+import datetime
+import logging
+import os
+import tempfile
+import time
+import unittest
+
+import numpy as np
+from dateutil import tz
+
+from engine.flashback_engine import bar_feed
+from quotation.barstore import BAR_DTYPE, BarStore
+from trade.basictrader import TradeError
+from trade.papertrader import PaperTrader
+from utils.strategyTemplate import StrategyTemplate
+from .grid import backtest, param_grid
+from .harness import BacktestEngine
+from .sweep import Sweep, load_results, top
+
+
+def random_bars(size, seed=0, price=10.0):
+    """
+        随机游走的日 K 线
+    :return: np.ndarray BAR_DTYPE
+    """
+    rng = np.random.RandomState(seed)
+    close = price * np.exp(np.cumsum(rng.normal(0, 0.02, size)))
+    open_ = np.concatenate(([price], close[:-1])) * np.exp(rng.normal(0, 0.005, size))
+    bars = np.zeros(size, dtype=BAR_DTYPE)
+    bars['timestamp'] = 1451606400 + np.arange(size) * 86400
+    bars['open'] = open_
+    bars['close'] = close
+    bars['high'] = np.maximum(open_, close) * np.exp(np.abs(rng.normal(0, 0.01, size)))
+    bars['low'] = np.minimum(open_, close) * np.exp(-np.abs(rng.normal(0, 0.01, size)))
+    bars['volume'] = 1e6
+    return bars
+
+
+def reference_trades(code, bars, param, capital):
+    """
+        逐根 K 线用 GridTrade 回测, 返回成交的 (价格, 数量)
+    """
+    import gridtradetest
+
+    logging.getLogger('GridTrade').setLevel(logging.WARNING)
+    grid = gridtradetest.GridTrade(code, None, None, capital)
+    grid.upNetSize, grid.downNetSize = param['up_size'], param['down_size']
+    grid.upNetAmount, grid.downNetAmount = param['up_amount'], param['down_amount']
+    grid.initSize = param['init_size']
+    trades = []
+    order = grid.order
+
+    def record(o):
+        ok = order(o)
+        if ok:
+            trades.append((o['price'], o['num']))
+        return ok
+
+    grid.order = record
+    for i, bar in enumerate(bars):
+        k = {field: float(bar[field]) for field in ('open', 'high', 'low', 'close')}
+        if i == 0:
+            grid.init(k)
+        grid.update(k)
+    return trades
+
+
+class GridBacktestTest(unittest.TestCase):
+    def test_matches_gridtrade(self):
+        # 低价时网格价格取整前后计算的数量不同
+        for seed, price in ((0, 10.0), (3, 0.8)):
+            bars = random_bars(250, seed=seed, price=price)
+            params = param_grid(up_size=[2, 4], down_size=[3, 5], up_amount=[5000, 10000], down_amount=[3000, 7000])
+            # 资金充足时 GridTrade 的现金口径不影响成交
+            result = backtest('601717', bars, params, capital=1e9)
+            for i, param in enumerate(params):
+                expected = reference_trades('601717', bars, param, 1e9)
+                trades = result.trades_of(i)
+                self.assertEqual(list(zip(trades['price'], trades['num'])), expected)
+
+    def test_cash_and_summary(self):
+        bars = random_bars(120, seed=1)
+        result = backtest('601717', bars, param_grid(init_size=[3, 50]), capital=50000)
+        summary = result.summary
+        self.assertTrue(np.all(result.cash >= 0))
+        # 底仓超过资金时不买入
+        self.assertEqual(summary['position'][1], result.trades_of(1)['num'].sum())
+        self.assertNotIn(50 * (10000 // bars['open'][0] // 100 * 100), result.trades_of(1)['num'])
+        np.testing.assert_allclose(summary['equity'], result.cash + result.position * bars['close'][-1])
+        self.assertEqual(result.equity.shape, (2, 120))
+
+
+class SweepTest(unittest.TestCase):
+    def test_resume(self):
+        with tempfile.TemporaryDirectory() as root:
+            store = BarStore(root)
+            store.save('150176', random_bars(60, seed=2, price=0.8))
+            store.save('601717', random_bars(60, seed=3))
+            path = os.path.join(root, 'sweep.csv')
+            space = {'upSize': [3, 5, 7], 'downSize': [3, 7], 'valCoefficient': [0, 15]}
+            table = Sweep(root, ['150176', '601717'], space, path, chunk_size=5, max_workers=2).run()
+            self.assertEqual(len(table), 24)
+
+            # 模拟中断: 只保留前 10 行, 最后一行写了一半
+            with open(path, encoding='utf-8') as f:
+                lines = f.readlines()
+            with open(path, 'w', encoding='utf-8') as f:
+                f.writelines(lines[:11])
+                f.write(lines[11][:10])
+            sweep = Sweep(root, ['150176', '601717'], space, path, chunk_size=5, max_workers=2)
+            self.assertEqual(sum(len(params) for _, params in sweep.tasks()), 14)
+            resumed = sweep.run()
+            self.assertEqual(len(resumed), 24)
+            self.assertEqual(len(load_results(path)), 24)
+            self.assertEqual(top(resumed, 'returns', 1)['returns'][0], table['returns'].max())
+
+            # 初始资金或时间范围不同的回测不能续写到同一个结果文件
+            with self.assertRaises(ValueError):
+                Sweep(root, ['150176'], space, path, capital=50000).tasks()
+            with self.assertRaises(ValueError):
+                Sweep(root, ['150176'], space, path, start=1451606400 + 86400 * 10).run()
+            self.assertEqual(len(load_results(path)), 24)
+
+
+class AlternateStrategy(StrategyTemplate):
+    """
+        空仓时买入, 持仓时卖出
+    """
+    name = 'alternate'
+    symbols = ['601717']
+    clocks = ['open']
+
+    def initialize(self):
+        self.opens = 0
+
+    def strategy(self, event):
+        quotation = event.data['601717']
+        position = self.user.get_position('601717')
+        if position is None:
+            self.user.buy('601717', quotation['now'], amount=100)
+        else:
+            self.user.sell('601717', quotation['now'], amount=position.enable_amount)
+
+    def clock(self, event):
+        self.opens += event.data.clock_event == 'open'
+
+
+class HarnessTest(unittest.TestCase):
+    def trading_bars(self, size, seed=4, price=10.0):
+        """
+            2016-12-05 起每个交易日 14:55 的 K 线
+        """
+        tzinfo = tz.gettz('Asia/Shanghai')
+        days = [datetime.datetime(2016, 12, 5, 14, 55, tzinfo=tzinfo) + datetime.timedelta(days=i)
+                for i in range(size * 2)]
+        bars = random_bars(size, seed, price)
+        bars['timestamp'] = [day.timestamp() for day in days if day.weekday() < 5][:size]
+        return bars
+
+    def test_strategy_template(self):
+        bars = self.trading_bars(10)
+        engine = BacktestEngine(capital=10000, tzinfo=tz.gettz('Asia/Shanghai'))
+        strategy = engine.add_strategy(AlternateStrategy)
+        self.assertIs(engine.get_strategy('alternate'), strategy)
+        result = engine.run([bar_feed('601717', bars), bar_feed('150176', self.trading_bars(10, 5, 0.8))])
+        # 从第一根 K 线的收盘前开始, 开盘事件当天补发一次, 之后每个交易日一次
+        self.assertEqual(strategy.opens, 10)
+        self.assertEqual(len(result.deals), 10)
+        self.assertEqual({deal['stock_code'] for deal in result.deals}, {'601717'})
+        # 最后一笔为卖出, 期末空仓
+        pnl = sum(deal['business_balance'] * (1 if deal['entrust_bs'] == '卖出' else -1) - deal['fee']
+                  for deal in result.deals)
+        self.assertAlmostEqual(result.summary['equity'], 10000 + pnl)
+        np.testing.assert_array_equal(result.timestamps, bars['timestamp'])
+
+    def test_grid_strategy(self):
+        bars = self.trading_bars(3, price=0.805)
+        bars['close'] = [0.80, 0.74, 0.70]
+        engine = BacktestEngine(tzinfo=tz.gettz('Asia/Shanghai'))
+        strategy = engine.add_strategy('网格交易策略')
+        engine.run([bar_feed('150176', bars)])
+        self.assertEqual(strategy.g.stocks['150176']['lastNet'], -2)
+
+    def test_strategy_state_dir(self):
+        bars = self.trading_bars(3, price=0.805)
+        bars['close'] = [0.80, 0.74, 0.70]
+        with tempfile.TemporaryDirectory() as state_dir:
+            engine = BacktestEngine(tzinfo=tz.gettz('Asia/Shanghai'), state_dir=state_dir)
+            strategy = engine.add_strategy('网格交易策略')
+            live_path = type(strategy).__bases__[0].tmp_file_path
+            self.assertEqual(strategy.tmp_file_path, os.path.join(state_dir, os.path.basename(live_path)))
+            engine.run([bar_feed('150176', bars)])
+            engine.shutdown()
+            self.assertTrue(os.path.exists(strategy.tmp_file_path))
+            self.assertFalse(os.path.exists(live_path))
+
+
+class PaperTraderTest(unittest.TestCase):
+    def quotation(self, now, asks=(), bids=()):
+        quotation = {'now': now, 'name': '测试'}
+        for side, levels in (('ask', asks), ('bid', bids)):
+            for level, (price, volume) in enumerate(levels, 1):
+                quotation['%s%d' % (side, level)] = price
+                quotation['%s%d_volume' % (side, level)] = volume
+        return {'601717': quotation}
+
+    def test_match_book(self):
+        tzinfo = tz.gettz('Asia/Shanghai')
+        day = datetime.datetime(2016, 12, 5, 10, tzinfo=tzinfo).timestamp()
+        user = PaperTrader(100000, commission=0.001, min_commission=5, tzinfo=tzinfo)
+        user.on_quotation(self.quotation(10.0, asks=[(10.0, 300), (10.01, 500), (10.05, 1000)]), day)
+        first = user.buy('601717', 10.01, amount=650)
+        self.assertEqual(first['entrust_status'], '已成')
+        self.assertEqual(first['entrust_amount'], 600)
+        self.assertEqual([(deal['business_price'], deal['business_amount']) for deal in user.current_deal],
+                         [(10.0, 300), (10.01, 300)])
+        # 同一笔行情内卖二只剩 200
+        second = user.buy('601717', 10.01, amount=500)
+        self.assertEqual((second['entrust_status'], second['business_amount']), ('部成', 200))
+        self.assertLess(user.get_balance()[0].enable_balance, user.cash)
+
+        user.on_quotation(self.quotation(10.0, asks=[(10.01, 100)]), day + 60)
+        self.assertEqual(second['business_amount'], 300)
+        self.assertTrue(user.cancel_entrust(second['entrust_no'], '601717'))
+        self.assertEqual(user.frozen, 0)
+        self.assertRaises(TradeError, user.cancel_entrust, second['entrust_no'], '601717')
+
+        position = user.get_position('601717')
+        self.assertEqual((position.current_amount, position.enable_amount), (900, 0))
+        fees = sum(deal['fee'] for deal in user.current_deal)
+        self.assertAlmostEqual(user.cash, 100000 - 300 * 10.0 - 600 * 10.01 - fees)
+        # 当日买入不能卖出
+        self.assertRaises(TradeError, user.sell, '601717', 9.9, amount=100)
+
+        user.on_quotation(self.quotation(10.2, bids=[(10.2, 1000)]), day + 86400)
+        self.assertEqual(user.get_position('601717').enable_amount, 900)
+        self.assertEqual(user.current_deal, [])
+        sell = user.sell('601717', 10.2, amount=900)
+        self.assertEqual(sell['entrust_status'], '已成')
+        self.assertIsNone(user.get_position('601717'))
+        self.assertAlmostEqual(user.current_deal[0]['fee'], 10.2 * 900 * 0.002)
+
+    def test_commission_per_entrust(self):
+        # 分 5 档成交只收一次最低佣金, 资金刚好够时不会透支
+        user = PaperTrader(505)
+        user.on_quotation(self.quotation(1.0, asks=[(1.0, 100)] * 5))
+        entrust = user.buy('601717', 1.0, amount=500)
+        self.assertEqual(entrust['entrust_status'], '已成')
+        self.assertEqual([deal['fee'] for deal in user.current_deal], [5, 0, 0, 0, 0])
+        self.assertAlmostEqual(user.cash, 0)
+        self.assertAlmostEqual(user.get_balance()[0].enable_balance, 0)
+        self.assertAlmostEqual(user.frozen, 0)
+
+        # 加滑点后取整到 1.01, 按取整后的价格冻结
+        self.assertRaises(TradeError, PaperTrader(509, slippage=0.006).buy, '601717', 1.0, amount=500)
+        user = PaperTrader(510, slippage=0.006)
+        user.on_quotation(self.quotation(1.0, asks=[(1.0, 100)] * 5))
+        user.buy('601717', 1.0, amount=500)
+        self.assertAlmostEqual(user.cash, 0)
+        self.assertGreaterEqual(user.cash, 0)
+
+
+def benchmark(size=250, combinations=1000):
+    """
+        python -m backtest.test
+    """
+    bars = random_bars(size)
+    params = param_grid(up_size=np.linspace(1, 10, 10), down_size=np.linspace(1, 10, 10),
+                        up_amount=np.linspace(5000, 50000, combinations // 100))
+    start = time.time()
+    backtest('601717', bars, params)
+    batched = time.time() - start
+    start = time.time()
+    for param in params[:20]:
+        reference_trades('601717', bars, param, 1e9)
+    single = (time.time() - start) / 20
+    print('{}根K线 {}组参数: 批量 {:.3f}s, GridTrade 逐组约 {:.3f}s'.format(size, len(params), batched,
+                                                                      single * len(params)))
+
+    user = PaperTrader(1e9)
+    book = PaperTraderTest().quotation(10.0, asks=[(10.0 + i / 100, 1e6) for i in range(5)],
+                                       bids=[(10.0 - i / 100, 1e6) for i in range(5)])
+    user.on_quotation(book)
+    start = time.time()
+    for i in range(10000):
+        entrust = user.buy('601717', 9.99 + i % 3 / 100, amount=100)
+        if entrust['entrust_status'] != '已成':
+            user.cancel_entrust(entrust['entrust_no'], '601717')
+        if i % 100 == 0:
+            user.on_quotation(book)
+    print('PaperTrader 每秒 {:.0f} 笔委托'.format(10000 / (time.time() - start)))
+
+
+if __name__ == '__main__':
+    benchmark()
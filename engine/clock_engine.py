@@ -1,17 +1,21 @@
 # coding: utf-8
 import datetime
-from collections import deque
-from threading import Thread
+import heapq
+import itertools
+from collections import defaultdict
+from threading import Thread, Lock, Event as ThreadEvent
 
 import arrow
 from dateutil import tz
 
-import time
 import utils.timeutil as etime
 from .event_engine import Event
+from .time_source import WallTime, SIMULATED, STEPPED
 
 
 class Clock:
+    __slots__ = ('trading_state', 'clock_event')
+
     def __init__(self, trading_state, clock_event):
         """
         :param trading_state: 是否交易时间
@@ -37,12 +41,21 @@ class ClockIntervalHandler:
         self.second = int(interval * 60)
         self.trading = trading
         self.call = call or (lambda: None)
+        # 调度器中的序号, 用于识别已失效的堆元素
+        self.seq = None
+        self.cancelled = False
 
     def is_active(self):
         if self.trading:
             if not self.clock_engine.trading_state:
                 return False
-        return int(self.clock_engine.now) % self.second == 0
+        return True
+
+    def next_deadline(self, now):
+        """
+        :return: float now 之后第一个整 interval 的时间戳
+        """
+        return (int(now) // self.second + 1) * self.second
 
     def __eq__(self, other):
         if isinstance(other, ClockIntervalHandler):
@@ -74,6 +87,15 @@ class ClockMomentHandler:
         self.is_trading_date = is_trading_date
         self.makeup = makeup
         self.call = call or (lambda: None)
+        self.seq = None
+        self.cancelled = False
+        self.reset()
+
+    def reset(self):
+        """
+        按时钟引擎当前时间重新计算下次触发时间
+        :return:
+        """
         self.next_time = datetime.datetime.combine(
             self.clock_engine.now_dt.date(),
             self.moment,
@@ -82,6 +104,17 @@ class ClockMomentHandler:
         if not self.makeup and self.is_active():
             self.update_next_time()
 
+    def skip(self):
+        """
+        已过触发时间但当天不是交易日时, 顺延到下一个交易日
+        :return:
+        """
+        if self.is_trading_date and self.next_time <= self.clock_engine.now_dt:
+            self.next_time = datetime.datetime.combine(
+                etime.get_next_trade_date(self.clock_engine.now_dt),
+                self.moment
+            )
+
     def update_next_time(self):
         """
         下次触发时间
@@ -104,6 +137,9 @@ class ClockMomentHandler:
             return False
         return self.next_time <= self.clock_engine.now_dt
 
+    def next_deadline(self, now):
+        return self.next_time.timestamp()
+
 
 class ClockEngine:
     """
@@ -115,22 +151,34 @@ class ClockEngine:
     # 系统缺省的时间间隔事件时间
     DEFAULT_INTERVAL_CLOCK_TIMES = (0.5, 1, 5, 15, 30, 60)
 
-    def __init__(self, event_engine, tzinfo=None):
+    def __init__(self, event_engine, tzinfo=None, time_source=None):
         """
         :param event_engine:
         :param tzinfo:
+        :param time_source: 时间源, 见 engine.time_source, 缺省为系统时间 WallTime
         :return:
         """
         # 默认使用当地时间的时区
         self.tzinfo = tzinfo or tz.tzlocal()
+        self.time_source = time_source or WallTime()
 
         self.event_engine = event_engine
         self.is_active = True
         self.clock_engine_thread = Thread(target=self.clock_tick, name="ClockEngine.%s" % self.EventType)
         self.sleep_time = 1
-        self.trading_state = True if (etime.is_tradetime(datetime.datetime.now()) and etime.is_trade_date(datetime.date.today())) else False
-        self.clock_moment_handlers = deque()
+        self.trading_state = False
+        self.clock_moment_handlers = []
         self.clock_interval_handlers = set()
+        # 定时器最小堆 (到期时间, 序号, 处理器), 处理器重新调度后旧元素按序号惰性丢弃
+        self.__timers = []
+        self.__seq = itertools.count()
+        self.__lock = Lock()
+        self.__wakeup = ThreadEvent()
+        # 只在交易时间触发的间隔处理器, 非交易时间不进入堆, 开盘时重新调度
+        self.__parked = []
+        # 时钟事件类型 -> 按类型注册的处理函数
+        self._clock_handlers = defaultdict(set)
+        self.set_trading_state(etime.is_tradetime(self.now_dt) and etime.is_trade_date(self.now_dt))
         self._init_clock_handler()
 
     def _init_clock_handler(self):
@@ -141,11 +189,11 @@ class ClockEngine:
 
         # 开盘事件
         def _open():
-            self.trading_state = True
+            self.set_trading_state(True)
 
         # 收盘事件
         def close():
-            self.trading_state = False
+            self.set_trading_state(False)
 
         # TODO 处理固定值 9 11:30 等
         self._register_moment('open', datetime.time(9, tzinfo=self.tzinfo), makeup=True, call=_open)
@@ -168,7 +216,7 @@ class ClockEngine:
         now 时间戳统一接口
         :return:
         """
-        return time.time()
+        return self.time_source.now()
 
     @property
     def now_dt(self):
@@ -181,40 +229,207 @@ class ClockEngine:
         self.clock_engine_thread.start()
 
     def clock_tick(self):
+        if self.time_source.mode == STEPPED:
+            # 步进时间由推进方调用 step_to
+            return
         while self.is_active:
             self.handle()
-            time.sleep(self.sleep_time)
+            self.wait()
 
-    def handle(self):
-        if not etime.is_trade_date(self.now_dt):
-            pass  # 假日暂停时钟引擎
-        else:
-            self._handle()
+    def wait(self):
+        """
+        等待到下一个到期时间, 模拟时间直接跳过去; 系统时间下有新的定时器注册时提前唤醒
+        :return:
+        """
+        self.__wakeup.clear()
+        timeout = self.next_deadline() - self.now
+        if self.time_source.mode == SIMULATED:
+            self.time_source.sleep(timeout)
+        elif timeout > 0:
+            self.__wakeup.wait(timeout)
+
+    def next_deadline(self):
+        """
+        :return: float 下一个定时器的到期时间戳
+        """
+        with self.__lock:
+            self.__discard()
+            if self.__timers:
+                return self.__timers[0][0]
+        return self.now + self.sleep_time
 
-    def _handle(self):
-        # 间隔事件
-        for handler in self.clock_interval_handlers:
-            if handler.is_active():
-                handler.call()
-                self.push_event_type(handler)
-        # 时刻事件
-        while self.clock_moment_handlers:
-            clock_handler = self.clock_moment_handlers.pop()
-            if clock_handler.is_active():
-                clock_handler.call()
-                self.push_event_type(clock_handler)
-                clock_handler.update_next_time()
-                self.clock_moment_handlers.appendleft(clock_handler)
+    def step_to(self, timestamp):
+        """
+        步进或模拟时间下, 把时间设置到 timestamp 并触发到期的事件
+        :param timestamp: float
+        :return:
+        """
+        jumped_back = timestamp < self.now
+        self.time_source.set(timestamp)
+        if jumped_back:
+            self.reset()
+        self.handle()
+
+    def run_until(self, timestamp):
+        """
+        步进或模拟时间下, 依次跳过每个到期时间直到 timestamp, 同步触发沿途的全部事件
+        :param timestamp: float
+        :return:
+        """
+        self.handle()
+        while self.is_active and self.now < timestamp:
+            self.time_source.set(min(self.next_deadline(), timestamp))
+            self.handle()
+
+    def handle(self):
+        """
+        触发全部到期的定时器, 同一时刻间隔事件先于时刻事件
+        卡顿后补发: 错过的每个时刻事件各触发一次, 间隔事件只触发一次并从当前时间重新对齐
+        :return:
+        """
+        now = self.now
+        due = []
+        with self.__lock:
+            while self.__timers and self.__timers[0][0] <= now:
+                deadline, seq, handler = heapq.heappop(self.__timers)
+                if handler.seq == seq and not handler.cancelled:
+                    due.append((deadline, isinstance(handler, ClockMomentHandler), seq, handler))
+        if not due:
+            return
+        due.sort(key=lambda item: item[:3])
+        trade_date = etime.is_trade_date(datetime.datetime.fromtimestamp(now, self.tzinfo))
+        for _, is_moment, _, handler in due:
+            if is_moment:
+                self._handle_moment(handler, trade_date)
             else:
-                self.clock_moment_handlers.append(clock_handler)
+                self._handle_interval(handler, trade_date, now)
+
+    def _handle_interval(self, handler, trade_date, now):
+        # 假日暂停间隔事件
+        if trade_date and handler.is_active():
+            handler.call()
+            self.push_event_type(handler)
+        if handler.trading and not self.trading_state:
+            if handler not in self.__parked:
+                self.__parked.append(handler)
+        else:
+            self._schedule(handler, handler.next_deadline(now))
+
+    def _handle_moment(self, handler, trade_date):
+        if not trade_date:
+            # 假日暂停时钟引擎, 已过期的时刻事件顺延到下一个交易日
+            handler.skip()
+        elif handler.is_active():
+            handler.call()
+            self.push_event_type(handler)
+            handler.update_next_time()
+        self._schedule(handler, handler.next_deadline(self.now))
+
+    def _schedule(self, handler, deadline):
+        with self.__lock:
+            handler.seq = next(self.__seq)
+            heapq.heappush(self.__timers, (deadline, handler.seq, handler))
+            earliest = self.__timers[0][2] is handler
+        if earliest:
+            self.__wakeup.set()
+
+    def __discard(self):
+        while self.__timers:
+            _, seq, handler = self.__timers[0]
+            if handler.seq == seq and not handler.cancelled:
                 break
+            heapq.heappop(self.__timers)
+
+    def set_trading_state(self, trading_state):
+        """
+        进入交易状态时重新调度暂停中的间隔处理器
+        :param trading_state: bool
+        :return:
+        """
+        self.trading_state = trading_state
+        if trading_state:
+            parked, self.__parked = self.__parked, []
+            for handler in parked:
+                if not handler.cancelled:
+                    self._schedule(handler, handler.next_deadline(self.now))
 
     def push_event_type(self, clock_handler):
-        event = Event(event_type=self.EventType, data=Clock(self.trading_state, clock_handler.clock_type))
-        self.event_engine.put(event)
+        """
+        有监听全部时钟事件的处理函数(如未声明 clocks 的策略)时推送 EventType 事件,
+        该类型有按类型注册的处理函数时推送 clock_event_type(clock_type) 事件
+        :param clock_handler:
+        :return:
+        """
+        clock = Clock(self.trading_state, clock_handler.clock_type)
+        if self.event_engine.has_handlers(self.EventType):
+            self.event_engine.put(Event(event_type=self.EventType, data=clock))
+        if clock_handler.clock_type in self._clock_handlers:
+            self.event_engine.put(Event(event_type=self.clock_event_type(clock_handler.clock_type), data=clock))
+
+    def clock_event_type(self, clock_type):
+        """
+        单一类型时钟事件的事件类型
+        :param clock_type: 间隔分钟数或时刻事件名
+        :return: 如 clock_tick.5, clock_tick.open
+        """
+        return '{}.{}'.format(self.EventType, clock_type)
+
+    def register_clocks(self, clocks, handler):
+        """
+        按类型注册时钟事件处理函数, 处理函数只会收到所注册类型的时钟事件
+        :param clocks: 列表, 元素为
+            int / float 间隔分钟数, 未注册的间隔会自动注册
+            str 已注册的时刻事件名, 如 open, close
+            tuple (时刻事件名, datetime.time) 自定义时刻, 未注册时自动注册
+        :param handler: 处理函数
+        :return:
+        """
+        for clock in clocks:
+            if isinstance(clock, tuple):
+                clock_type, moment = clock
+                if clock_type not in {h.clock_type for h in self.clock_moment_handlers}:
+                    self.register_moment(clock_type, moment)
+            elif isinstance(clock, (int, float)):
+                clock_type = self.register_interval(clock).clock_type
+            else:
+                clock_type = clock
+            self._clock_handlers[clock_type].add(handler)
+            self.event_engine.register(self.clock_event_type(clock_type), handler)
+
+    def unregister_clocks(self, handler, clock_types=None):
+        """
+        注销按类型注册的时钟事件处理函数
+        :param handler: 处理函数
+        :param clock_types: 时钟事件类型列表, 缺省注销该处理函数注册的所有类型
+        :return:
+        """
+        if clock_types is None:
+            clock_types = [t for t, handlers in list(self._clock_handlers.items()) if handler in handlers]
+        for clock_type in clock_types:
+            handlers = self._clock_handlers.get(clock_type)
+            if handlers is None:
+                continue
+            handlers.discard(handler)
+            if not handlers:
+                self._clock_handlers.pop(clock_type)
+            self.event_engine.unregister(self.clock_event_type(clock_type), handler)
 
     def stop(self):
         self.is_active = False
+        self.__wakeup.set()
+
+    def reset(self):
+        """
+        时间源被调整(如回放跳到历史时间)后, 按新的时间重新计算交易状态和全部定时器
+        :return:
+        """
+        self.set_trading_state(etime.is_tradetime(self.now_dt) and etime.is_trade_date(self.now_dt))
+        for handler in self.clock_moment_handlers:
+            handler.reset()
+            self._schedule(handler, handler.next_deadline(self.now))
+        for handler in self.clock_interval_handlers:
+            if handler not in self.__parked:
+                self._arm_interval(handler)
 
     def is_tradetime_now(self):
         """
@@ -231,16 +446,14 @@ class ClockEngine:
         :param makeup: 立即执行
         :return:
         """
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=self.tzinfo)
         return self._register_moment(clock_type, moment, makeup=makeup)
 
     def _register_moment(self, clock_type, moment, is_trading_date=True, makeup=False, call=None):
-        handlers = list(self.clock_moment_handlers)
         handler = ClockMomentHandler(self, clock_type, moment, is_trading_date, makeup, call)
-        handlers.append(handler)
-
-        # 触发事件重新排序
-        handlers.sort(key=lambda h: h.next_time, reverse=True)
-        self.clock_moment_handlers = deque(handlers)
+        self.clock_moment_handlers.append(handler)
+        self._schedule(handler, handler.next_deadline(self.now))
         return handler
 
     def register_interval(self, interval_minute, trading=True):
@@ -248,5 +461,29 @@ class ClockEngine:
 
     def _register_interval(self, interval_minute, trading=True, call=None):
         handler = ClockIntervalHandler(self, interval_minute, trading, call)
+        for registered in self.clock_interval_handlers:
+            if registered == handler:
+                return registered
         self.clock_interval_handlers.add(handler)
+        self._arm_interval(handler)
         return handler
+
+    def _arm_interval(self, handler):
+        if handler.trading and not self.trading_state:
+            # 使堆中已有的元素失效
+            handler.seq = None
+            if handler not in self.__parked:
+                self.__parked.append(handler)
+        else:
+            self._schedule(handler, handler.next_deadline(self.now))
+
+    def unregister(self, handler):
+        """
+            注销时刻或间隔处理器, 堆中的元素在到期时丢弃
+        :param handler: register_moment / register_interval 的返回值
+        :return:
+        """
+        handler.cancelled = True
+        if handler in self.clock_moment_handlers:
+            self.clock_moment_handlers.remove(handler)
+        self.clock_interval_handlers.discard(handler)
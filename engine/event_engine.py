@@ -1,23 +1,168 @@
-from collections import defaultdict
-from queue import Queue, Empty
-from threading import Thread
+import logging
+import time
+from collections import defaultdict, deque
+from queue import Empty
+from threading import Thread, Lock, Condition
+
+from utils.statsutil import LatencyStats
 
 
 class Event:
     """事件对象"""
+    __slots__ = ('event_type', 'data', 'timestamp')
 
-    def __init__(self, event_type, data=None):
+    def __init__(self, event_type, data=None, timestamp=None):
+        """
+        :param event_type: 事件类型
+        :param data: 事件数据
+        :param timestamp: float 事件数据产生的时间, 如行情的获取时间, None 表示未知
+        """
         self.event_type = event_type
         self.data = data
+        self.timestamp = timestamp
+
+
+class EventQueue:
+    """
+        事件队列, 支持容量上限以及按事件类型设置的溢出策略
+    """
+    # 队列已满时阻塞, 直到有空位
+    BLOCK = 'block'
+    # 队列已满时丢弃队列中同类型最早的事件, 没有同类型事件时阻塞
+    DROP_OLDEST = 'drop_oldest'
+    # 同类型事件在队列中只保留最新的一个
+    COALESCE = 'coalesce'
+    # 同 COALESCE, 但 dict 类型的事件数据按 key 合并, 新值覆盖旧值, 用于只包含变化股票的行情事件
+    MERGE = 'merge'
+
+    def __init__(self, maxsize=0, policies=None):
+        """
+        :param maxsize: int 队列容量, 0 表示不限
+        :param policies: dict 事件类型 -> 溢出策略, 缺省为 BLOCK
+        """
+        self.maxsize = maxsize
+        self.policies = policies or {}
+        # 队列元素为 [event] 槽位, 合并时直接替换槽位中的事件, 保持原有的排队位置
+        self.__queue = deque()
+        # 合并策略下, 事件类型 -> 队列中待处理的槽位
+        self.__pending = {}
+        self.__mutex = Lock()
+        self.__not_empty = Condition(self.__mutex)
+        self.__not_full = Condition(self.__mutex)
+        # 关闭后 put 不再入队, 阻塞中的 put / get 立即返回
+        self.closed = False
+        # 丢弃 / 合并的事件计数, key 为事件类型
+        self.dropped = defaultdict(int)
+        self.coalesced = defaultdict(int)
+
+    def policy(self, event_type):
+        policy = self.policies.get(event_type)
+        if policy is None and isinstance(event_type, str) and '.' in event_type:
+            # 按股票拆分的事件类型, 如 quotation.600887 沿用 quotation 的策略
+            policy = self.policies.get(event_type.rpartition('.')[0])
+        return policy or self.BLOCK
+
+    def put(self, event):
+        event_type = event.event_type
+        policy = self.policy(event_type)
+        with self.__not_full:
+            while True:
+                if self.closed:
+                    return
+                if policy in (self.COALESCE, self.MERGE):
+                    slot = self.__pending.get(event_type)
+                    if slot is not None:
+                        if policy == self.MERGE:
+                            event = self.__merge(slot[0], event)
+                        slot[0] = event
+                        self.coalesced[event_type] += 1
+                        return
+                if not self.__full():
+                    break
+                if policy == self.DROP_OLDEST and self.__drop_oldest(event_type):
+                    break
+                self.__not_full.wait()
+
+            slot = [event]
+            self.__queue.append(slot)
+            if policy in (self.COALESCE, self.MERGE):
+                self.__pending[event_type] = slot
+            self.__not_empty.notify()
+
+    def get(self, block=True, timeout=None):
+        with self.__not_empty:
+            if not block:
+                if not self.__queue:
+                    raise Empty
+            elif timeout is None:
+                while not self.__queue:
+                    if self.closed:
+                        raise Empty
+                    self.__not_empty.wait()
+            else:
+                end_time = time.monotonic() + timeout
+                while not self.__queue:
+                    if self.closed:
+                        raise Empty
+                    remaining = end_time - time.monotonic()
+                    if remaining <= 0:
+                        raise Empty
+                    self.__not_empty.wait(remaining)
+            slot = self.__queue.popleft()
+            event = slot[0]
+            if self.__pending.get(event.event_type) is slot:
+                self.__pending.pop(event.event_type)
+            self.__not_full.notify()
+            return event
+
+    def qsize(self):
+        with self.__mutex:
+            return len(self.__queue)
+
+    def close(self):
+        """关闭队列, 唤醒所有阻塞的 put / get"""
+        with self.__mutex:
+            self.closed = True
+            self.__not_full.notify_all()
+            self.__not_empty.notify_all()
+
+    @staticmethod
+    def __merge(pending, event):
+        if not (isinstance(pending.data, dict) and isinstance(event.data, dict)):
+            return event
+        # 同一个事件可能分派到多个工作队列, 合并时不修改原事件
+        data = dict(pending.data)
+        data.update(event.data)
+        return Event(event.event_type, data, event.timestamp)
+
+    def __full(self):
+        return 0 < self.maxsize <= len(self.__queue)
+
+    def __drop_oldest(self, event_type):
+        for slot in self.__queue:
+            if slot[0].event_type == event_type:
+                self.__queue.remove(slot)
+                self.dropped[event_type] += 1
+                return True
+        return False
 
 
 class EventEngine:
     """事件驱动引擎"""
 
-    def __init__(self):
-        """初始化事件引擎"""
+    def __init__(self, pool_size=0, maxsize=0, policies=None):
+        """
+        初始化事件引擎
+        :param pool_size: int 工作线程数, 0 表示每个事件启动一个新线程处理;
+            大于 0 时使用固定大小的线程池, 按处理函数所属的对象(如策略实例)分派工作线程,
+            同一对象的处理函数(包括 quotation.<code> / clock_tick.<type> 等子类型事件)总是在同一个线程中按序执行
+        :param maxsize: int 事件队列容量, 0 表示不限
+        :param policies: dict 事件类型 -> 溢出策略, 取值见 EventQueue.BLOCK / DROP_OLDEST / COALESCE / MERGE
+        """
+        self.log = logging.getLogger('EventEngine')
+
         # 事件队列
-        self.__queue = Queue()
+        self.__queue = EventQueue(maxsize, policies)
 
         # 事件引擎开关
         self.__active = False
@@ -28,33 +173,95 @@ class EventEngine:
         # 事件字典，key 为时间， value 为对应监听事件函数的列表
         self.__handlers = defaultdict(list)
 
+        # 工作线程池
+        self.pool_size = pool_size
+        self.__worker_queues = [EventQueue(maxsize, policies) for _ in range(pool_size)]
+        self.__workers = [Thread(target=self.__work, name="EventEngine.__worker.%s" % i, args=(i, q))
+                          for i, q in enumerate(self.__worker_queues)]
+
+        # 处理函数耗时统计, key 为处理函数名称
+        self.__handler_stats = defaultdict(LatencyStats)
+
     def __run(self):
         """启动引擎"""
         while self.__active:
             try:
                 event = self.__queue.get(block=True, timeout=1)
-                handle_thread = Thread(target=self.__process, name="EventEngine.__process", args=(event,))
-                handle_thread.start()
+                if self.pool_size:
+                    self.__dispatch(event)
+                else:
+                    handle_thread = Thread(target=self.__process, name="EventEngine.__process", args=(event,))
+                    handle_thread.start()
             except Empty:
                 pass
 
-    def __process(self, event):
-        """事件处理"""
+    def worker_of(self, handler):
+        """
+        处理函数所在的工作线程序号, 绑定方法按所属对象计算, 同一策略的 run / clock 在同一个线程中执行
+        :param handler: 处理函数
+        :return: int
+        """
+        owner = getattr(handler, '__self__', handler)
+        # 对象地址按 16 字节对齐, 去掉低位再取模
+        return (id(owner) >> 4) % self.pool_size
+
+    def __dispatch(self, event):
+        """分派到该事件的处理函数所在的工作线程"""
+        indexes = {self.worker_of(handler) for handler in list(self.__handlers.get(event.event_type, ()))}
+        for index in sorted(indexes):
+            self.__worker_queues[index].put(event)
+
+    def __work(self, index, worker_queue):
+        """工作线程, 只执行分派到本线程的处理函数"""
+        while self.__active:
+            try:
+                event = worker_queue.get(block=True, timeout=1)
+            except Empty:
+                continue
+            try:
+                self.__process(event, index)
+            except Exception as e:
+                self.log.error('事件 {} 处理出错: {}'.format(event.event_type, e), exc_info=True)
+
+    def __process(self, event, index=None):
+        """
+        事件处理
+        :param index: 工作线程序号, 只执行该线程的处理函数, None 表示全部
+        """
         # 检查该事件是否有对应的处理函数
         if event.event_type in self.__handlers:
             # 若存在,则按顺序将事件传递给处理函数执行
-            for handler in self.__handlers[event.event_type]:
-                handler(event)
+            for handler in list(self.__handlers[event.event_type]):
+                if index is not None and self.worker_of(handler) != index:
+                    continue
+                with self.__handler_stats[self._handler_name(handler)].timer():
+                    handler(event)
+
+    @staticmethod
+    def _handler_name(handler):
+        owner = getattr(handler, '__self__', None)
+        name = getattr(handler, '__name__', repr(handler))
+        if owner is None:
+            return getattr(handler, '__qualname__', name)
+        return '{}.{}'.format(getattr(owner, 'name', type(owner).__name__), name)
 
     def start(self):
         """引擎启动"""
         self.__active = True
+        for worker in self.__workers:
+            worker.start()
         self.__thread.start()
 
     def stop(self):
         """停止引擎"""
         self.__active = False
+        # 工作队列已满时分派线程阻塞在 put 中, 关闭队列使其返回
+        self.__queue.close()
+        for worker_queue in self.__worker_queues:
+            worker_queue.close()
         self.__thread.join()
+        for worker in self.__workers:
+            worker.join()
 
     def register(self, event_type, handler):
         """注册事件处理函数监听"""
@@ -71,9 +278,97 @@ class EventEngine:
         if len(handler_list) == 0:
             self.__handlers.pop(event_type)
 
+    def has_handlers(self, event_type):
+        """是否有监听该事件类型的处理函数"""
+        return bool(self.__handlers.get(event_type))
+
     def put(self, event):
         self.__queue.put(event)
 
     @property
     def queue_size(self):
         return self.__queue.qsize()
+
+    @property
+    def stats(self):
+        """
+        事件引擎运行统计
+        :return: dict
+            queue_size: 待分派的事件数
+            worker_queue_sizes: 各工作线程待处理的事件数
+            handlers: 各处理函数的调用次数及耗时(毫秒)
+            dropped: 各事件类型被丢弃的事件数
+            coalesced: 各事件类型被合并的事件数
+        """
+        dropped = defaultdict(int)
+        coalesced = defaultdict(int)
+        for q in [self.__queue] + self.__worker_queues:
+            for event_type, count in list(q.dropped.items()):
+                dropped[event_type] += count
+            for event_type, count in list(q.coalesced.items()):
+                coalesced[event_type] += count
+        return dict(
+            queue_size=self.queue_size,
+            worker_queue_sizes=[q.qsize() for q in self.__worker_queues],
+            handlers={name: s.to_dict() for name, s in list(self.__handler_stats.items())},
+            dropped=dict(dropped),
+            coalesced=dict(coalesced),
+        )
+
+
+class SyncEventEngine:
+    """
+        同步事件引擎, put 时在调用线程中按注册顺序直接执行处理函数, 用于回测, 结果与机器快慢无关
+        处理函数中 put 的事件排在当前事件之后处理, 与队列中的先后顺序一致
+    """
+
+    def __init__(self):
+        self.log = logging.getLogger('EventEngine')
+        self.__handlers = defaultdict(list)
+        self.__pending = deque()
+        self.__dispatching = False
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def register(self, event_type, handler):
+        """注册事件处理函数监听"""
+        if handler not in self.__handlers[event_type]:
+            self.__handlers[event_type].append(handler)
+
+    def unregister(self, event_type, handler):
+        """注销事件处理函数"""
+        handler_list = self.__handlers.get(event_type)
+        if handler_list is None:
+            return
+        if handler in handler_list:
+            handler_list.remove(handler)
+        if len(handler_list) == 0:
+            self.__handlers.pop(event_type)
+
+    def has_handlers(self, event_type):
+        """是否有监听该事件类型的处理函数"""
+        return bool(self.__handlers.get(event_type))
+
+    def put(self, event):
+        self.__pending.append(event)
+        if self.__dispatching:
+            return
+        self.__dispatching = True
+        try:
+            while self.__pending:
+                event = self.__pending.popleft()
+                for handler in list(self.__handlers.get(event.event_type, ())):
+                    try:
+                        handler(event)
+                    except Exception as e:
+                        self.log.error('事件 {} 处理出错: {}'.format(event.event_type, e), exc_info=True)
+        finally:
+            self.__dispatching = False
+
+    @property
+    def queue_size(self):
+        return len(self.__pending)
@@ -1,19 +1,66 @@
 from quotation.historyquotation import HistoryQuotation
+from quotation.barstore import BAR_FIELDS
+from quotation.tick import Tick
 from engine.event_engine import Event, EventEngine
 from engine.clock_engine import ClockEngine
+from engine.time_source import STEPPED
 from threading import Thread
+import heapq
+import itertools
 import logging
 import time
 
 
+def bar_feed(code, bars):
+    """
+        K 线回放数据源
+    :param code: 股票代码
+    :param bars: np.ndarray quotation.barstore.BAR_DTYPE, 按时间升序
+    :return: generator (timestamp, code, 行情), 行情中 now 为收盘价
+    """
+    for bar in bars:
+        data = {field: float(bar[field]) for field in BAR_FIELDS}
+        data['now'] = data['close']
+        yield float(bar['timestamp']), code, data
+
+
+def tick_feed(reader, day, symbols=None, start=None, end=None, symbol_range=None):
+    """
+        tick 回放数据源
+    :param reader: quotation.tickstore.TickReader
+    :param day: str YYYYMMDD
+    :param symbols: start: end: symbol_range: 同 TickReader.scan
+    :return: generator (timestamp, code, quotation.tick.Tick)
+    """
+    for records in reader.scan(day, symbols, start, end, symbol_range):
+        for record in records:
+            tick = Tick.from_record(record)
+            yield tick.timestamp, tick.symbol, tick
+
+
+def merge_feeds(feeds):
+    """
+        按时间戳合并多个数据源, 同一时间戳的行情合并为一个 {code: 行情}
+    :param feeds: list 数据源, 每个为按时间升序的 (timestamp, code, 行情) 迭代器, 见 bar_feed / tick_feed
+    :return: generator (timestamp, {code: 行情})
+    """
+    merged = heapq.merge(*feeds, key=lambda item: item[0])
+    for timestamp, group in itertools.groupby(merged, key=lambda item: item[0]):
+        yield timestamp, {code: quotation for _, code, quotation in group}
+
+
 class FlashbackEngine:
     EventType = 'flashback'
     PushInterval = 1
+    # 不限速回放时, 事件队列积压超过该值则等待处理函数消费
+    MaxPending = 1000
 
-    def __init__(self, event_engine: EventEngine,clock_engine:ClockEngine):
+    def __init__(self, event_engine: EventEngine, clock_engine: ClockEngine):
         self.log = logging.getLogger(self.EventType)
         self.event_engine = event_engine
-        self.history_quotation = HistoryQuotation()
+        self.clock_engine = clock_engine
+        # 仅在线回放时需要, 延迟到使用时创建, 避免本地回放发起网络请求
+        self.history_quotation = None
         self.is_active = True
         self.quotation_thread = None
 
@@ -22,6 +69,14 @@ class FlashbackEngine:
                                        name='FlashbackEngine.{}'.format(stock),
                                        args=(stock, begin, end))
 
+    def create_replay(self, feeds, speed=None):
+        """
+            从本地数据回放, 参数同 replay
+        """
+        self.quotation_thread = Thread(target=self.replay,
+                                       name='FlashbackEngine.replay',
+                                       args=(feeds, speed))
+
     def start(self):
         self.quotation_thread.start()
 
@@ -29,6 +84,8 @@ class FlashbackEngine:
         self.is_active = False
 
     def push_quotation(self, stock, begin, end):
+        if self.history_quotation is None:
+            self.history_quotation = HistoryQuotation()
         while self.is_active:
             try:
                 data = self.history_quotation.get_data(stock, begin, end)
@@ -41,6 +98,38 @@ class FlashbackEngine:
                 self.wait()
                 continue
             self.wait()
+
+    def replay(self, feeds, speed=None):
+        """
+            按时间戳合并多个数据源依次推送, 同一时间戳的行情合并为一个事件 {code: 行情}
+            时钟引擎使用 SteppedTime 时, 每个时间点先推进时钟并触发到期的时钟事件, 再推送行情
+        :param feeds: list 数据源, 见 merge_feeds
+        :param speed: 回放倍速, 如 60 表示 1 秒回放 1 分钟的数据; None 或 0 表示不限速, 只受处理函数消费速度限制
+        :return: int 推送的事件数
+        """
+        stepped = self.clock_engine.time_source.mode == STEPPED
+        count = 0
+        last_timestamp = None
+        last_wall = None
+        for timestamp, data in merge_feeds(feeds):
+            if not self.is_active:
+                break
+            if speed:
+                if last_timestamp is not None:
+                    delay = (timestamp - last_timestamp) / speed - (time.time() - last_wall)
+                    if delay > 0:
+                        time.sleep(delay)
+                last_timestamp, last_wall = timestamp, time.time()
+            else:
+                while self.event_engine.queue_size > self.MaxPending and self.is_active:
+                    time.sleep(0.001)
+            if stepped:
+                self.clock_engine.step_to(timestamp)
+            self.event_engine.put(Event(event_type=self.EventType, data=data, timestamp=timestamp))
+            count += 1
+        self.log.info('回放结束, 共推送 {} 个事件'.format(count))
+        return count
+
     def wait(self):
         for _ in range(int(self.PushInterval) + 1):
             time.sleep(1)
@@ -1,49 +1,189 @@
 # coding: utf-8
-import time
+import datetime
 import logging
-from threading import Thread
+from collections import defaultdict
+from threading import Thread, Event as ThreadEvent
 from engine.event_engine import Event
 import quotation
+import utils.timeutil as etime
 
 
 class QuotationEngine:
     """行情推送引擎基类"""
     EventType = 'quotation'
     PushInterval = 60
+    # 按时段设置的推送间隔 ((开始时间, 结束时间, 间隔秒数), ...), 优先于 PushInterval, 间隔可以小于 1 秒
+    # 如开盘集合竞价期间加快推送 ((datetime.time(9, 15), datetime.time(9, 30), 0.5),)
+    Schedule = ()
+    # 尾盘(见 utils.timeutil.is_closing)的推送间隔, None 表示沿用 PushInterval
+    ClosingInterval = None
+    ClosingStart = datetime.time(14, 54, 30)
+    # 非交易日、午间休市、收盘后是否暂停获取行情
+    SuspendOutsideSession = True
+    # 暂停期间单次等待的最长时间, 秒, 到期后重新判断是否恢复
+    MaxSuspend = 3600
+    # 是否只推送与上次相比价格或盘口有变化的股票
+    DiffPush = False
+    # 判断行情是否变化时比较的字段
+    DiffFields = ('now', 'volume') + tuple('{}{}{}'.format(side, level, suffix)
+                                           for side in ('bid', 'ask')
+                                           for level in range(1, 6)
+                                           for suffix in ('', '_volume'))
+
+    # 缺省的行情源, 见 quotation.use
+    Source = 'lf'
 
     def __init__(self, event_engine, clock_engine, source=None):
+        """
+        :param source: 行情源, 见 quotation.use, 列表表示组合多个行情源; 缺省为 Source
+        """
         self.log = logging.getLogger(self.EventType)
         self.event_engine = event_engine
         self.clock_engine = clock_engine
         self.is_active = True
-        self.quotation = quotation.use('lf')
+        self.quotation = self.create_quotation(source or self.Source)
         self.quotation_thread = Thread(target=self.push_quotation, name="QuotationEngine.%s" % self.EventType)
         self.quotation_thread.setDaemon(False)
+        # 上次推送的行情, 用于 DiffPush 比较
+        self._last_snapshot = dict()
+        # 股票代码 -> 按股票注册的处理函数
+        self._symbol_handlers = defaultdict(set)
+        # 由 register_symbols 订阅的股票, 最后一个处理函数注销时取消订阅
+        self._symbol_subscriptions = set()
+        # 等待下次推送, 停止或开盘 / 午后开盘时提前唤醒
+        self._wakeup = ThreadEvent()
+        self._suspended = False
+        self.clock_engine.register_clocks(['open', 'continue', 'close'], self._wake)
         self.init()
 
+    def create_quotation(self, source):
+        """
+        创建行情源, 子类可以覆盖, 如回放引擎不需要行情源
+        :param source: 行情源, 见 quotation.use
+        :return: 行情源对象
+        """
+        return quotation.use(source)
+
     def subscribe(self, codes):
         self.quotation.subscribe(codes)
 
     def unsubscribe(self, codes):
         self.quotation.unsubscribe(codes)
 
+    @property
+    def subscribed(self):
+        return self.quotation.subscribed
+
+    def symbol_event_type(self, code):
+        """
+        单只股票行情的事件类型
+        :param code: 股票代码
+        :return: 如 quotation.600887
+        """
+        return '{}.{}'.format(self.EventType, code)
+
+    def register_symbols(self, codes, handler):
+        """
+        按股票注册行情处理函数, 处理函数只会收到所注册股票的行情
+        :param codes: 股票代码或股票代码列表
+        :param handler: 处理函数, event.data 为 {code: 行情}
+        :return:
+        """
+        if type(codes) is not list:
+            codes = [codes]
+        subscribed = set(self.subscribed)
+        self._symbol_subscriptions.update(code for code in codes if code not in subscribed)
+        self.subscribe(codes)
+        for code in codes:
+            self._symbol_handlers[code].add(handler)
+            self.event_engine.register(self.symbol_event_type(code), handler)
+
+    def unregister_symbols(self, handler, codes=None):
+        """
+        注销按股票注册的行情处理函数
+        :param handler: 处理函数
+        :param codes: 股票代码列表, 缺省注销该处理函数注册的所有股票
+        :return:
+        """
+        if codes is None:
+            codes = [code for code, handlers in list(self._symbol_handlers.items()) if handler in handlers]
+        elif type(codes) is not list:
+            codes = [codes]
+        for code in codes:
+            handlers = self._symbol_handlers.get(code)
+            if handlers is None:
+                continue
+            handlers.discard(handler)
+            if not handlers:
+                self._symbol_handlers.pop(code)
+                if code in self._symbol_subscriptions:
+                    self._symbol_subscriptions.discard(code)
+                    self.unsubscribe([code])
+            self.event_engine.unregister(self.symbol_event_type(code), handler)
+
     def start(self):
         self.quotation_thread.start()
 
     def stop(self):
+        """停止推送, 行情线程退出时关闭行情源的连接"""
         self.is_active = False
+        self._wakeup.set()
+
+    def _wake(self, event=None):
+        self._wakeup.set()
 
     def push_quotation(self):
         while self.is_active:
+            if self.next_interval() is None:
+                self.wait()
+                continue
+            # 行情的获取时间, 记录行情时以此为时间戳, 而不是事件处理的时间
+            fetched = self.clock_engine.now
             try:
                 response_data = self.fetch_quotation()
             except Exception as e:
                 self.log.error(e)
                 self.wait()
                 continue
-            event = Event(event_type=self.EventType, data=response_data)
-            self.event_engine.put(event)
+            self.publish(response_data, fetched)
             self.wait()
+        # 行情线程退出时释放长连接
+        self.quotation.close()
+
+    def publish(self, response_data, timestamp=None):
+        """
+        推送行情事件
+        1. 推送 EventType 事件, DiffPush 时只包含有变化的股票, 没有变化时不推送
+        2. 对按股票注册了处理函数的股票, 逐只推送 symbol_event_type(code) 事件
+        :param response_data: dict {code: 行情}
+        :param timestamp: float 行情的获取时间, 作为事件的 timestamp
+        :return:
+        """
+        if self.DiffPush:
+            response_data = self.diff(response_data)
+            if not response_data:
+                return
+        event = Event(event_type=self.EventType, data=response_data, timestamp=timestamp)
+        self.event_engine.put(event)
+        for code in list(self._symbol_handlers):
+            if code in response_data:
+                event = Event(event_type=self.symbol_event_type(code), data={code: response_data[code]},
+                              timestamp=timestamp)
+                self.event_engine.put(event)
+
+    def diff(self, response_data):
+        """
+        与上次推送的行情比较, 只保留 DiffFields 有变化的股票
+        :param response_data: dict {code: 行情}
+        :return: dict {code: 行情}
+        """
+        changed = dict()
+        for code, quotation in response_data.items():
+            key = tuple(quotation.get(field) for field in self.DiffFields)
+            if self._last_snapshot.get(code) != key:
+                self._last_snapshot[code] = key
+                changed[code] = quotation
+        return changed
 
     def fetch_quotation(self):
         # return your quotation
@@ -52,7 +192,71 @@ class QuotationEngine:
     def init(self):
         pass
 
+    def in_session(self, now):
+        """
+        是否交易时段, 以时钟引擎的交易状态为准, 午间休市除外
+        :param now: datetime
+        :return: bool
+        """
+        return bool(self.clock_engine.trading_state) and not etime.is_pause(now)
+
+    def next_interval(self, now=None):
+        """
+        当前时段的推送间隔
+        :param now: datetime, 缺省为时钟引擎的当前时间
+        :return: float 秒数, None 表示暂停获取行情
+        """
+        now = now or self.clock_engine.now_dt
+        if not self.SuspendOutsideSession:
+            return self.PushInterval
+        if not etime.is_trade_date(now):
+            return None
+        moment = now.time()
+        for begin, end, interval in self.Schedule:
+            if begin <= moment < end:
+                return interval
+        if not self.in_session(now):
+            return None
+        if self.ClosingInterval is not None and etime.is_closing(now, self.ClosingStart):
+            return self.ClosingInterval
+        return self.PushInterval
+
+    def boundaries(self):
+        """
+        :return: list datetime.time 推送间隔可能变化的时刻, 升序
+        """
+        times = {moment for window in etime.OPEN_TIME + etime.PAUSE_TIME for moment in window}
+        times.update(moment for begin, end, _ in self.Schedule for moment in (begin, end))
+        if self.ClosingInterval is not None:
+            times.add(self.ClosingStart)
+        return sorted(times)
+
+    def seconds_to_boundary(self, now):
+        """
+        :param now: datetime
+        :return: float 距下一个 boundaries 时刻的秒数, 当天没有时为距午夜的秒数
+        """
+        def seconds(moment):
+            return moment.hour * 3600 + moment.minute * 60 + moment.second + moment.microsecond / 1e6
+
+        current = seconds(now.time())
+        for moment in self.boundaries():
+            if seconds(moment) > current:
+                return seconds(moment) - current
+        return 24 * 3600 - current
+
     def wait(self):
-        # for receive quit signal
-        for _ in range(int(self.PushInterval) + 1):
-            time.sleep(1)
+        """
+        按当前时段的推送间隔等待, 不超过下一个时段边界; 暂停期间等到下一个时段边界或开盘事件
+        """
+        now = self.clock_engine.now_dt
+        interval = self.next_interval(now)
+        suspended = interval is None
+        if suspended != self._suspended:
+            self._suspended = suspended
+            self.log.info('非交易时段, 暂停获取行情' if suspended else '进入交易时段, 恢复获取行情')
+        timeout = min(self.seconds_to_boundary(now), self.MaxSuspend)
+        if interval is not None:
+            timeout = min(timeout, interval)
+        self._wakeup.wait(timeout)
+        self._wakeup.clear()
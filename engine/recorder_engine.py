@@ -0,0 +1,51 @@
+# coding: utf-8
+import logging
+
+from quotation.tickstore import TickWriter, FSYNC_ROTATE
+
+
+class RecorderEngine:
+    """
+        行情记录引擎, 监听行情事件并按交易日追加写入本地 tick 文件
+        收到 close 时钟事件时写入缓冲并切换文件
+    """
+    EventType = 'recorder'
+
+    def __init__(self, event_engine, clock_engine, root='ticks', event_types=('quotation',), batch_size=10000,
+                 fsync=FSYNC_ROTATE):
+        """
+        :param event_engine: 事件引擎
+        :param clock_engine: 时钟引擎, 事件没有行情获取时间时以其当前时间记录, 并按其时区切分文件
+        :param root: 存储目录
+        :param event_types: 要记录的行情事件类型
+        :param batch_size: 缓冲的行数达到该值时写入一个数据块
+        :param fsync: fsync 策略, 见 quotation.tickstore
+        """
+        self.log = logging.getLogger(self.EventType)
+        self.event_engine = event_engine
+        self.clock_engine = clock_engine
+        self.event_types = list(event_types)
+        self.writer = TickWriter(root, batch_size=batch_size, fsync=fsync, tzinfo=clock_engine.tzinfo)
+
+    def start(self):
+        for event_type in self.event_types:
+            self.event_engine.register(event_type, self.record)
+        self.clock_engine.register_clocks(['close'], self.clock)
+
+    def stop(self):
+        for event_type in self.event_types:
+            self.event_engine.unregister(event_type, self.record)
+        self.clock_engine.unregister_clocks(self.clock)
+        self.writer.close()
+
+    def record(self, event):
+        try:
+            timestamp = event.timestamp if event.timestamp is not None else self.clock_engine.now
+            self.writer.append(timestamp, event.data)
+        except Exception as e:
+            self.log.error('行情记录失败: {}'.format(e), exc_info=True)
+
+    def clock(self, event):
+        if event.data.clock_event == 'close':
+            self.writer.rotate()
+            self.log.info('收盘, 行情文件已切换')
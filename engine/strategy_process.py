@@ -0,0 +1,362 @@
+# coding: utf-8
+"""
+    策略进程隔离
+    每个 StrategyProcess 管理一个工作进程, 进程中运行一组策略, 主进程中以 RemoteStrategy 代替策略实例注册事件
+        主进程 -> 工作进程: 加载 / 卸载策略, 行情和时钟事件
+        工作进程 -> 主进程: 交易接口调用, 行情订阅, 日志
+    行情事件在主进程中序列化一次, 以列式 Snapshot 的 pickle 发给所有工作进程
+"""
+import importlib
+import itertools
+import logging
+import logging.handlers
+import multiprocessing
+import pickle
+import queue
+import sys
+import time
+import traceback
+from threading import Thread, Lock
+
+import arrow
+
+from quotation.snapshot import FIELDS, TEXT_FIELDS, Snapshot
+
+_QUOTATION_KEYS = frozenset(FIELDS + TEXT_FIELDS + ('stale',))
+
+# 最近一次序列化的事件, 同一事件分发给多个远程策略时只序列化一次
+_encoded = (None, None)
+_encode_lock = Lock()
+
+
+def encode_event(event):
+    """
+        序列化事件, dict 格式的行情转换为列式 Snapshot
+    :param event: Event
+    :return: bytes
+    """
+    global _encoded
+    with _encode_lock:
+        if _encoded[0] is event:
+            return _encoded[1]
+    original = event
+    data = event.data
+    if isinstance(data, dict) and data:
+        first = next(iter(data.values()))
+        if isinstance(first, dict) and _QUOTATION_KEYS.issuperset(first):
+            event = type(event)(event_type=event.event_type, data=Snapshot.from_dict(data))
+    payload = pickle.dumps(event, protocol=pickle.HIGHEST_PROTOCOL)
+    with _encode_lock:
+        _encoded = (original, payload)
+    return payload
+
+
+class RemoteStrategy:
+    """
+        工作进程中策略在主进程的代理, 提供 MainEngine.strategy_listen_event 所需的属性和方法
+    """
+
+    def __init__(self, process, name, module_name, symbols, clocks):
+        self.process = process
+        self.name = name
+        self.module_name = module_name
+        self.symbols = symbols
+        self.clocks = clocks
+
+    def run(self, event):
+        self.process.send_event(self.name, 'run', event)
+
+    def clock(self, event):
+        self.process.send_event(self.name, 'clock', event)
+
+    def shutdown(self):
+        self.process.unload(self.name)
+
+    def __repr__(self):
+        return 'RemoteStrategy(%s@%s)' % (self.name, self.process.name)
+
+
+class StrategyProcess:
+    """
+        主进程中的工作进程句柄
+    """
+    # 等待工作进程加载策略的超时时间, 秒
+    LoadTimeout = 60
+
+    def __init__(self, main_engine, name, log_queue, context=None):
+        """
+        :param main_engine: MainEngine, 执行工作进程转发的交易和行情订阅请求
+        :param name: 进程名, 通常为策略的 process_group
+        :param log_queue: 工作进程日志队列, 由主进程统一输出
+        :param context: multiprocessing 上下文
+        """
+        self.log = logging.getLogger('StrategyProcess')
+        self.main_engine = main_engine
+        self.name = name
+        context = context or multiprocessing.get_context()
+        self.inbox = context.Queue()
+        self.outbox = context.Queue()
+        self.replies = context.Queue()
+        self.strategies = dict()
+        self.__loaded = queue.Queue()
+        # 加载请求的编号, 工作进程在回复中带回, 用于丢弃超时请求的迟到回复
+        self.__load_ids = itertools.count()
+        self.process = context.Process(target=worker_main,
+                                       name='Strategy.%s' % name,
+                                       args=(name, self.inbox, self.outbox, self.replies, log_queue,
+                                             main_engine.clock_engine.tzinfo,
+                                             main_engine.user is not None,
+                                             [quo.EventType for quo in main_engine.quotation_engines]),
+                                       daemon=True)
+        self.__receiver = Thread(target=self.__receive, name='StrategyProcess.%s' % name, daemon=True)
+
+    def start(self):
+        self.process.start()
+        self.__receiver.start()
+
+    def load(self, module_name, reload=False):
+        """
+            在工作进程中加载策略模块
+        :return: RemoteStrategy
+        """
+        load_id = next(self.__load_ids)
+        self.inbox.put(('load', load_id, module_name, reload))
+        deadline = time.monotonic() + self.LoadTimeout
+        while True:
+            try:
+                reply_id, status, *result = self.__loaded.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                raise RuntimeError('策略进程 %s 加载 %s 超时' % (self.name, module_name))
+            if reply_id == load_id:
+                break
+            self.log.warning('丢弃策略进程 %s 超时的加载请求 %s 的回复' % (self.name, reply_id))
+        if status == 'error':
+            raise RuntimeError('策略进程 %s 加载 %s 失败: %s' % (self.name, module_name, result[0]))
+        name, symbols, clocks = result
+        strategy = RemoteStrategy(self, name, module_name, symbols, clocks)
+        self.strategies[name] = strategy
+        return strategy
+
+    def unload(self, name):
+        self.strategies.pop(name, None)
+        self.inbox.put(('unload', name))
+
+    def send_event(self, name, method, event):
+        self.inbox.put(('event', name, method, encode_event(event)))
+
+    def stop(self, timeout=10):
+        if not self.process.is_alive():
+            return
+        self.inbox.put(('stop',))
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.log.warning('策略进程 %s 未按时退出, 强制结束' % self.name)
+            self.process.terminate()
+        self.outbox.put(None)
+
+    def __receive(self):
+        while True:
+            message = self.outbox.get()
+            if message is None:
+                break
+            kind = message[0]
+            try:
+                if kind == 'loaded':
+                    self.__loaded.put(message[1:])
+                elif kind == 'call':
+                    self.__call(*message[1:])
+                elif kind == 'subscribe':
+                    self.__subscribe(*message[1:])
+            except Exception as e:
+                self.log.error('处理策略进程 %s 的请求失败: %s' % (self.name, e), exc_info=True)
+
+    def __call(self, call_id, attr, args, kwargs):
+        """
+            在主进程中执行工作进程的交易接口调用, args 为 None 时读取属性, 属性为方法时只返回 Method 标记
+        """
+        try:
+            value = getattr(self.main_engine.user, attr)
+            if args is not None:
+                value = value(*args, **kwargs)
+            elif callable(value):
+                value = Method
+            # 在这里序列化, 避免无法序列化的结果在队列的发送线程中出错导致工作进程一直等待
+            pickle.dumps(value)
+            self.replies.put((call_id, value, None))
+        except Exception as e:
+            self.replies.put((call_id, None, '%s: %s' % (type(e).__name__, e)))
+
+    def __subscribe(self, event_type, method, codes):
+        quotation_engine = self.main_engine.get_quotation(event_type)
+        if quotation_engine is not None:
+            getattr(quotation_engine, method)(codes)
+
+
+class Method:
+    """
+        读取交易接口属性时, 属性为方法的标记
+    """
+
+
+class RemoteTrader:
+    """
+        工作进程中的交易接口代理, 方法调用和属性读取在主进程中执行并等待结果
+        首次访问某个名称时先在主进程中读取, 是方法则记录下来, 之后直接返回调用代理; 其它属性每次读取都请求主进程
+    """
+
+    def __init__(self, outbox, replies):
+        self.__outbox = outbox
+        self.__replies = replies
+        self.__ids = itertools.count()
+        self.__lock = Lock()
+        self.__methods = set()
+
+    def _request(self, attr, args=None, kwargs=None):
+        with self.__lock:
+            call_id = next(self.__ids)
+            self.__outbox.put(('call', call_id, attr, args, kwargs))
+            while True:
+                reply_id, value, error = self.__replies.get()
+                if reply_id == call_id:
+                    break
+        if error is not None:
+            if args is None and error.startswith('AttributeError:'):
+                # 保持 hasattr / getattr 缺省值的行为
+                raise AttributeError(attr)
+            raise RuntimeError('交易接口 %s 调用失败: %s' % (attr, error))
+        return value
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        if attr not in self.__methods:
+            value = self._request(attr)
+            if value is not Method:
+                return value
+            self.__methods.add(attr)
+        return lambda *args, **kwargs: self._request(attr, args, kwargs)
+
+
+class RemoteQuotationEngine:
+    """
+        工作进程中的行情引擎代理, 只支持订阅, 行情由主进程推送
+    """
+
+    def __init__(self, event_type, outbox):
+        self.EventType = event_type
+        self.__outbox = outbox
+
+    def subscribe(self, codes):
+        self.__outbox.put(('subscribe', self.EventType, 'subscribe', codes))
+
+    def unsubscribe(self, codes):
+        self.__outbox.put(('subscribe', self.EventType, 'unsubscribe', codes))
+
+
+class RemoteClockEngine:
+    """
+        工作进程中的时钟引擎代理, 只提供当前时间
+    """
+
+    def __init__(self, tzinfo):
+        self.tzinfo = tzinfo
+
+    @property
+    def now(self):
+        return time.time()
+
+    @property
+    def now_dt(self):
+        return arrow.get(self.now).to(self.tzinfo)
+
+
+class WorkerMainEngine:
+    """
+        工作进程中传给策略的 main_engine
+    """
+
+    def __init__(self, user, clock_engine, quotation_engines):
+        self.user = user
+        self.clock_engine = clock_engine
+        self.quotation_engines = quotation_engines
+
+    def get_quotation(self, eventype):
+        for quo in self.quotation_engines:
+            if quo.EventType == eventype:
+                return quo
+        return None
+
+
+def worker_main(name, inbox, outbox, replies, log_queue, tzinfo, has_user, quotation_types=('quotation',)):
+    """
+        工作进程入口
+    """
+    root = logging.getLogger()
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(logging.DEBUG)
+    log = logging.getLogger('StrategyProcess.%s' % name)
+
+    user = RemoteTrader(outbox, replies) if has_user else None
+    main_engine = WorkerMainEngine(user, RemoteClockEngine(tzinfo),
+                                   [RemoteQuotationEngine(t, outbox) for t in quotation_types])
+    modules = dict()
+    strategies = dict()
+
+    while True:
+        message = inbox.get()
+        kind = message[0]
+        if kind == 'event':
+            _, strategy_name, method, payload = message
+            strategy = strategies.get(strategy_name)
+            if strategy is not None:
+                try:
+                    getattr(strategy, method)(pickle.loads(payload))
+                except Exception:
+                    log.error('%s.%s 执行失败\n%s' % (strategy_name, method, traceback.format_exc()))
+        elif kind == 'load':
+            _, load_id, module_name, reload = message
+            try:
+                module = modules.get(module_name)
+                if module is None:
+                    module = importlib.import_module('.' + module_name, 'strategies')
+                elif reload:
+                    module = importlib.reload(module)
+                modules[module_name] = module
+                strategy = module.Strategy(user=user, log_handler=log, main_engine=main_engine)
+                old_strategy = strategies.get(strategy.name)
+                if reload and old_strategy is not None:
+                    strategy.handover(getattr(old_strategy, 'g', None))
+                strategies[strategy.name] = strategy
+                outbox.put(('loaded', load_id, 'ok', strategy.name, strategy.symbols, strategy.clocks))
+            except Exception:
+                outbox.put(('loaded', load_id, 'error', traceback.format_exc()))
+        elif kind == 'unload':
+            strategy = strategies.pop(message[1], None)
+            if strategy is not None:
+                _shutdown(strategy, log)
+        elif kind == 'stop':
+            for strategy in strategies.values():
+                _shutdown(strategy, log)
+            break
+    log.info('策略进程 %s 退出' % name)
+    sys.exit(0)
+
+
+def _shutdown(strategy, log):
+    try:
+        strategy.shutdown()
+    except Exception:
+        log.error('%s.shutdown 执行失败\n%s' % (strategy.name, traceback.format_exc()))
+
+
+class LogForwarder(logging.Handler):
+    """
+        主进程中输出工作进程的日志记录, 交给同名 logger 处理
+    """
+
+    def handle(self, record):
+        logging.getLogger(record.name).handle(record)
+        return True
+
+    def emit(self, record):
+        pass
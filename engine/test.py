@@ -1,5 +1,22 @@
+import datetime
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import types
 import unittest
-from .event_engine import EventEngine
+
+from dateutil import tz
+
+from quotation.tickstore import TickReader
+from .clock_engine import ClockEngine
+from .event_engine import Event, EventEngine, EventQueue, SyncEventEngine
+from .flashback_engine import FlashbackEngine
+from .quotation_engine import QuotationEngine
+from .recorder_engine import RecorderEngine
+from .strategy_process import StrategyProcess
+from .time_source import SimulatedTime, WallTime
 
 
 class EventEngineTest(unittest.TestCase):
@@ -7,3 +24,402 @@ class EventEngineTest(unittest.TestCase):
         eventEngine = EventEngine()
         eventEngine.start()
 
+    def test_pool_keeps_order(self):
+        event_engine = EventEngine(pool_size=3)
+        received = []
+
+        def handler(event):
+            received.append(event.data)
+
+        event_engine.register('quotation', handler)
+        event_engine.start()
+        for i in range(100):
+            event_engine.put(Event('quotation', i))
+        for _ in range(50):
+            if len(received) == 100:
+                break
+            time.sleep(0.1)
+        event_engine.stop()
+
+        self.assertEqual(received, list(range(100)))
+        stats = event_engine.stats
+        self.assertEqual(stats['handlers']['EventEngineTest.test_pool_keeps_order.<locals>.handler']['count'], 100)
+        self.assertEqual(len(stats['worker_queue_sizes']), 3)
+
+    def test_pool_routes_by_owner(self):
+        event_engine = EventEngine(pool_size=4)
+
+        class Owner:
+            def __init__(self):
+                self.threads = set()
+                self.count = 0
+
+            def run(self, event):
+                self.threads.add(threading.current_thread().name)
+                self.count += 1
+
+            def clock(self, event):
+                self.run(event)
+
+        owners = [Owner() for _ in range(6)]
+        for owner in owners:
+            for event_type in ('quotation', 'quotation.600887', 'quotation.000001'):
+                event_engine.register(event_type, owner.run)
+            event_engine.register('clock_tick.open', owner.clock)
+        event_engine.start()
+        for i in range(50):
+            for event_type in ('quotation', 'quotation.600887', 'quotation.000001', 'clock_tick.open'):
+                event_engine.put(Event(event_type, i))
+        for _ in range(50):
+            if all(owner.count == 200 for owner in owners):
+                break
+            time.sleep(0.1)
+        event_engine.stop()
+
+        for owner in owners:
+            self.assertEqual(owner.count, 200)
+            # 同一对象的处理函数, 包括子类型事件, 只在一个工作线程中执行
+            self.assertEqual(len(owner.threads), 1)
+
+    def test_stop_full_bounded_pool(self):
+        event_engine = EventEngine(pool_size=1, maxsize=1)
+        release = threading.Event()
+        event_engine.register('quotation', lambda event: release.wait(5))
+        event_engine.start()
+        # 处理中 1 个, 工作队列 1 个, 分派线程阻塞在 put 中 1 个, 主队列 1 个
+        for i in range(4):
+            event_engine.put(Event('quotation', i))
+        time.sleep(0.2)
+        stopper = threading.Thread(target=event_engine.stop)
+        stopper.start()
+        release.set()
+        stopper.join(5)
+        self.assertFalse(stopper.is_alive())
+
+
+class EventQueueTest(unittest.TestCase):
+    def test_coalesce(self):
+        q = EventQueue(maxsize=2, policies={'quotation': EventQueue.COALESCE})
+        q.put(Event('clock_tick', 'open'))
+        for i in range(5):
+            q.put(Event('quotation', i))
+        self.assertEqual(q.qsize(), 2)
+        self.assertEqual(q.get().data, 'open')
+        self.assertEqual(q.get().data, 4)
+        self.assertEqual(q.coalesced['quotation'], 4)
+
+    def test_drop_oldest(self):
+        q = EventQueue(maxsize=2, policies={'quotation': EventQueue.DROP_OLDEST})
+        for i in range(5):
+            q.put(Event('quotation', i))
+        self.assertEqual([q.get().data, q.get().data], [3, 4])
+        self.assertEqual(q.dropped['quotation'], 3)
+
+    def test_merge(self):
+        q = EventQueue(maxsize=2, policies={'quotation': EventQueue.MERGE})
+        first = Event('quotation', {'600000': 1, '000001': 1})
+        q.put(first)
+        q.put(Event('quotation', {'000001': 2}))
+        q.put(Event('quotation.600887', {'600887': 3}))
+        q.put(Event('quotation.600887', {'600887': 4}))
+        self.assertEqual(q.qsize(), 2)
+        self.assertEqual(q.get().data, {'600000': 1, '000001': 2})
+        self.assertEqual(first.data, {'600000': 1, '000001': 1})
+        self.assertEqual(q.get().data, {'600887': 4})
+
+
+class FlashbackEngineTest(unittest.TestCase):
+    def test_replay_merges_feeds(self):
+        event_engine = EventEngine()
+        clock_engine = types.SimpleNamespace(time_source=WallTime())
+        flashback_engine = FlashbackEngine(event_engine, clock_engine)
+        feeds = [
+            iter([(1.0, '600000', {'now': 1}), (3.0, '600000', {'now': 3})]),
+            iter([(1.0, '000001', {'now': 10}), (2.0, '000001', {'now': 20})]),
+        ]
+        self.assertEqual(flashback_engine.replay(feeds), 3)
+        events = [event_engine._EventEngine__queue.get(block=False) for _ in range(3)]
+        self.assertEqual([sorted(event.data) for event in events], [['000001', '600000'], ['000001'], ['600000']])
+
+
+class ClockEngineTest(unittest.TestCase):
+    def test_simulated_week(self):
+        tzinfo = tz.gettz('Asia/Shanghai')
+        start = datetime.datetime(2016, 12, 5, 8, tzinfo=tzinfo).timestamp()
+        end = datetime.datetime(2016, 12, 11, 16, tzinfo=tzinfo).timestamp()
+        events = []
+        clock_engine = ClockEngine(types.SimpleNamespace(put=events.append, has_handlers=lambda t: True), tzinfo,
+                                   SimulatedTime(start))
+        clock_engine.run_until(end)
+
+        clock_types = [event.data.clock_event for event in events]
+        self.assertEqual(clock_types.count('open'), 5)
+        self.assertEqual(clock_types.count('close'), 5)
+        # 9:00 开盘后至 15:00 收盘每分钟一次
+        self.assertEqual(clock_types.count(1), 5 * 6 * 60)
+        self.assertEqual(clock_engine.now, end)
+
+    def test_catch_up_after_stall(self):
+        tzinfo = tz.gettz('Asia/Shanghai')
+        start = datetime.datetime(2016, 12, 5, 8, tzinfo=tzinfo).timestamp()
+        events = []
+        clock_engine = ClockEngine(types.SimpleNamespace(put=events.append, has_handlers=lambda t: True), tzinfo,
+                                   SimulatedTime(start))
+        clock_engine.time_source.advance(8 * 3600)
+        clock_engine.handle()
+
+        # 错过的时刻事件按顺序各补发一次, 间隔事件不补发
+        self.assertEqual([event.data.clock_event for event in events], ['open', 'pause', 'continue', 'close'])
+        self.assertFalse(clock_engine.trading_state)
+
+    def test_register_clocks(self):
+        tzinfo = tz.gettz('Asia/Shanghai')
+        start = datetime.datetime(2016, 12, 5, 8, tzinfo=tzinfo).timestamp()
+        events, registered = [], []
+        event_engine = types.SimpleNamespace(put=events.append, register=lambda t, h: registered.append(t),
+                                             has_handlers=lambda t: False)
+        clock_engine = ClockEngine(event_engine, tzinfo, SimulatedTime(start))
+        clock_engine.register_clocks(['open', 5, ('before_close', datetime.time(14, 50))], print)
+        clock_engine.run_until(start + 8 * 3600)
+
+        self.assertEqual(registered, ['clock_tick.open', 'clock_tick.5', 'clock_tick.before_close'])
+        topics = [event.data.clock_event for event in events if event.event_type != ClockEngine.EventType]
+        self.assertEqual(topics.count('open'), 1)
+        self.assertEqual(topics.count('before_close'), 1)
+        self.assertEqual(topics.count(5), 6 * 12)
+        self.assertEqual(set(topics), {'open', 'before_close', 5})
+
+    def test_no_broadcast_without_listener(self):
+        tzinfo = tz.gettz('Asia/Shanghai')
+        start = datetime.datetime(2016, 12, 5, 9, 30, tzinfo=tzinfo).timestamp()
+        put_types = []
+
+        class Recording(SyncEventEngine):
+            def put(self, event):
+                put_types.append(event.event_type)
+                super().put(event)
+
+        event_engine = Recording()
+        clock_engine = ClockEngine(event_engine, tzinfo, SimulatedTime(start))
+        received, legacy = [], []
+        # 声明了 clocks=[5] 的策略
+        clock_engine.register_clocks([5], received.append)
+        clock_engine.run_until(start + 3600)
+        self.assertEqual(len(received), 12)
+        self.assertNotIn(ClockEngine.EventType, put_types)
+
+        # 未声明 clocks 的策略监听全部时钟事件
+        event_engine.register(ClockEngine.EventType, legacy.append)
+        clock_engine.run_until(start + 7200)
+        self.assertEqual(len(received), 24)
+        self.assertEqual([event.data.clock_event for event in legacy].count(5), 12)
+
+
+class Subscription:
+    """只记录订阅的行情源"""
+
+    def __init__(self, codes=()):
+        self.subscribed = list(codes)
+
+    def subscribe(self, codes):
+        self.subscribed.extend(code for code in codes if code not in self.subscribed)
+
+    def unsubscribe(self, codes):
+        self.subscribed = [code for code in self.subscribed if code not in codes]
+
+
+class QuotationEngineTest(unittest.TestCase):
+    def quotation_engine(self, diff_push=False, codes=()):
+        event_engine = SyncEventEngine()
+        clock_engine = ClockEngine(event_engine, tz.gettz('Asia/Shanghai'), SimulatedTime(0))
+        engine = type('Engine', (QuotationEngine,), dict(DiffPush=diff_push))(event_engine, clock_engine)
+        engine.quotation = Subscription(codes)
+        return engine
+
+    def test_diff_push(self):
+        engine = self.quotation_engine(diff_push=True)
+        received = []
+        engine.event_engine.register(engine.EventType, lambda event: received.append(event.data))
+        engine.publish({'600000': {'now': 1, 'volume': 10}, '000001': {'now': 2, 'volume': 10}})
+        engine.publish({'600000': {'now': 1, 'volume': 10}, '000001': {'now': 2, 'volume': 20}})
+        engine.publish({'600000': {'now': 1, 'volume': 10}, '000001': {'now': 2, 'volume': 20}})
+        self.assertEqual([sorted(data) for data in received], [['000001', '600000'], ['000001']])
+        self.assertEqual(received[1]['000001']['volume'], 20)
+
+    def test_register_symbols(self):
+        engine = self.quotation_engine(codes=['600887'])
+        first, second, whole = [], [], []
+        engine.event_engine.register(engine.EventType, lambda event: whole.append(event.data))
+        engine.register_symbols(['600000', '600887'], first.append)
+        engine.register_symbols('600000', second.append)
+        self.assertEqual(engine.subscribed, ['600887', '600000'])
+
+        engine.publish({'600000': {'now': 1}, '600887': {'now': 2}, '000001': {'now': 3}})
+        self.assertEqual(len(whole), 1)
+        self.assertEqual(sorted(code for event in first for code in event.data), ['600000', '600887'])
+        self.assertEqual([event.data for event in second], [{'600000': {'now': 1}}])
+        self.assertEqual({event.event_type for event in first}, {'quotation.600000', 'quotation.600887'})
+
+        engine.unregister_symbols(first.append)
+        engine.publish({'600000': {'now': 4}, '600887': {'now': 5}})
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 2)
+        # 600000 仍有处理函数, 600887 在注册前已订阅, 都不取消订阅
+        self.assertEqual(engine.subscribed, ['600887', '600000'])
+        engine.unregister_symbols(second.append, ['600000'])
+        self.assertEqual(engine.subscribed, ['600887'])
+        engine.publish({'600000': {'now': 6}})
+        self.assertEqual(len(second), 2)
+
+    def test_session_schedule(self):
+        tzinfo = tz.gettz('Asia/Shanghai')
+        event_engine = types.SimpleNamespace(put=lambda event: None, register=lambda t, h: None)
+        clock_engine = ClockEngine(event_engine, tzinfo, SimulatedTime(0))
+
+        class Engine(QuotationEngine):
+            Schedule = ((datetime.time(9, 15), datetime.time(9, 30), 0.5),)
+            ClosingInterval = 1
+
+        engine = Engine(event_engine, clock_engine)
+
+        def interval(hour, minute, day=5):
+            return engine.next_interval(datetime.datetime(2016, 12, day, hour, minute, tzinfo=tzinfo))
+
+        clock_engine.trading_state = True
+        self.assertEqual(interval(9, 20), 0.5)
+        self.assertEqual(interval(10, 0), Engine.PushInterval)
+        self.assertIsNone(interval(12, 0))
+        self.assertEqual(interval(14, 58), 1)
+        # 周末和收盘后暂停
+        self.assertIsNone(interval(10, 0, day=10))
+        clock_engine.trading_state = False
+        self.assertIsNone(interval(16, 0))
+        self.assertEqual(engine.seconds_to_boundary(datetime.datetime(2016, 12, 5, 9, 14, 30)), 30)
+
+
+class RecorderEngineTest(unittest.TestCase):
+    def test_record_fetch_time(self):
+        tzinfo = tz.gettz('Asia/Shanghai')
+        fetched = datetime.datetime(2016, 12, 5, 23, 59, 59, tzinfo=tzinfo).timestamp()
+        event_engine = SyncEventEngine()
+        # 处理事件时已是次日, 仍按获取时间记录到获取当天的文件
+        clock_engine = ClockEngine(event_engine, tzinfo, SimulatedTime(fetched + 2))
+        with tempfile.TemporaryDirectory() as root:
+            recorder = RecorderEngine(event_engine, clock_engine, root=root)
+            recorder.start()
+            event_engine.put(Event('quotation', {'600887': {'now': 17.5, 'stale': True}}, fetched))
+            event_engine.put(Event('quotation', {'600887': {'now': 17.6}}))
+            recorder.stop()
+            reader = TickReader(root)
+            self.assertEqual(reader.days(), ['20161205', '20161206'])
+            ticks = reader.read('20161205')
+            self.assertEqual((ticks['timestamp'][0], ticks['stale'][0]), (fetched, True))
+            self.assertEqual(reader.read('20161206')['timestamp'][0], fetched + 2)
+
+
+PROBE_STRATEGY = """
+from utils.strategyTemplate import StrategyTemplate, StrategyState
+
+VERSION = {version}
+
+
+class Strategy(StrategyTemplate):
+    name = 'probe'
+
+    def initialize(self):
+        self.g = StrategyState()
+        self.g.runs = 0
+
+    def strategy(self, event):
+        self.g.runs += 1
+        self.user.record(VERSION, self.g.runs, event.data['600887']['now'], self.user.cash,
+                         hasattr(self.user, 'missing'))
+"""
+
+SLOW_STRATEGY = """
+import time
+
+from utils.strategyTemplate import StrategyTemplate
+
+
+class Strategy(StrategyTemplate):
+    name = 'slow'
+
+    def initialize(self):
+        time.sleep(0.5)
+"""
+
+
+class ProbeTrader:
+    """记录工作进程中策略的调用"""
+
+    def __init__(self):
+        self.cash = 1000.0
+        self.records = []
+        self.recorded = threading.Event()
+
+    def record(self, *args):
+        self.records.append(args)
+        self.recorded.set()
+
+
+class StrategyProcessTest(unittest.TestCase):
+    def setUp(self):
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            self.skipTest('需要 fork 启动方式')
+        import strategies
+        self.root = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.root.name, 'process_probe.py')
+        self.write(1)
+        strategies.__path__.append(self.root.name)
+        self.addCleanup(strategies.__path__.remove, self.root.name)
+        self.addCleanup(self.root.cleanup)
+
+        context = multiprocessing.get_context('fork')
+        self.user = ProbeTrader()
+        main_engine = types.SimpleNamespace(user=self.user, quotation_engines=[], get_quotation=lambda t: None,
+                                            clock_engine=types.SimpleNamespace(tzinfo=tz.gettz('Asia/Shanghai')))
+        self.process = StrategyProcess(main_engine, 'probe', context.Queue(), context)
+        self.process.start()
+        self.addCleanup(self.process.stop)
+
+    def write(self, version):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write(PROBE_STRATEGY.format(version=version) + '#' * version)
+
+    def run_strategy(self, strategy, now):
+        self.user.recorded.clear()
+        strategy.run(Event('quotation', {'600887': {'now': now}}))
+        self.assertTrue(self.user.recorded.wait(10))
+        return self.user.records[-1]
+
+    def test_round_trip_and_reload(self):
+        strategy = self.process.load('process_probe')
+        self.assertEqual(strategy.name, 'probe')
+        # 行情经 Snapshot 发给工作进程, 属性读取和方法调用都在主进程中执行
+        self.assertEqual(self.run_strategy(strategy, 17.5), (1, 1, 17.5, 1000.0, False))
+        self.user.cash = 900.0
+        self.assertEqual(self.run_strategy(strategy, 17.6), (1, 2, 17.6, 900.0, False))
+
+        # 重新加载后新策略沿用旧策略的 g
+        self.write(2)
+        reloaded = self.process.load('process_probe', reload=True)
+        self.assertEqual(self.run_strategy(reloaded, 17.7), (2, 3, 17.7, 900.0, False))
+
+        reloaded.shutdown()
+        self.user.recorded.clear()
+        reloaded.run(Event('quotation', {'600887': {'now': 17.8}}))
+        self.assertFalse(self.user.recorded.wait(0.5))
+        self.assertEqual(self.process.strategies, {})
+
+    def test_late_load_reply(self):
+        with open(os.path.join(self.root.name, 'process_slow.py'), 'w', encoding='utf-8') as f:
+            f.write(SLOW_STRATEGY)
+        self.process.LoadTimeout = 0.2
+        with self.assertRaises(RuntimeError):
+            self.process.load('process_slow')
+        self.process.LoadTimeout = 10
+        # 超时请求的迟到回复被丢弃, 不会当作本次加载的结果
+        strategy = self.process.load('process_probe')
+        self.assertEqual(strategy.name, 'probe')
+        self.assertEqual(strategy.module_name, 'process_probe')
@@ -0,0 +1,55 @@
+# coding: utf-8
+import time
+
+# 时间源模式
+WALL = 'wall'
+SIMULATED = 'simulated'
+STEPPED = 'stepped'
+
+
+class WallTime:
+    """
+        系统时间
+    """
+    mode = WALL
+
+    def now(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+class SimulatedTime:
+    """
+        模拟时间, sleep 不等待而是直接推进时间, 时钟引擎据此直接跳到下一个到期的事件
+    """
+    mode = SIMULATED
+
+    def __init__(self, start=None):
+        """
+        :param start: float 起始时间戳, 缺省为当前系统时间
+        """
+        self._now = time.time() if start is None else float(start)
+
+    def now(self):
+        return self._now
+
+    def set(self, timestamp):
+        self._now = float(timestamp)
+
+    def advance(self, seconds):
+        self._now += seconds
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.advance(seconds)
+
+
+class SteppedTime(SimulatedTime):
+    """
+        步进时间, 只由外部(回放引擎, 测试)调用 set / advance 推进
+        时钟引擎不会自行运行, 由推进方调用 ClockEngine.step_to 触发到期事件
+    """
+    mode = STEPPED
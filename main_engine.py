@@ -5,14 +5,18 @@ import threading
 import time
 from threading import Thread, Lock
 
-import trade
 from engine.clock_engine import ClockEngine
 from engine.quotation_engine import QuotationEngine
+from utils import tradecalendar
+from utils.statsutil import StartupProfile
+from utils.watcher import create_watcher
 
 import importlib
+import logging.handlers
+import multiprocessing
 import os
 from collections import OrderedDict
-from engine.event_engine import EventEngine
+from engine.event_engine import EventEngine, EventQueue
 import logging
 
 ACCOUNT_OBJECT_FILE = 'account.session'
@@ -21,28 +25,44 @@ ACCOUNT_OBJECT_FILE = 'account.session'
 class MainEngine:
     """主引擎，负责行情 / 事件驱动引擎 / 交易"""
 
-    def __init__(self, broker=None, account_file=None, quotation_engines=None, tzinfo=None):
+    def __init__(self, broker=None, account_file=None, quotation_engines=None, tzinfo=None, event_pool_size=0,
+                 event_queue_size=0, event_policies=None, tick_dir=None, strategy_process=False,
+                 process_start_method=None, defer_init=False):
         """
             初始化事件 / 行情 引擎并启动事件引擎
+        :param event_pool_size: 事件引擎工作线程数, 0 表示每个事件启动一个新线程处理
+        :param event_queue_size: 事件队列容量, 0 表示不限
+        :param event_policies: dict 事件类型 -> 队列溢出策略, 限定容量时缺省对行情事件使用合并策略,
+            DiffPush 的行情引擎只推送变化的股票, 使用按股票合并的 MERGE 策略, 不能使用 COALESCE
+        :param tick_dir: 行情记录目录, 设置后将所有行情引擎推送的行情记录到本地
+        :param strategy_process: 是否在工作进程中运行策略, 按策略的 process_group 分组, 每组一个进程
+        :param process_start_method: 工作进程的启动方式 fork / spawn / forkserver, 缺省为平台默认方式,
+            使用 spawn / forkserver 时启动脚本需要放在 if __name__ == '__main__' 下
+        :param defer_init: 是否把券商登录等网络初始化放到后台并行执行, 可用 wait_ready 等待完成,
+            各阶段耗时见 startup.report()
         """
         self.log = logging.getLogger("MainEngine")
         self.broker = broker
+        self.startup = StartupProfile()
 
         # 登录账户
         if (broker is not None) and (account_file is not None):
-            self.user = trade.use(broker, account_file)
+            with self.startup.phase('trader'):
+                import trade
+                self.user = trade.use(broker, account_file)
             need_data_file = pathlib.Path(account_file)
             if need_data_file.exists():
-                self.user.login()
+                if defer_init:
+                    self.startup.background('trader.login', self.user.login)
+                else:
+                    with self.startup.phase('trader.login'):
+                        self.user.login()
             else:
                 self.log.warning("券商账号信息文件 %s 不存在, trader 将不可用" % account_file)
         else:
             self.user = None
             self.log.info('选择了无交易模式')
 
-        self.event_engine = EventEngine()
-        self.clock_engine = ClockEngine(self.event_engine, tzinfo)
-
         quotation_engines = quotation_engines or [QuotationEngine]
 
         if type(quotation_engines) != list:
@@ -53,10 +73,41 @@ class MainEngine:
                 types.sort()
                 types = ','.join([str(t) for t in types])
                 raise ValueError("行情引擎 EventType 重复:" + types)
+
+        if event_queue_size and event_policies is None:
+            # 策略只需要最新的行情, 积压的旧行情直接合并
+            event_policies = {quo.EventType: EventQueue.MERGE if quo.DiffPush else EventQueue.COALESCE
+                              for quo in quotation_engines}
+        for quo in quotation_engines:
+            if quo.DiffPush and (event_policies or {}).get(quo.EventType) == EventQueue.COALESCE:
+                # 被合并掉的事件中的股票已记入 _last_snapshot, 在再次变化前不会重新推送
+                raise ValueError('DiffPush 的行情引擎 %s 不能使用 COALESCE 策略, 请使用 MERGE' % quo.EventType)
+        # 交易日历, 只读取本地文件, 启动时不通过网络补全
+        with self.startup.phase('calendar'):
+            tradecalendar.get_calendar()
+
+        with self.startup.phase('event_engine'):
+            self.event_engine = EventEngine(pool_size=event_pool_size, maxsize=event_queue_size,
+                                            policies=event_policies)
+        with self.startup.phase('clock_engine'):
+            self.clock_engine = ClockEngine(self.event_engine, tzinfo)
         self.quotation_engines = []
-        for quotation_engine in quotation_engines:
-            self.quotation_engines.append(
-                quotation_engine(event_engine=self.event_engine, clock_engine=self.clock_engine))
+        with self.startup.phase('quotation_engines'):
+            for quotation_engine in quotation_engines:
+                self.quotation_engines.append(
+                    quotation_engine(event_engine=self.event_engine, clock_engine=self.clock_engine))
+        # 模拟交易按推送的行情撮合
+        if hasattr(self.user, 'on_quotation'):
+            for quotation_engine in self.quotation_engines:
+                self.event_engine.register(quotation_engine.EventType, self._paper_quotation)
+
+        # 行情记录引擎
+        self.recorder_engine = None
+        if tick_dir is not None:
+            with self.startup.phase('recorder_engine'):
+                from engine.recorder_engine import RecorderEngine
+                self.recorder_engine = RecorderEngine(self.event_engine, self.clock_engine, root=tick_dir,
+                                                      event_types=[quo.EventType for quo in self.quotation_engines])
 
         # 保存读取的策略类
         self.strategies = OrderedDict()
@@ -64,17 +115,29 @@ class MainEngine:
 
         # 是否要动态重载策略
         self.is_watch_strategy = False
+        # 合并连续保存的等待时间, 文件在该时间内没有新的变化才重新加载
+        self.reload_debounce = 0.5
         # 修改时间缓存
         self._cache = {}
         # 文件进程映射
         # self._process_map = {}
         # 文件模块映射
         self._modules = {}
+        # 文件策略实例映射
+        self._file_strategies = {}
         self._names = None
+        # 策略进程
+        self.strategy_process = strategy_process
+        self._process_context = multiprocessing.get_context(process_start_method)
+        self._strategy_processes = OrderedDict()
+        self._log_queue = None
+        self._log_listener = None
         # 加载锁
         self.lock = Lock()
+        # 策略目录监视
+        self._watcher = None
         # 加载线程
-        self._watch_thread = Thread(target=self._load_strategy, name="MainEngine.watch_reload_strategy")
+        self._watch_thread = Thread(target=self._watch_strategy, name="MainEngine.watch_reload_strategy")
 
         # shutdown 函数
         self.before_shutdown = []  # 关闭引擎前的 shutdown
@@ -91,7 +154,20 @@ class MainEngine:
             # 捕获退出信号后的要调用的,唯一的 shutdown 接口
             signal.signal(s, self._shutdown)
 
-        self.log.info('启动主引擎')
+        self.log.info('启动主引擎, 耗时: %s' % dict(self.startup.report()['phases']))
+
+    def wait_ready(self, timeout=None):
+        """
+            等待后台初始化任务完成
+        :param timeout: 秒, None 表示一直等待
+        :return: bool 是否全部完成
+        """
+        ready = self.startup.wait(timeout)
+        report = self.startup.report()
+        self.log.info('初始化耗时: %s' % dict(report['phases']))
+        for name, error in report['errors'].items():
+            self.log.error('初始化任务 %s 失败: %s' % (name, error))
+        return ready
 
     def start(self):
         """启动主引擎"""
@@ -104,48 +180,92 @@ class MainEngine:
         self.clock_engine.start()
         self._add_main_shutdown(self.clock_engine.stop)
 
+        if self.recorder_engine is not None:
+            self.recorder_engine.start()
+            self._add_main_shutdown(self.recorder_engine.stop)
+
     def load(self, names, strategy_file):
+        """
+            加载策略文件, 文件已加载且有改动时重新加载
+            导入和创建新策略时不持有锁, 新策略创建成功后在锁内替换旧策略的事件监听, 创建失败时旧策略继续运行
+            旧策略的状态通过 g 交给新策略, 见 StrategyTemplate.handover
+        :param names: 策略名列表, None 表示全部加载
+        :param strategy_file: strategies 目录下的文件名
+        :return:
+        """
+        mtime = os.path.getmtime(os.path.join('strategies', strategy_file))
+        if self._cache.get(strategy_file) == mtime:
+            # 检查最后改动时间
+            return
+
+        strategy_module_name = os.path.basename(strategy_file)[:-3]
+        strategy_module = self._modules.get(strategy_file)
+        reload = strategy_module is not None
+        if reload:
+            strategy_module = importlib.reload(strategy_module)
+        else:
+            strategy_module = importlib.import_module('.' + strategy_module_name, 'strategies')
+        self._modules[strategy_file] = strategy_module
+
+        strategy_class = getattr(strategy_module, 'Strategy')
+        if names is not None and strategy_class.name not in names:
+            self._cache[strategy_file] = mtime
+            return
+
+        old_strategy = self._file_strategies.get(strategy_file)
+        if self.strategy_process:
+            # 工作进程中重新加载时由工作进程交接 g
+            new_strategy = self._get_strategy_process(strategy_class).load(strategy_module_name, reload)
+        else:
+            new_strategy = strategy_class(user=self.user, log_handler=self.log, main_engine=self)
+            if old_strategy is not None:
+                new_strategy.handover(getattr(old_strategy, 'g', None))
+
         with self.lock:
-            mtime = os.path.getmtime(os.path.join('strategies', strategy_file))
-
-            # 是否需要重新加载
-            reload = False
-
-            strategy_module_name = os.path.basename(strategy_file)[:-3]
-            new_module = lambda strategy_module_name: importlib.import_module('.' + strategy_module_name, 'strategies')
-            strategy_module = self._modules.get(
-                strategy_file,  # 从缓存中获取 module 实例
-                new_module(strategy_module_name)  # 创建新的 module 实例
-            )
-
-            if self._cache.get(strategy_file, None) == mtime:
-                # 检查最后改动时间
-                return
-            elif self._cache.get(strategy_file, None) is not None:
-                # 注销策略的监听
-                old_strategy = self.get_strategy(strategy_module.Strategy.name)
-                if old_strategy is None:
-                    for s in self.strategy_list:
-                        print(s.name)
-                self.log.warn(u'卸载策略: %s' % old_strategy.name)
+            if old_strategy is not None:
+                self.log.warning(u'卸载策略: %s' % old_strategy.name)
                 self.strategy_listen_event(old_strategy, "unlisten")
-                time.sleep(2)
-                reload = True
-            # 重新加载
-            if reload:
-                strategy_module = importlib.reload(strategy_module)
-
-            self._modules[strategy_file] = strategy_module
-
-            strategy_class = getattr(strategy_module, 'Strategy')
-            if names is None or strategy_class.name in names:
-                self.strategies[strategy_module_name] = strategy_class
-                # 缓存加载信息
-                new_strategy = strategy_class(user=self.user, log_handler=self.log, main_engine=self)
-                self.strategy_list.append(new_strategy)
-                self._cache[strategy_file] = mtime
-                self.strategy_listen_event(new_strategy, "listen")
-                self.log.info(u'加载策略: %s' % strategy_module_name)
+                self.strategy_list.remove(old_strategy)
+                old_process = getattr(old_strategy, 'process', None)
+                if old_process is not None and (old_process is not new_strategy.process
+                                                or old_strategy.name != new_strategy.name):
+                    # process_group 或策略名改变后, 旧策略仍留在原工作进程中, 需要卸载
+                    old_strategy.shutdown()
+            self.strategies[strategy_module_name] = strategy_class
+            self.strategy_list.append(new_strategy)
+            self._file_strategies[strategy_file] = new_strategy
+            self.strategy_listen_event(new_strategy, "listen")
+            # 替换成功后才记录改动时间, 加载失败时下次检查仍会重试
+            self._cache[strategy_file] = mtime
+        self.log.info(u'%s策略: %s' % ('重新加载' if reload else '加载', strategy_module_name))
+
+    def _get_strategy_process(self, strategy_class):
+        """
+        :param strategy_class: 策略类
+        :return: StrategyProcess 策略所在进程组的工作进程, 不存在时创建并启动
+        """
+        group = strategy_class.process_group or strategy_class.name
+        process = self._strategy_processes.get(group)
+        if process is None:
+            from engine.strategy_process import StrategyProcess, LogForwarder
+            if self._log_queue is None:
+                self._log_queue = self._process_context.Queue()
+                self._log_listener = logging.handlers.QueueListener(self._log_queue, LogForwarder())
+                self._log_listener.start()
+            process = StrategyProcess(self, group, self._log_queue, self._process_context)
+            process.start()
+            self._strategy_processes[group] = process
+            self.log.info('启动策略进程: %s' % group)
+        return process
+
+    def _stop_strategy_processes(self):
+        for process in self._strategy_processes.values():
+            process.stop()
+        if self._log_listener is not None:
+            self._log_listener.stop()
+
+    def _paper_quotation(self, event):
+        self.user.on_quotation(event.data, self.clock_engine.now)
 
     def strategy_listen_event(self, strategy, _type="listen"):
         """
@@ -161,16 +281,33 @@ class MainEngine:
 
         # 行情引擎的事件
         for quotation_engine in self.quotation_engines:
-            func(quotation_engine.EventType, strategy.run)
+            if strategy.symbols:
+                # 策略声明了关注的股票, 只接收这些股票的行情
+                if _type == "listen":
+                    quotation_engine.register_symbols(list(strategy.symbols), strategy.run)
+                else:
+                    quotation_engine.unregister_symbols(strategy.run)
+            else:
+                func(quotation_engine.EventType, strategy.run)
 
         # 时钟事件
-        func(ClockEngine.EventType, strategy.clock)
+        if strategy.clocks:
+            # 策略声明了关注的时钟事件, 只接收这些类型
+            if _type == "listen":
+                self.clock_engine.register_clocks(list(strategy.clocks), strategy.clock)
+            else:
+                self.clock_engine.unregister_clocks(strategy.clock)
+        else:
+            func(ClockEngine.EventType, strategy.clock)
 
     def load_strategy(self, names=None):
         """动态加载策略
         :param names: 策略名列表，元素为策略的 name 属性"""
         s_folder = 'strategies'
         self._names = names
+        if self.is_watch_strategy and self._watcher is None:
+            # 先开始监视再加载, 避免漏掉加载过程中的改动
+            self._watcher = create_watcher(s_folder, '.py')
         strategies = os.listdir(s_folder)
         strategies = filter(lambda file: file.endswith('.py') and file != '__init__.py', strategies)
         importlib.import_module(s_folder)
@@ -181,13 +318,34 @@ class MainEngine:
             self.log.warn("启用了动态加载策略功能")
             self._watch_thread.start()
 
-    def _load_strategy(self):
-        while True:
-            try:
-                self.load_strategy(self._names)
-                time.sleep(2)
-            except Exception as e:
-                print(e)
+    def _watch_strategy(self):
+        """
+            监视策略目录, 只重新加载有改动的文件
+        :return:
+        """
+        watcher = self._watcher
+        self.log.info('策略目录监视方式: %s' % type(watcher).__name__)
+        try:
+            while self.is_watch_strategy:
+                changed = watcher.wait(timeout=1)
+                if not changed:
+                    continue
+                # 合并短时间内的连续保存
+                while True:
+                    more = watcher.wait(timeout=self.reload_debounce)
+                    if not more:
+                        break
+                    changed |= more
+                for strategy_file in sorted(changed):
+                    if strategy_file == '__init__.py' or not os.path.exists(os.path.join('strategies', strategy_file)):
+                        continue
+                    try:
+                        self.load(self._names, strategy_file)
+                    except Exception as e:
+                        self.log.error('加载策略 %s 失败: %s' % (strategy_file, e), exc_info=True)
+        finally:
+            watcher.close()
+            self._watcher = None
 
     def get_strategy(self, name):
         for strategy in self.strategy_list:
@@ -230,6 +388,7 @@ class MainEngine:
         :return:
         """
         self.log.debug("开始关闭进程...")
+        self.is_watch_strategy = False
         # 所有 shutdown 前的触发点
         for st in self.before_shutdown:
             st()
@@ -247,6 +406,7 @@ class MainEngine:
         self.log.debug("开始关闭策略...")
         for s in self.strategy_list:
             s.shutdown()
+        self._stop_strategy_processes()
 
         # 所有 shutdown 后的触发点
         for st in self.after_shutdown:
@@ -1,4 +1,5 @@
 from .api import *
 from .basicquotation import BasicQuotation
+from .composite import Composite
 from .leverfun import Leverfun
 from .sina import Sina
\ No newline at end of file
@@ -1,13 +1,25 @@
 from .sina import Sina
 from .leverfun import Leverfun
+from .composite import Composite
 
+# 组合行情源的参数, 其余参数传给各个行情源
+COMPOSITE_KWARGS = ('hedge_delay', 'cooldown', 'refresh_timeout')
 
-def use(source=None):
+
+def use(source=None, **kwargs):
+    """
+    :param source: 行情源 ['sina'] ['leverfun', 'lf'], 缺省为 sina; 列表表示按优先级组合多个行情源, 见 Composite
+    :param kwargs: 传给 BasicQuotation 的连接参数, 如 pooled, limit_per_host; 组合行情源另见 COMPOSITE_KWARGS
+    :return: 行情对象
+    """
+    if isinstance(source, (list, tuple)):
+        composite_kwargs = {key: kwargs.pop(key) for key in COMPOSITE_KWARGS if key in kwargs}
+        return Composite([use(name, **kwargs) for name in source], **composite_kwargs)
     if source in ['sina']:
-        return Sina()
+        return Sina(**kwargs)
     elif source in ['leverfun', 'lf']:
-        return Leverfun()
+        return Leverfun(**kwargs)
     elif source is None:
-        return Sina()
+        return Sina(**kwargs)
     else:
         raise RuntimeError('不支持的行情source{}'.format(source))
@@ -0,0 +1,87 @@
+"""
+    本地 K 线存储
+    每只股票一个文件 <code>.npy, 内容为按时间戳升序排列的 numpy 结构化数组
+    读取时使用 mmap, 按时间范围二分查找切片
+"""
+import datetime
+import os
+
+import numpy as np
+
+SUFFIX = '.npy'
+BAR_FIELDS = ('open', 'high', 'low', 'close', 'volume')
+BAR_DTYPE = np.dtype([('timestamp', 'f8')] + [(field, 'f8') for field in BAR_FIELDS])
+
+
+def from_chartlist(chartlist):
+    """
+        雪球 K 线数据(HistoryQuotation.get_data 的返回值)转换为结构化数组
+    :param chartlist: list of dict
+    :return: np.ndarray BAR_DTYPE
+    """
+    bars = np.zeros(len(chartlist), dtype=BAR_DTYPE)
+    for i, bar in enumerate(chartlist):
+        if 'timestamp' in bar:
+            timestamp = bar['timestamp'] / 1000
+        else:
+            timestamp = datetime.datetime.strptime(bar['time'], '%a %b %d %H:%M:%S %z %Y').timestamp()
+        bars[i] = (timestamp,) + tuple(float(bar[field]) for field in BAR_FIELDS)
+    return bars
+
+
+class BarStore:
+    """
+        >>> store = BarStore('bars')                                            # doctest: +SKIP
+        >>> store.save('600887', from_chartlist(chartlist))                      # doctest: +SKIP
+        >>> bars = store.load('600887', start=1451836800)                       # doctest: +SKIP
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, code):
+        return os.path.join(self.root, code + SUFFIX)
+
+    def symbols(self):
+        """
+        :return: list 已存储的股票代码
+        """
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name[:-len(SUFFIX)] for name in os.listdir(self.root) if name.endswith(SUFFIX))
+
+    def save(self, code, bars):
+        """
+            与已有数据合并, 相同时间戳以新数据为准
+        :param code: 股票代码
+        :param bars: np.ndarray BAR_DTYPE
+        :return:
+        """
+        bars = np.asarray(bars, dtype=BAR_DTYPE)
+        if os.path.exists(self.path(code)):
+            bars = np.concatenate([bars, self.load(code)])
+        # 稳定排序后按时间戳去重, 保留先出现的新数据
+        bars = bars[np.argsort(bars['timestamp'], kind='stable')]
+        _, first = np.unique(bars['timestamp'], return_index=True)
+        bars = bars[first]
+        os.makedirs(self.root, exist_ok=True)
+        tmp = self.path(code) + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.save(f, bars)
+        os.replace(tmp, self.path(code))
+
+    def load(self, code, start=None, end=None):
+        """
+        :param code: 股票代码
+        :param start: float 起始时间戳(含)
+        :param end: float 结束时间戳(含)
+        :return: np.ndarray BAR_DTYPE, 只读
+        """
+        path = self.path(code)
+        if not os.path.exists(path):
+            return np.zeros(0, dtype=BAR_DTYPE)
+        bars = np.load(path, mmap_mode='r')
+        timestamps = bars['timestamp']
+        low = 0 if start is None else np.searchsorted(timestamps, start, side='left')
+        high = len(bars) if end is None else np.searchsorted(timestamps, end, side='right')
+        return bars[low:high]
@@ -1,13 +1,30 @@
 import asyncio
-import aiohttp
 import logging
 import time
 import math
 from abc import abstractclassmethod
 
+from utils.statsutil import LatencyStats
+
 
 class BasicQuotation:
-    def __init__(self, crawl_api, headers=None, cookies=None):
+    def __init__(self, crawl_api, headers=None, cookies=None, pooled=True, limit_per_host=20, keepalive_timeout=30,
+                 ttl_dns_cache=300, concurrency=20, request_timeout=5, refresh_timeout=10, columnar=False,
+                 ticks=False):
+        """
+        :param crawl_api: 行情接口地址
+        :param headers: 请求头
+        :param cookies: 请求 cookies
+        :param pooled: 是否复用长连接会话, False 时每次请求新建会话
+        :param limit_per_host: 每个主机的最大连接数
+        :param keepalive_timeout: 空闲连接保持时间, 单位秒
+        :param ttl_dns_cache: DNS 缓存时间, 单位秒
+        :param concurrency: 同时进行的最大请求数
+        :param request_timeout: 单个请求超时时间, 单位秒
+        :param refresh_timeout: 整次刷新超时时间, 单位秒, 超时未返回的股票标记为过期
+        :param columnar: refresh 是否返回列式快照 quotation.snapshot.Snapshot, 需要 numpy
+        :param ticks: refresh 是否返回定长 tick 记录 {code: quotation.tick.Tick}, 需要解析器支持, 见 Sina
+        """
         self.__stocks = list()
         self.__crawl_api = crawl_api
         logging.basicConfig(level='INFO', format='[%(asctime)s] [%(levelname)s] %(name)s:%(message)s',
@@ -21,6 +38,35 @@ class BasicQuotation:
         else:
             self.cookies = cookies
 
+        # 长连接会话, 在 event_loop 中首次请求时创建
+        self.pooled = pooled
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.ttl_dns_cache = ttl_dns_cache
+        self._session = None
+
+        # 并发数及超时
+        self.concurrency = concurrency
+        self.request_timeout = request_timeout
+        self.refresh_timeout = refresh_timeout
+
+        # 最近一次成功获取的行情, 请求失败时以此填充并标记 stale
+        self._last_result = dict()
+        # 最近一次刷新中请求失败或超时的股票
+        self.stale_stocks = list()
+
+        # 列式快照及其股票行号索引, 索引在各次刷新间保持不变
+        self.columnar = columnar
+        self.symbol_index = None
+        self._snapshot = None
+
+        # 定长 tick 记录, 时间戳取本次刷新开始的时间
+        self.ticks = ticks
+        self._refresh_time = None
+
+        # 行情刷新耗时统计
+        self.refresh_stats = LatencyStats()
+
     def subscribe(self, codes):
         if type(codes) is not list:
             if not self.__stocks.count(codes):
@@ -45,49 +91,164 @@ class BasicQuotation:
 
     def refresh(self):
         start = time.time()
+        self._refresh_time = start
         if not self.__stocks:
             self.log.info('未订阅任何股票行情.')
             return {}
+        if self.columnar:
+            self._snapshot = self._new_snapshot()
         asyncio.set_event_loop(self.event_loop)
         future = asyncio.ensure_future(self._run(self.event_loop))
-        content = self.event_loop.run_until_complete(future)
+        content, stale_stocks = self.event_loop.run_until_complete(future)
         end = time.time()
-        result = dict()
-        for future_result in content:
-            if type(future_result) is dict:
-                for j in future_result.keys():
-                    result.__setitem__(j, future_result.get(j))
+        if self.columnar:
+            result, self._snapshot = self._snapshot, None
+        else:
+            result = dict()
+            for future_result in content:
+                if type(future_result) is dict:
+                    for j in future_result.keys():
+                        result.__setitem__(j, future_result.get(j))
+            self._last_result.update(result)
+
+        # 失败的股票沿用上一次的行情, 并标记为过期; 从未获取成功的股票只有过期标记
+        self.stale_stocks = stale_stocks
+        for stock in stale_stocks:
+            if stock in result:
+                continue
+            last = self._last_result.get(stock)
+            if last is None:
+                quotation = self._stale_placeholder(stock)
+            elif hasattr(last, 'replace'):
+                quotation = last.replace(stale=True)
+            else:
+                quotation = dict(last, stale=True)
+            if self.columnar:
+                result.set(stock, quotation)
+            else:
+                result[stock] = quotation
+        if self.columnar:
+            self._last_result = result
+        if stale_stocks:
+            self.log.warning('{}只股票行情获取失败或超时: {}'.format(len(stale_stocks), stale_stocks))
+        self.refresh_stats.add(end - start)
         self.log.info('行情刷新完毕，耗时{}ms'.format(math.ceil((end - start) * 1000)))
         return result
 
+    def _stale_placeholder(self, stock):
+        """
+            从未获取成功的股票在本次结果中的占位行情, 只带过期标记
+        :return: dict 或 quotation.tick.Tick
+        """
+        if self.ticks:
+            from quotation.tick import Tick
+            return Tick(stock, self._refresh_time, stale=True)
+        return {'stale': True}
+
+    def _new_snapshot(self):
+        """
+            按订阅的股票预先分配本次刷新的列式快照
+        :return: Snapshot
+        """
+        from quotation.snapshot import Snapshot, SymbolIndex
+        if self.symbol_index is None:
+            self.symbol_index = SymbolIndex()
+        self.symbol_index.extend(self.__stocks)
+        return Snapshot(self.symbol_index)
+
+    def _get_session(self):
+        """
+            获取长连接会话, 需要在 event_loop 中调用
+        :return: aiohttp.ClientSession
+        """
+        if self._session is None or self._session.closed:
+            import aiohttp
+            connector = aiohttp.TCPConnector(limit_per_host=self.limit_per_host,
+                                             keepalive_timeout=self.keepalive_timeout,
+                                             use_dns_cache=True,
+                                             ttl_dns_cache=self.ttl_dns_cache)
+            self._session = aiohttp.ClientSession(connector=connector, headers=self.headers, cookies=self.cookies)
+        return self._session
+
     async def _fetch(self, url, stock):
+        if self.pooled:
+            async with self._get_session().get(url=url) as response:
+                return self._decode(await response.text(), stock)
+        import aiohttp
         async with aiohttp.ClientSession(headers=self.headers, cookies=self.cookies) as session:
             async with session.get(url=url) as response:
-                return self._format_response(await response.text(), stock)
+                return self._decode(await response.text(), stock)
+
+    def _decode(self, response, stock):
+        if self._snapshot is not None:
+            return self._format_response_into(response, stock, self._snapshot)
+        return self._format_response(response, stock)
+
+    @property
+    def stats(self):
+        """
+        :return: dict 行情刷新次数及耗时(毫秒)
+        """
+        return dict(self.refresh_stats.to_dict(), pooled=self.pooled)
+
+    def close(self):
+        """
+            关闭长连接会话及事件循环, 关闭后不能再刷新行情
+        :return:
+        """
+        if self.event_loop.is_closed():
+            return
+        if self._session is not None and not self._session.closed:
+            self.event_loop.run_until_complete(self._session.close())
+        self._session = None
+        self.event_loop.close()
 
     async def _run(self, loop):
         """
             行情数据
-        :return: dict
+        :return: tuple (各请求返回的 dict 列表, 失败或超时的股票列表)
         """
 
         def task_completed(future):
             # This function should never be called in right case.
             # The only reason why it is invoking is uncaught exception.
+            if future.cancelled():
+                return
             exc = future.exception()
             if exc:
-                self.log.error('Worker has finished with error: {} '.format(exc), exc_info=True)
+                self.log.error('Worker has finished with error: {!r} '.format(exc))
 
-        tasks = []
-        for stock in self.__stocks:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = dict()
+        for stock in self._split_stocks(list(self.__stocks)):
             crawl_url = self._curl_handle(self.__crawl_api, stock)
-            crawl_future = asyncio.ensure_future(self._fetch(crawl_url, stock))
+            crawl_future = asyncio.ensure_future(self._limited_fetch(semaphore, crawl_url, stock))
             crawl_future.add_done_callback(task_completed)
-            tasks.append(crawl_future)
-        responses = await asyncio.gather(*tasks)
-        for task in tasks:
+            tasks[crawl_future] = stock
+        done, pending = await asyncio.wait(tasks.keys(), timeout=self.refresh_timeout)
+        for task in pending:
             task.cancel()
-        return responses
+
+        responses = []
+        stale_stocks = []
+        for task, stock in tasks.items():
+            if task in done and not task.cancelled() and task.exception() is None:
+                responses.append(task.result())
+            else:
+                stale_stocks.extend(stock if type(stock) is list else [stock])
+        return responses, stale_stocks
+
+    async def _limited_fetch(self, semaphore, url, stock):
+        async with semaphore:
+            return await asyncio.wait_for(self._fetch(url, stock), self.request_timeout)
+
+    def _split_stocks(self, stocks):
+        """
+            将订阅的股票拆分为请求参数, 每个参数发起一次请求, 支持批量查询的子类可以合并为多只股票一组
+        :param stocks: list 订阅的股票
+        :return: list 请求参数, 依次传给 _curl_handle 和 _format_response
+        """
+        return stocks
 
     def _curl_handle(self, crawl_api, param):
         return crawl_api + param
@@ -102,6 +263,17 @@ class BasicQuotation:
         """
         pass
 
+    def _format_response_into(self, response, stock, snapshot):
+        """
+            解析返回结果并写入列式快照, 子类可以覆盖为直接解析到数组
+        :param response: 返回结果字符串
+        :param stock: 股票代码
+        :param snapshot: quotation.snapshot.Snapshot
+        :return: None
+        """
+        for code, quotation in self._format_response(response, stock).items():
+            snapshot.set(code, quotation)
+
 
 if __name__ == '__main__':
     q = BasicQuotation('https://app.leverfun.com/timelyInfo/timelyOrderForm?stockCode=')
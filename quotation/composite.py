@@ -0,0 +1,185 @@
+"""
+    组合行情源
+    同时使用多个行情源, 按股票合并结果, 某个行情源出错时自动切换到其它行情源
+        合并模式(hedge_delay=None): 所有可用的行情源并行刷新, 按优先级逐只股票取第一个有效的行情
+        对冲模式: 先只请求优先级最高的行情源, 超过 hedge_delay 秒未返回或出错时再请求下一个, 先返回的结果胜出
+    每个行情源在各自的线程中刷新, 耗时分布见 stats
+    >>> q = Composite([Sina(), Leverfun()], hedge_delay=0.2)                   # doctest: +SKIP
+    >>> q.subscribe('600887')                                                   # doctest: +SKIP
+    >>> q.refresh()                                                              # doctest: +SKIP
+"""
+import logging
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from utils.statsutil import LatencyStats
+
+
+class Composite:
+    def __init__(self, sources, hedge_delay=None, cooldown=30, refresh_timeout=None):
+        """
+        :param sources: list 行情源, 按优先级排列; 或 dict 名称 -> 行情源
+        :param hedge_delay: 对冲请求的等待时间, 秒, None 表示所有行情源并行刷新后合并
+        :param cooldown: 行情源出错后暂停使用的时间, 秒, 所有行情源都在暂停中时仍然全部尝试
+        :param refresh_timeout: 整次刷新超时时间, 秒, 缺省为各行情源 refresh_timeout 的最大值
+        """
+        if not isinstance(sources, dict):
+            named = OrderedDict()
+            for source in sources:
+                name = type(source).__name__.lower()
+                if name in named:
+                    name = '%s%d' % (name, len(named))
+                named[name] = source
+            sources = named
+        if not sources:
+            raise ValueError('至少需要一个行情源')
+        self.sources = OrderedDict(sources)
+        self.hedge_delay = hedge_delay
+        self.cooldown = cooldown
+        self.refresh_timeout = refresh_timeout or max(
+            getattr(source, 'refresh_timeout', 10) for source in self.sources.values())
+        self.log = logging.getLogger('quotation')
+        # 每个行情源一个线程, 行情源的事件循环只在该线程中运行
+        self.__executors = {name: ThreadPoolExecutor(1, thread_name_prefix='quotation.%s' % name)
+                            for name in self.sources}
+        # 行情源 -> 仍在进行中的刷新, 上次被对冲淘汰的请求未结束前不再提交
+        self.__running = dict()
+        # 行情源 -> 恢复使用的时间
+        self.__suspended = dict()
+        self.latency = {name: LatencyStats() for name in self.sources}
+        self.errors = {name: 0 for name in self.sources}
+        self.wins = {name: 0 for name in self.sources}
+        self.stale_stocks = list()
+
+    def subscribe(self, codes):
+        for source in self.sources.values():
+            source.subscribe(codes)
+
+    def unsubscribe(self, codes):
+        for source in self.sources.values():
+            source.unsubscribe(codes)
+
+    @property
+    def subscribed(self):
+        return next(iter(self.sources.values())).subscribed
+
+    def refresh(self):
+        """
+        :return: dict {code: 行情}, 只有一个行情源返回结果时原样返回
+        """
+        candidates = self.__candidates()
+        if self.hedge_delay is None:
+            results = self.__refresh_all(candidates)
+        else:
+            results = self.__refresh_hedged(candidates)
+        if not results:
+            raise RuntimeError('所有行情源刷新失败: {}'.format(', '.join(candidates)))
+        result = self.merge(results)
+        self.stale_stocks = [code for code, quotation in result.items() if quotation.get('stale')]
+        return result
+
+    def merge(self, results):
+        """
+            按优先级逐只股票合并, 优先取未过期的行情
+        :param results: list 各行情源的结果, 按优先级排列
+        :return: dict {code: 行情}
+        """
+        if len(results) == 1:
+            return results[0]
+        merged = dict()
+        for result in results:
+            for code, quotation in result.items():
+                current = merged.get(code)
+                if current is None or (current.get('stale') and not quotation.get('stale')):
+                    merged[code] = quotation
+        return merged
+
+    def __candidates(self):
+        now = time.time()
+        busy = {name for name, future in self.__running.items() if not future.done()}
+        names = [name for name in self.sources if name not in busy]
+        healthy = [name for name in names if self.__suspended.get(name, 0) <= now]
+        return healthy or names or list(self.sources)
+
+    def __submit(self, name):
+        future = self.__running.get(name)
+        if future is None or future.done():
+            future = self.__executors[name].submit(self.__refresh_source, name)
+            self.__running[name] = future
+        return future
+
+    def __refresh_source(self, name):
+        source = self.sources[name]
+        start = time.perf_counter()
+        try:
+            result = source.refresh()
+        except Exception as e:
+            self.__fail(name, e)
+            raise
+        if not result and source.subscribed:
+            error = RuntimeError('{} 未返回任何行情'.format(name))
+            self.__fail(name, error)
+            raise error
+        self.latency[name].add(time.perf_counter() - start)
+        self.__suspended.pop(name, None)
+        return result
+
+    def __fail(self, name, error):
+        self.errors[name] += 1
+        self.__suspended[name] = time.time() + self.cooldown
+        self.log.warning('行情源 {} 刷新失败, {} 秒内切换到其它行情源: {}'.format(name, self.cooldown, error))
+
+    def __refresh_all(self, names):
+        futures = OrderedDict((name, self.__submit(name)) for name in names)
+        wait(futures.values(), self.refresh_timeout)
+        results = []
+        for name, future in futures.items():
+            if future.done() and future.exception() is None:
+                if not results:
+                    self.wins[name] += 1
+                results.append(future.result())
+        return results
+
+    def __refresh_hedged(self, names):
+        """
+            依次发起请求, 前一个请求超过 hedge_delay 未返回或出错时发起下一个, 返回最先成功的结果
+        """
+        deadline = time.time() + self.refresh_timeout
+        pending = dict()
+        queue = list(names)
+        while queue or pending:
+            if queue:
+                name = queue.pop(0)
+                pending[self.__submit(name)] = name
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            timeout = min(self.hedge_delay, remaining) if queue else remaining
+            done, _ = wait(pending, timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = pending.pop(future)
+                if future.exception() is None:
+                    self.wins[name] += 1
+                    return [future.result()]
+        return []
+
+    @property
+    def stats(self):
+        """
+        :return: dict 行情源 -> 刷新耗时(毫秒)、耗时分布、失败及胜出次数
+        """
+        stats = dict()
+        for name, latency in self.latency.items():
+            stats[name] = dict(latency.to_dict(),
+                               p50=round(latency.percentile(50) * 1000, 3),
+                               p90=round(latency.percentile(90) * 1000, 3),
+                               histogram=latency.histogram(),
+                               errors=self.errors[name],
+                               wins=self.wins[name])
+        return stats
+
+    def close(self):
+        for name, source in self.sources.items():
+            self.__executors[name].submit(source.close).result()
+            self.__executors[name].shutdown()
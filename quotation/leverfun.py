@@ -5,8 +5,8 @@ import logging
 class Leverfun(BasicQuotation):
     __crawl_api = 'https://app.leverfun.com/timelyInfo/timelyOrderForm?stockCode='
 
-    def __init__(self):
-        super(Leverfun, self).__init__(self.__crawl_api)
+    def __init__(self, **kwargs):
+        super(Leverfun, self).__init__(self.__crawl_api, **kwargs)
         self.log = logging.getLogger("LeverFun")
 
     def _format_response(self, response, stock):
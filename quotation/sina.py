@@ -1,4 +1,4 @@
-import re
+from quotation import sinaparser
 from quotation.basicquotation import BasicQuotation
 from utils.stockutil import get_stock_type
 import logging
@@ -6,56 +6,51 @@ import logging
 
 class Sina(BasicQuotation):
     __crawl_api = 'http://hq.sinajs.cn/?format=text&list='
-    __grep_detail = re.compile(r'(\d+)=([^\s][^,]+?)%s%s' % (r',([\.\d]+)' * 29, r',([-\.\d:]+)' * 2))
 
-    def __init__(self):
-        super(Sina, self).__init__(self.__crawl_api)
+    def __init__(self, batch_size=800, max_url_length=8000, **kwargs):
+        """
+        :param batch_size: 每次请求查询的股票数量, list 参数支持逗号分隔的多只股票
+        :param max_url_length: 每次请求的 url 最大长度, 超过时拆分为多次请求
+        """
+        super(Sina, self).__init__(self.__crawl_api, **kwargs)
         self.log = logging.getLogger("sina")
+        self.batch_size = batch_size
+        self.max_url_length = max_url_length
+
+    def _split_stocks(self, stocks):
+        """
+            按 batch_size 和 max_url_length 拆分, 每组至少一只股票
+        """
+        batches = []
+        batch = []
+        length = len(self.__crawl_api)
+        for code in stocks:
+            # 市场前缀 + 代码, 非首只股票另加逗号
+            size = len(get_stock_type(code)) + len(code) + (1 if batch else 0)
+            if batch and (len(batch) >= self.batch_size or length + size > self.max_url_length):
+                batches.append(batch)
+                batch = []
+                length = len(self.__crawl_api)
+                size -= 1
+            batch.append(code)
+            length += size
+        if batch:
+            batches.append(batch)
+        return batches
 
     def _curl_handle(self, crawl_api, param):
-        result = get_stock_type(param) + param
+        if type(param) is not list:
+            param = [param]
+        result = ','.join(get_stock_type(code) + code for code in param)
         return crawl_api + result
 
     def _format_response(self, response, stock):
-        result = self.__grep_detail.finditer(response)
-        stock_dict = dict()
-        for stock_match_object in result:
-            stock = stock_match_object.groups()
-            stock_dict[stock[0]] = dict(
-                name=stock[1],
-                open=float(stock[2]),
-                close=float(stock[3]),
-                now=float(stock[4]),
-                high=float(stock[5]),
-                low=float(stock[6]),
-                buy=float(stock[7]),
-                sell=float(stock[8]),
-                turnover=int(stock[9]),
-                volume=float(stock[10]),
-                bid1_volume=int(stock[11]),
-                bid1=float(stock[12]),
-                bid2_volume=int(stock[13]),
-                bid2=float(stock[14]),
-                bid3_volume=int(stock[15]),
-                bid3=float(stock[16]),
-                bid4_volume=int(stock[17]),
-                bid4=float(stock[18]),
-                bid5_volume=int(stock[19]),
-                bid5=float(stock[20]),
-                ask1_volume=int(stock[21]),
-                ask1=float(stock[22]),
-                ask2_volume=int(stock[23]),
-                ask2=float(stock[24]),
-                ask3_volume=int(stock[25]),
-                ask3=float(stock[26]),
-                ask4_volume=int(stock[27]),
-                ask4=float(stock[28]),
-                ask5_volume=int(stock[29]),
-                ask5=float(stock[30]),
-                date=stock[31],
-                time=stock[32],
-            )
-        return stock_dict
+        if self.ticks:
+            return sinaparser.parse_ticks(response, self._refresh_time)
+        return sinaparser.parse(response)
+
+    def _format_response_into(self, response, stock, snapshot):
+        sinaparser.parse_into(response, snapshot)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,188 @@
+"""
+    新浪行情解析
+    返回内容每行一只股票, 格式为 sh600887=名称,开盘,昨收,现价,...,日期,时间,...
+"""
+import re
+
+# 名称之后依次为 29 个数值字段, 再之后为日期和时间
+NUMBER_FIELDS = ('open', 'close', 'now', 'high', 'low', 'buy', 'sell', 'turnover', 'volume') + tuple(
+    name for side in ('bid', 'ask') for level in range(1, 6)
+    for name in ('{}{}_volume'.format(side, level), '{}{}'.format(side, level)))
+INT_FIELDS = ('turnover',) + tuple(field for field in NUMBER_FIELDS if field.endswith('_volume'))
+# 名称 + 29 个数值 + 日期 + 时间
+MIN_COLUMNS = len(NUMBER_FIELDS) + 3
+
+_INT_POSITIONS = tuple(i for i, field in enumerate(NUMBER_FIELDS) if field in INT_FIELDS)
+_DIGITS = '0123456789'
+
+_grep_detail = re.compile(r'(\d+)=([^\s][^,]+?)%s%s' % (r',([\.\d]+)' * 29, r',([-\.\d:]+)' * 2))
+
+
+def parse_regex(response):
+    """
+        正则解析, 保留用于对比测试和基准测试
+    :param response: 返回结果字符串
+    :return: dict {code: 行情}
+    """
+    stock_dict = dict()
+    for stock_match_object in _grep_detail.finditer(response):
+        stock = stock_match_object.groups()
+        stock_dict[stock[0]] = dict(
+            name=stock[1],
+            open=float(stock[2]),
+            close=float(stock[3]),
+            now=float(stock[4]),
+            high=float(stock[5]),
+            low=float(stock[6]),
+            buy=float(stock[7]),
+            sell=float(stock[8]),
+            turnover=int(stock[9]),
+            volume=float(stock[10]),
+            bid1_volume=int(stock[11]),
+            bid1=float(stock[12]),
+            bid2_volume=int(stock[13]),
+            bid2=float(stock[14]),
+            bid3_volume=int(stock[15]),
+            bid3=float(stock[16]),
+            bid4_volume=int(stock[17]),
+            bid4=float(stock[18]),
+            bid5_volume=int(stock[19]),
+            bid5=float(stock[20]),
+            ask1_volume=int(stock[21]),
+            ask1=float(stock[22]),
+            ask2_volume=int(stock[23]),
+            ask2=float(stock[24]),
+            ask3_volume=int(stock[25]),
+            ask3=float(stock[26]),
+            ask4_volume=int(stock[27]),
+            ask4=float(stock[28]),
+            ask5_volume=int(stock[29]),
+            ask5=float(stock[30]),
+            date=stock[31],
+            time=stock[32],
+        )
+    return stock_dict
+
+
+def _split(response):
+    """
+        按行拆分, 跳过空行情及列数不足的行
+    :return: generator (code, columns)
+    """
+    for line in response.splitlines():
+        key, sep, body = line.partition('=')
+        if not sep:
+            continue
+        columns = body.split(',')
+        if len(columns) < MIN_COLUMNS or not columns[0]:
+            continue
+        # 去掉 sh / sz 等前缀, 只保留末尾的数字代码
+        code = key[len(key.rstrip(_DIGITS)):]
+        if code:
+            yield code, columns
+
+
+def parse(response):
+    """
+        按分隔符解析, 结果与 parse_regex 一致
+    :param response: 返回结果字符串
+    :return: dict {code: 行情}
+    """
+    stock_dict = dict()
+    for code, columns in _split(response):
+        numbers = columns[1:MIN_COLUMNS - 2]
+        try:
+            quotation = dict(zip(NUMBER_FIELDS, map(float, numbers)))
+            for i in _INT_POSITIONS:
+                quotation[NUMBER_FIELDS[i]] = int(numbers[i])
+        except ValueError:
+            continue
+        quotation['name'] = columns[0]
+        quotation['date'] = columns[MIN_COLUMNS - 2]
+        quotation['time'] = columns[MIN_COLUMNS - 1]
+        stock_dict[code] = quotation
+    return stock_dict
+
+
+def parse_ticks(response, timestamp=None):
+    """
+        解析为定长 tick 记录, 不创建逐只股票的 dict
+    :param response: 返回结果字符串
+    :param timestamp: float 行情时间戳, 通常为本次刷新的时间
+    :return: dict {code: quotation.tick.Tick}
+    """
+    from quotation.tick import Tick
+
+    ticks = dict()
+    for code, columns in _split(response):
+        numbers = columns[1:MIN_COLUMNS - 2]
+        tick = Tick(code, timestamp)
+        try:
+            for field, number in zip(NUMBER_FIELDS, numbers):
+                setattr(tick, field, float(number))
+            for i in _INT_POSITIONS:
+                setattr(tick, NUMBER_FIELDS[i], int(numbers[i]))
+        except ValueError:
+            continue
+        tick.name = columns[0]
+        tick.date = columns[MIN_COLUMNS - 2]
+        tick.time = columns[MIN_COLUMNS - 1]
+        ticks[code] = tick
+    return ticks
+
+
+def parse_into(response, snapshot):
+    """
+        直接解析到列式快照的数组中, 不创建逐只股票的 dict
+    :param response: 返回结果字符串
+    :param snapshot: quotation.snapshot.Snapshot
+    :return: list 解析到的股票代码
+    """
+    import numpy as np
+
+    codes = []
+    rows = []
+    numbers = []
+    for code, columns in _split(response):
+        codes.append(code)
+        rows.append(columns)
+        numbers.extend(columns[1:MIN_COLUMNS - 2])
+    if not rows:
+        return codes
+    try:
+        matrix = np.array(numbers, dtype=np.float64)
+    except ValueError:
+        # 存在无法解析的行时, 与 parse 一样跳过这些行
+        pairs = [(code, columns) for code, columns in zip(codes, rows) if _is_number_row(columns)]
+        codes = [code for code, _ in pairs]
+        rows = [columns for _, columns in pairs]
+        matrix = np.array([number for columns in rows for number in columns[1:MIN_COLUMNS - 2]], dtype=np.float64)
+        if not rows:
+            return codes
+    matrix = matrix.reshape(len(rows), len(NUMBER_FIELDS))
+
+    index = [snapshot.index.add(code) for code in codes]
+    snapshot.grow()
+    names, dates, times = snapshot.texts['name'], snapshot.texts['date'], snapshot.texts['time']
+    for row, columns in zip(index, rows):
+        names[row] = columns[0]
+        dates[row] = columns[MIN_COLUMNS - 2]
+        times[row] = columns[MIN_COLUMNS - 1]
+    index = np.array(index, dtype=np.intp)
+    for i, field in enumerate(NUMBER_FIELDS):
+        snapshot.arrays[field][index] = matrix[:, i]
+    snapshot.valid[index] = True
+    snapshot.stale[index] = False
+    return codes
+
+
+def _is_number_row(columns):
+    try:
+        numbers = columns[1:MIN_COLUMNS - 2]
+        for number in numbers:
+            float(number)
+        for i in _INT_POSITIONS:
+            int(numbers[i])
+    except ValueError:
+        return False
+    return True
@@ -0,0 +1,185 @@
+from collections.abc import Mapping
+
+import numpy as np
+
+# 价格字段
+PRICE_FIELDS = ('open', 'close', 'now', 'high', 'low', 'buy', 'sell') + tuple(
+    '{}{}'.format(side, level) for side in ('bid', 'ask') for level in range(1, 6))
+# 成交量 / 盘口挂单量字段
+VOLUME_FIELDS = ('turnover', 'volume') + tuple(
+    '{}{}_volume'.format(side, level) for side in ('bid', 'ask') for level in range(1, 6))
+# 按行取出时转换为 int 的字段, 与 dict 格式的行情保持一致
+INT_FIELDS = ('turnover',) + VOLUME_FIELDS[2:]
+# 数值字段, 每个字段一个 float64 数组
+FIELDS = PRICE_FIELDS + VOLUME_FIELDS
+# 文本字段, 每个字段一个 list
+TEXT_FIELDS = ('name', 'date', 'time')
+
+
+class SymbolIndex:
+    """
+        股票代码 -> 行号, 只增不减, 保证同一只股票在每次刷新的快照中行号不变
+    """
+
+    def __init__(self, codes=None):
+        self.codes = list()
+        self.rows = dict()
+        if codes:
+            self.extend(codes)
+
+    def add(self, code):
+        row = self.rows.get(code)
+        if row is None:
+            row = len(self.codes)
+            self.rows[code] = row
+            self.codes.append(code)
+        return row
+
+    def extend(self, codes):
+        for code in codes:
+            self.add(code)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, code):
+        return code in self.rows
+
+
+class Snapshot(Mapping):
+    """
+        列式行情快照, 每个字段一个按 SymbolIndex 行号排列的数组, 便于对全市场向量化计算
+        同时保留 dict 的访问方式, snapshot[code] 返回该股票的行情 dict
+
+        >>> snapshot = Snapshot.from_dict({'600887': {'now': 17.5, 'bid1': 17.49}})
+        >>> float(snapshot.column('now')[snapshot.index.rows['600887']])
+        17.5
+        >>> snapshot['600887']['bid1']
+        17.49
+    """
+
+    def __init__(self, index, size=None):
+        """
+        :param index: SymbolIndex
+        :param size: 快照行数, 缺省为 index 当前的股票数
+        """
+        self.index = index
+        self.size = len(index) if size is None else size
+        self.arrays = {field: np.full(self.size, np.nan) for field in FIELDS}
+        self.texts = {field: [None] * self.size for field in TEXT_FIELDS}
+        # 本次快照中是否有该行的行情
+        self.valid = np.zeros(self.size, dtype=bool)
+        # 该行是否沿用了上一次的行情
+        self.stale = np.zeros(self.size, dtype=bool)
+
+    @classmethod
+    def from_dict(cls, data, index=None):
+        """
+        :param data: dict 格式的行情 {code: {field: value}}
+        :param index: SymbolIndex, 缺省新建
+        :return: Snapshot
+        """
+        index = index if index is not None else SymbolIndex()
+        index.extend(data.keys())
+        snapshot = cls(index)
+        for code, quotation in data.items():
+            snapshot.set(code, quotation)
+        return snapshot
+
+    def set(self, code, quotation):
+        """
+            写入一只股票的行情
+        :param code: 股票代码
+        :param quotation: dict 行情
+        """
+        row = self.add(code)
+        for field in FIELDS:
+            value = quotation.get(field)
+            if value is not None:
+                self.arrays[field][row] = value
+        for field in TEXT_FIELDS:
+            self.texts[field][row] = quotation.get(field)
+        self.stale[row] = bool(quotation.get('stale'))
+        self.valid[row] = True
+
+    def add(self, code):
+        """
+            返回股票的行号, 不在 index 中的股票追加到 index, 并扩充数组
+        :param code: 股票代码
+        :return: int 行号
+        """
+        row = self.index.add(code)
+        if row >= self.size:
+            self.grow()
+        return row
+
+    def grow(self):
+        """数组扩充到 index 当前的股票数, 新增的行为 nan / None"""
+        size = len(self.index)
+        if size <= self.size:
+            return
+        extra = size - self.size
+        for field, array in self.arrays.items():
+            self.arrays[field] = np.concatenate((array, np.full(extra, np.nan)))
+        for values in self.texts.values():
+            values.extend([None] * extra)
+        self.valid = np.concatenate((self.valid, np.zeros(extra, dtype=bool)))
+        self.stale = np.concatenate((self.stale, np.zeros(extra, dtype=bool)))
+        self.size = size
+
+    def column(self, field):
+        """
+        :param field: 字段名, 如 now / bid1 / ask1_volume / name
+        :return: np.ndarray 或 list, 按 index 行号排列, 无行情的行为 nan / None
+        """
+        if field in self.arrays:
+            return self.arrays[field]
+        if field in self.texts:
+            return self.texts[field]
+        raise KeyError(field)
+
+    @property
+    def codes(self):
+        return self.index.codes[:self.size]
+
+    def row(self, row):
+        """
+        :param row: 行号
+        :return: dict 该行的行情, 与 dict 格式的行情字段一致
+        """
+        quotation = dict()
+        for field in FIELDS:
+            value = self.arrays[field][row]
+            if value == value:
+                quotation[field] = int(value) if field in INT_FIELDS else float(value)
+        for field in TEXT_FIELDS:
+            value = self.texts[field][row]
+            if value is not None:
+                quotation[field] = value
+        if self.stale[row]:
+            quotation['stale'] = True
+        return quotation
+
+    def to_dict(self):
+        return {code: self[code] for code in self}
+
+    def __repr__(self):
+        return 'Snapshot(%r)' % self.to_dict()
+
+    def __getitem__(self, code):
+        row = self.index.rows.get(code)
+        if row is None or row >= self.size or not self.valid[row]:
+            raise KeyError(code)
+        return self.row(row)
+
+    def __contains__(self, code):
+        row = self.index.rows.get(code)
+        return row is not None and row < self.size and bool(self.valid[row])
+
+    def __iter__(self):
+        codes = self.index.codes
+        for row in np.flatnonzero(self.valid):
+            yield codes[row]
+
+    def __len__(self):
+        return int(self.valid.sum())
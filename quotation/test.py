@@ -0,0 +1,359 @@
+import asyncio
+import datetime
+import json
+import os
+import pickle
+import tempfile
+import timeit
+import time
+import tracemalloc
+import unittest
+
+from dateutil import tz
+
+from engine.flashback_engine import tick_feed
+from . import sinaparser
+from .basicquotation import BasicQuotation
+from .barstore import BarStore, from_chartlist
+from .composite import Composite
+from .sina import Sina
+from .snapshot import Snapshot, SymbolIndex
+from .tickstore import TickReader, TickWriter, day_of
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(__file__), 'testdata')
+
+
+def load_test_data(name):
+    with open(os.path.join(TEST_DATA_DIR, name), encoding='utf-8') as f:
+        return f.read()
+
+
+class SinaParserTest(unittest.TestCase):
+    def setUp(self):
+        self.response = load_test_data('sina.txt')
+        self.golden = json.loads(load_test_data('sina.json'))
+
+    def test_regex_golden(self):
+        self.assertEqual(sinaparser.parse_regex(self.response), self.golden)
+
+    def test_parse_golden(self):
+        self.assertEqual(sinaparser.parse(self.response), self.golden)
+
+    def test_parse_into_golden(self):
+        snapshot = Snapshot(SymbolIndex(['600887']))
+        codes = sinaparser.parse_into(self.response, snapshot)
+        self.assertEqual(sorted(codes), sorted(self.golden))
+        self.assertEqual(snapshot.to_dict(), self.golden)
+
+    def test_parse_ticks_golden(self):
+        ticks = sinaparser.parse_ticks(self.response, timestamp=1.0)
+        self.assertEqual({code: tick.to_dict() for code, tick in ticks.items()}, self.golden)
+        tick = ticks['600887']
+        self.assertEqual(tick['now'], tick.last)
+        self.assertEqual(tick.bids[0], (tick['bid1'], tick['bid1_volume']))
+        self.assertEqual(pickle.loads(pickle.dumps(tick)), tick)
+        self.assertTrue(tick.replace(stale=True)['stale'])
+
+    def test_skip_bad_row(self):
+        response = self.response.replace('17.560', 'x', 1)
+        snapshot = Snapshot(SymbolIndex())
+        sinaparser.parse_into(response, snapshot)
+        self.assertNotIn('600887', sinaparser.parse(response))
+        self.assertNotIn('600887', snapshot)
+        self.assertIn('000001', snapshot)
+
+
+class SnapshotTest(unittest.TestCase):
+    def test_symbol_index(self):
+        index = SymbolIndex(['600887', '000001', '600887'])
+        self.assertEqual(index.codes, ['600887', '000001'])
+        self.assertEqual(index.add('000001'), 1)
+        self.assertEqual(index.add('150176'), 2)
+        self.assertIn('150176', index)
+        self.assertNotIn('601717', index)
+        self.assertEqual(len(index), 3)
+
+    def test_lookups(self):
+        index = SymbolIndex(['600887', '000001'])
+        snapshot = Snapshot(index)
+        snapshot.set('000001', {'now': 10.5, 'volume': 100, 'bid1_volume': 300, 'name': '平安银行'})
+        self.assertIn('000001', snapshot)
+        self.assertNotIn('600887', snapshot)
+        self.assertRaises(KeyError, lambda: snapshot['600887'])
+        self.assertEqual(snapshot['000001'], {'now': 10.5, 'volume': 100.0, 'bid1_volume': 300,
+                                              'name': '平安银行'})
+        self.assertIs(type(snapshot['000001']['bid1_volume']), int)
+        self.assertEqual(list(snapshot), ['000001'])
+        self.assertEqual(len(snapshot), 1)
+        self.assertEqual(snapshot.get('600887'), None)
+        self.assertRaises(KeyError, snapshot.column, 'unknown')
+
+        # 新股票追加到 index 末尾并扩充数组, 已有股票的行号不变
+        snapshot.set('150176', {'now': 0.8, 'stale': True})
+        self.assertEqual(index.rows, {'600887': 0, '000001': 1, '150176': 2})
+        self.assertEqual(snapshot.size, 3)
+        self.assertEqual(snapshot.column('now')[2], 0.8)
+        self.assertTrue(snapshot['150176']['stale'])
+        self.assertEqual(snapshot.column('name'), [None, '平安银行', None])
+
+        # 同一 index 的下一次快照沿用行号
+        following = Snapshot(index)
+        following.set('150176', {'now': 0.81})
+        self.assertEqual(following.codes, ['600887', '000001', '150176'])
+        self.assertEqual(following.column('now')[2], 0.81)
+        self.assertEqual(following.to_dict(), {'150176': {'now': 0.81}})
+
+
+class TickStoreTest(unittest.TestCase):
+    def test_write_and_scan(self):
+        data = sinaparser.parse(load_test_data('sina.txt'))
+        with tempfile.TemporaryDirectory() as root:
+            writer = TickWriter(root, batch_size=len(data))
+            writer.append(1480572000.0, data)
+            writer.append(1480572003.0, Snapshot.from_dict(data))
+            writer.append(1480572006.0, {'600887': data['600887']})
+            writer.close()
+
+            reader = TickReader(root)
+            day = reader.days()[0]
+            self.assertEqual(len(reader.read(day)), len(data) * 2 + 1)
+
+            ticks = reader.read(day, symbols=['600887'], start=1480572003.0)
+            self.assertEqual(list(ticks['timestamp']), [1480572003.0, 1480572006.0])
+            self.assertEqual(ticks['now'][0], data['600887']['now'])
+
+            ticks = reader.read(day, symbol_range=('000000', '159999'), end=1480572000.0)
+            self.assertEqual(sorted(ticks['symbol']), [b'000001', b'150176'])
+            # 两个代码的列表是成员筛选, 不是区间
+            ticks = reader.read(day, symbols=['000001', '600887'], end=1480572000.0)
+            self.assertEqual(sorted(ticks['symbol']), [b'000001', b'600887'])
+            self.assertEqual(len(reader.read(day, symbols=[])), 0)
+
+    def test_stale_and_timezone(self):
+        tzinfo = tz.gettz('Asia/Shanghai')
+        # 上海时间 2016-12-02 07:00, UTC 时间仍为 12-01
+        timestamp = datetime.datetime(2016, 12, 2, 7, tzinfo=tzinfo).timestamp()
+        self.assertEqual(day_of(timestamp, tzinfo), '20161202')
+        self.assertEqual(day_of(timestamp, tz.tzutc()), '20161201')
+        with tempfile.TemporaryDirectory() as root:
+            writer = TickWriter(root, tzinfo=tzinfo)
+            writer.append(timestamp, {'600887': {'now': 17.5}, '000001': {'now': 9.1, 'stale': True}})
+            writer.close()
+            reader = TickReader(root)
+            self.assertEqual(reader.days(), ['20161202'])
+            ticks = {tick.symbol: tick for _, _, tick in tick_feed(reader, '20161202')}
+            self.assertTrue(ticks['000001']['stale'])
+            self.assertIsNone(ticks['600887'].get('stale'))
+            self.assertEqual(ticks['600887'].timestamp, timestamp)
+
+
+class BarStoreTest(unittest.TestCase):
+    def test_save_and_load(self):
+        chartlist = [dict(timestamp=ts * 1000, open=1, high=2, low=0.5, close=1.5, volume=100) for ts in (300, 100, 200)]
+        with tempfile.TemporaryDirectory() as root:
+            store = BarStore(root)
+            store.save('600887', from_chartlist(chartlist))
+            store.save('600887', from_chartlist([dict(chartlist[0], close=1.8)]))
+            bars = store.load('600887', start=150)
+            self.assertEqual(list(bars['timestamp']), [200, 300])
+            self.assertEqual(bars['close'][-1], 1.8)
+            self.assertEqual(store.symbols(), ['600887'])
+
+
+class SlowQuotation(BasicQuotation):
+    """
+        不访问网络的行情源, 每只股票按 delays 中的秒数延迟返回, 并记录同时进行的请求数
+    """
+
+    def __init__(self, delays, **kwargs):
+        super(SlowQuotation, self).__init__('fake://', **kwargs)
+        self.delays = delays
+        self.running = 0
+        self.max_running = 0
+        self.subscribe(list(delays))
+
+    async def _fetch(self, url, stock):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(self.delays[stock])
+        finally:
+            self.running -= 1
+        return self._decode(url, stock)
+
+    def _format_response(self, response, stock):
+        return {stock: {'now': 1.0, 'url': response}}
+
+
+class BasicQuotationTest(unittest.TestCase):
+    def test_session_reuse_and_close(self):
+        q = SlowQuotation({'600887': 0})
+
+        async def sessions():
+            first, second = q._get_session(), q._get_session()
+            await first.close()
+            return first, second, q._get_session()
+
+        first, second, third = q.event_loop.run_until_complete(sessions())
+        self.assertIs(first, second)
+        # 会话关闭后重新创建
+        self.assertIsNot(third, first)
+        q.close()
+        self.assertTrue(third.closed)
+        self.assertTrue(q.event_loop.is_closed())
+        self.assertIsNone(q._session)
+        q.close()
+
+    def test_concurrency_limit(self):
+        q = SlowQuotation({'%06d' % i: 0.02 for i in range(10)}, concurrency=3)
+        result = q.refresh()
+        self.assertEqual(len(result), 10)
+        self.assertEqual(q.max_running, 3)
+        self.assertEqual(q.stale_stocks, [])
+        q.close()
+
+    def test_request_timeout_and_stale_fill(self):
+        q = SlowQuotation({'600887': 0, '000001': 1}, request_timeout=0.1, refresh_timeout=5)
+        result = q.refresh()
+        self.assertEqual(q.stale_stocks, ['000001'])
+        self.assertFalse(result['600887'].get('stale'))
+        # 首次获取就超时的股票只有过期标记
+        self.assertEqual(result['000001'], {'stale': True})
+
+        q.delays['000001'] = 0
+        self.assertNotIn('stale', q.refresh()['000001'])
+        q.delays['000001'] = 1
+        result = q.refresh()
+        self.assertEqual(result['000001'], {'now': 1.0, 'url': 'fake://000001', 'stale': True})
+        q.close()
+
+    def test_refresh_timeout(self):
+        codes = ['%06d' % i for i in range(5)]
+        q = SlowQuotation({code: 0.1 for code in codes}, concurrency=1, request_timeout=1, refresh_timeout=0.25)
+        start = time.time()
+        result = q.refresh()
+        self.assertLess(time.time() - start, 0.5)
+        fresh = [code for code in codes if not result[code].get('stale')]
+        self.assertEqual(fresh, codes[:len(fresh)])
+        self.assertGreaterEqual(len(fresh), 1)
+        self.assertEqual(q.stale_stocks, codes[len(fresh):])
+        self.assertEqual(sorted(result), codes)
+        q.close()
+
+
+class SinaTest(unittest.TestCase):
+    def test_split_at_url_limit(self):
+        api = 'http://hq.sinajs.cn/?format=text&list='
+        codes = ['%06d' % i for i in range(600000, 602000)]
+        q = Sina(batch_size=800)
+        self.assertEqual([len(batch) for batch in q._split_stocks(codes)], [800, 800, 400])
+
+        # 每只股票占 9 个字符(含逗号), url 长度先于数量达到上限
+        q.max_url_length = 4000
+        batches = q._split_stocks(codes)
+        self.assertEqual(sum(batches, []), codes)
+        self.assertEqual(len(batches[0]), (4000 - len(api) + 1) // 9)
+        for batch in batches:
+            self.assertLessEqual(len(q._curl_handle(api, batch)), 4000)
+        self.assertGreater(len(q._curl_handle(api, batches[0] + batches[1][:1])), 4000)
+        q.close()
+
+
+class FakeSource:
+    def __init__(self, result, delay=0.0, error=None):
+        self.result = result
+        self.delay = delay
+        self.error = error
+        self.subscribed = ['600887', '000001']
+        self.refresh_timeout = 2
+
+    def refresh(self):
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return self.result
+
+    def close(self):
+        pass
+
+
+class CompositeTest(unittest.TestCase):
+    def test_merge_prefers_fresh(self):
+        primary = FakeSource({'600887': {'now': 1.0}, '000001': {'now': 2.0, 'stale': True}})
+        secondary = FakeSource({'000001': {'now': 2.5}})
+        q = Composite([primary, secondary])
+        self.assertEqual(q.refresh(), {'600887': {'now': 1.0}, '000001': {'now': 2.5}})
+        self.assertEqual(list(q.stats), ['fakesource', 'fakesource1'])
+        q.close()
+
+    def test_hedged_and_failover(self):
+        slow = FakeSource({'600887': {'now': 1.0}}, delay=0.5)
+        fast = FakeSource({'600887': {'now': 1.1}})
+        q = Composite({'slow': slow, 'fast': fast}, hedge_delay=0.05)
+        self.assertEqual(q.refresh(), {'600887': {'now': 1.1}})
+        self.assertEqual(q.wins, {'slow': 0, 'fast': 1})
+
+        broken = FakeSource(None, error=IOError('down'))
+        q = Composite({'broken': broken, 'fast': fast}, hedge_delay=1)
+        start = time.time()
+        self.assertEqual(q.refresh(), {'600887': {'now': 1.1}})
+        # 出错后立即切换, 不等待 hedge_delay
+        self.assertLess(time.time() - start, 0.5)
+        self.assertEqual(q.errors['broken'], 1)
+        q.close()
+
+
+def benchmark(size=5000, number=20):
+    """
+        全市场规模的解析耗时对比
+        python -m quotation.test
+    """
+    lines = [line for line in load_test_data('sina.txt').splitlines() if len(line.split(',')) > 30]
+    response = '\n'.join('sh{:0>6}={}'.format(i, lines[i % len(lines)].partition('=')[2]) for i in range(size))
+    index = SymbolIndex()
+    cases = (
+        ('regex', lambda: sinaparser.parse_regex(response)),
+        ('split', lambda: sinaparser.parse(response)),
+        ('split_into', lambda: sinaparser.parse_into(response, Snapshot(index))),
+    )
+    for name, func in cases:
+        cost = min(timeit.repeat(func, number=number, repeat=3)) / number
+        print('{:<12}{:>6}只 {:>8.2f}ms'.format(name, size, cost * 1000))
+
+
+def memory_benchmark(size=5000, interval=3, session_hours=4):
+    """
+        全市场每次刷新的行情对象内存占用及分配次数, dict / 定长 tick 记录 / 列式快照
+        python -m quotation.test
+    :param interval: 行情刷新间隔, 秒, 用于估算一个交易日的分配量
+    """
+    lines = [line for line in load_test_data('sina.txt').splitlines() if len(line.split(',')) > 30]
+    response = '\n'.join('sh{:0>6}={}'.format(i, lines[i % len(lines)].partition('=')[2]) for i in range(size))
+    index = SymbolIndex()
+
+    def parse_snapshot():
+        snapshot = Snapshot(index)
+        sinaparser.parse_into(response, snapshot)
+        return snapshot
+
+    cases = (
+        ('dict', lambda: sinaparser.parse(response)),
+        ('tick', lambda: sinaparser.parse_ticks(response, 0.0)),
+        ('snapshot', parse_snapshot),
+    )
+    refreshes = session_hours * 3600 // interval
+    for name, func in cases:
+        func()
+        tracemalloc.start()
+        result = func()
+        current, _ = tracemalloc.get_traced_memory()
+        blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+        tracemalloc.stop()
+        del result
+        print('{:<12}{:>6}只 每次刷新 {:>8.2f}MB {:>8}次分配, 每交易日累计分配 {:>6.1f}GB'.format(
+            name, size, current / 2 ** 20, blocks, current * refreshes / 2 ** 30))
+
+
+if __name__ == '__main__':
+    benchmark()
+    memory_benchmark()
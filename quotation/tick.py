@@ -0,0 +1,142 @@
+"""
+    定长 tick 记录
+    一只股票一次刷新的行情, 字段固定为 股票代码、时间戳、现价等数值字段、五档盘口以及名称 / 日期 / 时间
+    使用 __slots__, 不为每个对象创建 __dict__, 全市场逐只推送时内存占用和分配次数都低于 dict 格式的行情
+    保留 dict 的读取方式 tick['now'] / tick.get('bid1'), 已有策略无需修改
+
+    >>> tick = Tick.from_dict('600887', {'now': 17.5, 'bid1': 17.49, 'bid1_volume': 100}, timestamp=1.0)
+    >>> tick.last, tick['bid1'], tick.bids[0]
+    (17.5, 17.49, (17.49, 100))
+    >>> tick.get('ask1') is None
+    True
+"""
+from quotation.snapshot import FIELDS, INT_FIELDS, TEXT_FIELDS
+
+LEVELS = 5
+# 可按 tick[field] 读取的字段, 未提供的字段为 None, 读取时与 dict 一样视为不存在
+QUOTATION_FIELDS = FIELDS + TEXT_FIELDS
+_FIELD_SET = frozenset(QUOTATION_FIELDS)
+
+
+class Tick:
+    __slots__ = ('symbol', 'timestamp', 'stale') + QUOTATION_FIELDS
+
+    def __init__(self, symbol, timestamp=None, stale=False):
+        """
+        :param symbol: 股票代码
+        :param timestamp: float 行情时间戳
+        :param stale: 是否沿用了上一次的行情
+        """
+        self.symbol = symbol
+        self.timestamp = timestamp
+        self.stale = stale
+        for field in QUOTATION_FIELDS:
+            setattr(self, field, None)
+
+    @classmethod
+    def from_dict(cls, symbol, quotation, timestamp=None):
+        """
+        :param symbol: 股票代码
+        :param quotation: dict 格式的行情
+        :param timestamp: float 行情时间戳
+        :return: Tick
+        """
+        tick = cls(symbol, timestamp, bool(quotation.get('stale')))
+        for field in QUOTATION_FIELDS:
+            value = quotation.get(field)
+            if value is not None:
+                setattr(tick, field, value)
+        return tick
+
+    @classmethod
+    def from_record(cls, record):
+        """
+        :param record: quotation.tickstore.TICK_DTYPE 的一行
+        :return: Tick
+        """
+        tick = cls(record['symbol'].decode(), float(record['timestamp']), bool(record['stale']))
+        for field in FIELDS:
+            value = record[field]
+            if value == value:
+                setattr(tick, field, int(value) if field in INT_FIELDS else float(value))
+        return tick
+
+    @property
+    def last(self):
+        """最新成交价"""
+        return self.now
+
+    @property
+    def bids(self):
+        """
+        :return: tuple 买一至买五的 (价格, 挂单量)
+        """
+        return tuple((getattr(self, 'bid%d' % level), getattr(self, 'bid%d_volume' % level))
+                     for level in range(1, LEVELS + 1))
+
+    @property
+    def asks(self):
+        """
+        :return: tuple 卖一至卖五的 (价格, 挂单量)
+        """
+        return tuple((getattr(self, 'ask%d' % level), getattr(self, 'ask%d_volume' % level))
+                     for level in range(1, LEVELS + 1))
+
+    def replace(self, **changes):
+        """
+        :return: Tick 修改部分字段后的副本
+        """
+        tick = Tick.__new__(Tick)
+        for field in self.__slots__:
+            setattr(tick, field, changes.get(field, getattr(self, field)))
+        return tick
+
+    def to_dict(self):
+        """
+        :return: dict 与 dict 格式的行情字段一致
+        """
+        return dict(self.items())
+
+    def keys(self):
+        return [field for field, _ in self.items()]
+
+    def items(self):
+        for field in QUOTATION_FIELDS:
+            value = getattr(self, field)
+            if value is not None:
+                yield field, value
+        if self.stale:
+            yield 'stale', True
+
+    def get(self, field, default=None):
+        if field in _FIELD_SET:
+            value = getattr(self, field)
+        else:
+            # 与 dict 格式一致, 只有过期的行情才有 stale 字段
+            value = True if field == 'stale' and self.stale else None
+        return default if value is None else value
+
+    def __getitem__(self, field):
+        value = self.get(field)
+        if value is None:
+            raise KeyError(field)
+        return value
+
+    def __contains__(self, field):
+        return self.get(field) is not None
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if not isinstance(other, Tick):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in self.__slots__)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'Tick(%s, %s, %r)' % (self.symbol, self.timestamp, self.to_dict())
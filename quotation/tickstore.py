@@ -0,0 +1,250 @@
+"""
+    本地 tick 存储
+    每个交易日一个文件 YYYYMMDD.tick, 文件由追加写入的数据块组成, 每个数据块为
+        块头: magic, 行数, 压缩后长度, 最小/最大时间戳, 最小/最大股票代码
+        数据: zlib 压缩的 numpy 结构化数组, 每行为一只股票一次刷新的行情, 时间戳为行情的获取时间
+    读取时通过 mmap 只扫描块头, 按时间和股票代码范围筛选后才解压对应的数据块
+"""
+import datetime
+import mmap
+import os
+import struct
+import zlib
+from threading import Lock
+
+import numpy as np
+
+from quotation.snapshot import FIELDS, Snapshot
+
+MAGIC = b'TCK2'
+HEADER = struct.Struct('<4sIIdd8s8s')
+SUFFIX = '.tick'
+TICK_DTYPE = np.dtype([('symbol', 'S8'), ('timestamp', 'f8'), ('stale', '?')] + [(field, 'f8') for field in FIELDS])
+# 旧格式的数据块没有 stale 字段, 读取时转换为 TICK_DTYPE
+LEGACY_DTYPES = {b'TCK1': np.dtype([('symbol', 'S8'), ('timestamp', 'f8')] + [(field, 'f8') for field in FIELDS])}
+
+# fsync 策略: 每写一个数据块 / 只在切换文件和关闭时 / 从不
+FSYNC_BATCH = 'batch'
+FSYNC_ROTATE = 'rotate'
+FSYNC_NEVER = 'never'
+
+
+def day_of(timestamp, tzinfo=None):
+    """
+    :param timestamp: float 时间戳
+    :param tzinfo: 时区, 缺省为当地时区
+    :return: str tzinfo 时区的日期 YYYYMMDD
+    """
+    return datetime.datetime.fromtimestamp(timestamp, tzinfo).strftime('%Y%m%d')
+
+
+def to_records(timestamp, data):
+    """
+        一次刷新的行情转换为结构化数组
+    :param timestamp: float 刷新时间戳
+    :param data: dict {code: 行情} 或 Snapshot
+    :return: np.ndarray TICK_DTYPE
+    """
+    if isinstance(data, Snapshot):
+        rows = np.flatnonzero(data.valid)
+        records = np.zeros(len(rows), dtype=TICK_DTYPE)
+        records['symbol'] = [data.index.codes[row] for row in rows]
+        records['stale'] = data.stale[rows]
+        for field in FIELDS:
+            records[field] = data.arrays[field][rows]
+    else:
+        records = np.zeros(len(data), dtype=TICK_DTYPE)
+        records['symbol'] = list(data.keys())
+        records['stale'] = [bool(quotation.get('stale')) for quotation in data.values()]
+        for field in FIELDS:
+            records[field] = [quotation.get(field, np.nan) for quotation in data.values()]
+    records['timestamp'] = timestamp
+    return records
+
+
+class TickWriter:
+    """
+        按交易日追加写入 tick 文件, 线程安全
+    """
+
+    def __init__(self, root, batch_size=10000, fsync=FSYNC_ROTATE, level=1, tzinfo=None):
+        """
+        :param root: 存储目录
+        :param batch_size: 缓冲的行数达到该值时写入一个数据块
+        :param fsync: fsync 策略 FSYNC_BATCH / FSYNC_ROTATE / FSYNC_NEVER
+        :param level: zlib 压缩级别
+        :param tzinfo: 按该时区的日期切分文件, 应与时钟引擎的时区一致, 缺省为当地时区
+        """
+        self.root = root
+        self.tzinfo = tzinfo
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self.level = level
+        self.day = None
+        self.__file = None
+        self.__buffer = []
+        self.__buffer_rows = 0
+        self.__lock = Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, day):
+        return os.path.join(self.root, day + SUFFIX)
+
+    def append(self, timestamp, data):
+        """
+        :param timestamp: float 刷新时间戳
+        :param data: dict {code: 行情} 或 Snapshot
+        :return:
+        """
+        records = to_records(timestamp, data)
+        if not len(records):
+            return
+        with self.__lock:
+            day = day_of(timestamp, self.tzinfo)
+            if self.day is not None and day != self.day:
+                self.__rotate()
+            self.day = day
+            self.__buffer.append(records)
+            self.__buffer_rows += len(records)
+            if self.__buffer_rows >= self.batch_size:
+                self.__flush()
+
+    def flush(self):
+        """写入缓冲中的行情"""
+        with self.__lock:
+            self.__flush()
+
+    def rotate(self):
+        """写入缓冲并关闭当前文件, 下次写入时按日期打开新文件"""
+        with self.__lock:
+            self.__rotate()
+
+    def close(self):
+        self.rotate()
+
+    def __flush(self):
+        if not self.__buffer:
+            return
+        records = np.concatenate(self.__buffer)
+        self.__buffer = []
+        self.__buffer_rows = 0
+        payload = zlib.compress(records.tobytes(), self.level)
+        symbols = np.sort(records['symbol'])
+        header = HEADER.pack(MAGIC, len(records), len(payload),
+                             records['timestamp'].min(), records['timestamp'].max(),
+                             symbols[0], symbols[-1])
+        if self.__file is None:
+            self.__file = open(self.path(self.day), 'ab')
+        self.__file.write(header + payload)
+        self.__file.flush()
+        if self.fsync == FSYNC_BATCH:
+            os.fsync(self.__file.fileno())
+
+    def __rotate(self):
+        self.__flush()
+        if self.__file is not None:
+            if self.fsync != FSYNC_NEVER:
+                os.fsync(self.__file.fileno())
+            self.__file.close()
+            self.__file = None
+        self.day = None
+
+
+class TickReader:
+    """
+        读取 tick 文件
+        >>> reader = TickReader('ticks')                                        # doctest: +SKIP
+        >>> ticks = reader.read('20161201', symbol_range=('600000', '601999'))  # doctest: +SKIP
+        >>> ticks = reader.read('20161201', symbols=['600000', '601999'])       # doctest: +SKIP
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def days(self):
+        """
+        :return: list 已存储的交易日, 升序
+        """
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name[:-len(SUFFIX)] for name in os.listdir(self.root) if name.endswith(SUFFIX))
+
+    def scan(self, day, symbols=None, start=None, end=None, symbol_range=None):
+        """
+            逐个数据块读取, 只解压与筛选条件有交集的数据块
+        :param day: str YYYYMMDD
+        :param symbols: 代码列表
+        :param start: float 起始时间戳(含)
+        :param end: float 结束时间戳(含)
+        :param symbol_range: tuple (起始代码, 结束代码) 闭区间, 与 symbols 同时指定时两者都需满足
+        :return: generator np.ndarray TICK_DTYPE
+        """
+        path = os.path.join(self.root, day + SUFFIX)
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return
+        low, high, members = self.__symbol_filter(symbols, symbol_range)
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            offset = 0
+            size = len(mm)
+            while offset + HEADER.size <= size:
+                magic, rows, length, ts_min, ts_max, sym_min, sym_max = HEADER.unpack_from(mm, offset)
+                if magic != MAGIC and magic not in LEGACY_DTYPES:
+                    raise ValueError('{} 在偏移 {} 处的数据块格式错误'.format(path, offset))
+                begin = offset + HEADER.size
+                offset = begin + length
+                if offset > size:
+                    # 最后一个数据块未写完整
+                    break
+                if start is not None and ts_max < start or end is not None and ts_min > end:
+                    continue
+                if low is not None and (sym_max.rstrip(b'\0') < low or sym_min.rstrip(b'\0') > high):
+                    continue
+                records = np.frombuffer(zlib.decompress(mm[begin:offset]), dtype=LEGACY_DTYPES.get(magic, TICK_DTYPE),
+                                        count=rows)
+                if magic != MAGIC:
+                    records = self.__upgrade(records)
+                mask = np.ones(rows, dtype=bool)
+                if start is not None:
+                    mask &= records['timestamp'] >= start
+                if end is not None:
+                    mask &= records['timestamp'] <= end
+                if members is not None:
+                    mask &= np.isin(records['symbol'], members)
+                if low is not None:
+                    mask &= (records['symbol'] >= low) & (records['symbol'] <= high)
+                if mask.any():
+                    yield records[mask]
+
+    def read(self, day, symbols=None, start=None, end=None, symbol_range=None):
+        """
+            参数同 scan
+        :return: np.ndarray TICK_DTYPE, 按写入顺序排列
+        """
+        chunks = list(self.scan(day, symbols, start, end, symbol_range))
+        if not chunks:
+            return np.zeros(0, dtype=TICK_DTYPE)
+        return np.concatenate(chunks)
+
+    @staticmethod
+    def __symbol_filter(symbols, symbol_range):
+        """
+        :return: tuple (最小代码, 最大代码, 代码数组), 数据块的代码范围与 [最小代码, 最大代码] 无交集时跳过
+        """
+        low = high = members = None
+        if symbol_range is not None:
+            low, high = (symbol.encode() for symbol in symbol_range)
+        if symbols is not None:
+            members = np.sort(np.array([symbol.encode() for symbol in symbols], dtype='S8'))
+            if not len(members):
+                # 空列表不匹配任何股票
+                return b'\xff', b'', members
+            low = max(low, bytes(members[0])) if low is not None else bytes(members[0])
+            high = min(high, bytes(members[-1])) if high is not None else bytes(members[-1])
+        return low, high, members
+
+    @staticmethod
+    def __upgrade(records):
+        upgraded = np.zeros(len(records), dtype=TICK_DTYPE)
+        for name in records.dtype.names:
+            upgraded[name] = records[name]
+        return upgraded
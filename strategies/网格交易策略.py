@@ -9,6 +9,7 @@ import utils.stockutil as sutils
 
 class Strategy(StrategyTemplate):
     name = '网格交易策略'
+    clocks = ['open', 'close', 5]
     strategy_dir = os.path.dirname(__file__)
     tmp_file_path = strategy_dir + '/' + name + '.tmp'
     config_file_path = strategy_dir + '/' + name + '.json'
@@ -1,2 +1,10 @@
 from .api import *
-from .yjbtrader import YJBTrader
\ No newline at end of file
+from .papertrader import PaperTrader
+
+
+def __getattr__(name):
+    # YJBTrader 依赖 demjson 等券商接口的包, 用到时才导入
+    if name == 'YJBTrader':
+        from .yjbtrader import YJBTrader
+        return YJBTrader
+    raise AttributeError("module 'trade' has no attribute '%s'" % name)
@@ -0,0 +1,97 @@
+"""
+    账户状态缓存
+    资金、持仓、委托各自缓存最近一次从券商下载的结果, 读取时不再请求券商:
+        数据超过 ttl 秒或被 invalidate 标记失效后, 下次读取时才重新下载
+        下单、撤单后调用 invalidate, 成交后的持仓和资金在下次读取时刷新
+    >>> cache = AccountCache(dict(balance=user.fetch_balance), ttl=5)          # doctest: +SKIP
+    >>> cache.get('balance')                                                    # doctest: +SKIP
+    >>> cache.updated_at('balance')                                             # doctest: +SKIP
+"""
+import time
+from threading import Lock
+
+
+class AccountCache:
+    def __init__(self, loaders, ttl=5):
+        """
+        :param loaders: dict 名称 -> 下载函数, 如 {'balance': ..., 'position': ..., 'entrust': ...}
+        :param ttl: 缓存有效时间, 秒, None 表示只在 invalidate 后刷新
+        """
+        self.loaders = dict(loaders)
+        self.ttl = ttl
+        self.__values = dict()
+        # 名称 -> 下载完成的时间戳
+        self.__updated = dict()
+        # 名称 -> 下载锁, 同一项同时只下载一次
+        self.__locks = {name: Lock() for name in self.loaders}
+        # 名称 -> 失效次数, 下载期间被标记失效时, 下载结果不视为最新
+        self.__generations = {name: 0 for name in self.loaders}
+
+    def get(self, name):
+        """
+        :param name: 缓存项名称
+        :return: 缓存的数据, 过期或失效时先重新下载
+        """
+        if self.is_fresh(name):
+            return self.__values[name]
+        with self.__locks[name]:
+            # 等锁期间其它线程可能已经下载完成
+            if self.is_fresh(name):
+                return self.__values[name]
+            return self.__load(name)
+
+    def refresh(self, names=None):
+        """
+            立即重新下载
+        :param names: 缓存项名称列表, 缺省全部
+        """
+        for name in names or self.loaders:
+            with self.__locks[name]:
+                self.__load(name)
+
+    def set(self, name, value, generation=None):
+        """
+            写入在其它地方下载的数据, 如心跳查询到的资金
+        :param name: 缓存项名称
+        :param value: 数据
+        :param generation: 发起下载前读取的 generation(name), 之后被标记过失效时数据不视为最新, None 表示不检查
+        """
+        with self.__locks[name]:
+            self.__values[name] = value
+            if generation is None or generation == self.__generations[name]:
+                self.__updated[name] = time.time()
+
+    def generation(self, name):
+        """
+        :return: 缓存项的失效次数, 在其它地方下载前读取, 写入时传给 set
+        """
+        return self.__generations[name]
+
+    def invalidate(self, *names):
+        """
+            标记缓存失效, 下次读取时重新下载
+        :param names: 缓存项名称, 缺省全部
+        """
+        for name in names or self.loaders:
+            self.__generations[name] += 1
+            self.__updated.pop(name, None)
+
+    def is_fresh(self, name):
+        updated = self.__updated.get(name)
+        if updated is None:
+            return False
+        return self.ttl is None or time.time() - updated < self.ttl
+
+    def updated_at(self, name):
+        """
+        :return: 最近一次下载完成的时间戳, 未下载或已失效时为 None
+        """
+        return self.__updated.get(name)
+
+    def __load(self, name):
+        generation = self.__generations[name]
+        value = self.loaders[name]()
+        self.__values[name] = value
+        if generation == self.__generations[name]:
+            self.__updated[name] = time.time()
+        return value
@@ -0,0 +1,96 @@
+import threading
+import time
+import unittest
+
+from .accountcache import AccountCache
+
+
+class Loader:
+    """按调用次数返回结果的下载函数, 设置 block 时等待 release 后才返回"""
+
+    def __init__(self, block=False):
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+        if not block:
+            self.release.set()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        return self.calls
+
+
+class FailingLoader(Loader):
+    """券商返回错误状态时, 下载函数抛出异常"""
+
+    def __call__(self):
+        super().__call__()
+        raise RuntimeError('error_no:-51')
+
+
+class AccountCacheTest(unittest.TestCase):
+    def test_ttl(self):
+        loader = Loader()
+        cache = AccountCache(dict(balance=loader), ttl=0.05)
+        self.assertIsNone(cache.updated_at('balance'))
+        self.assertEqual([cache.get('balance'), cache.get('balance')], [1, 1])
+        self.assertIsNotNone(cache.updated_at('balance'))
+        time.sleep(0.06)
+        self.assertFalse(cache.is_fresh('balance'))
+        self.assertEqual(cache.get('balance'), 2)
+
+    def test_invalidate(self):
+        balance, position = Loader(), Loader()
+        cache = AccountCache(dict(balance=balance, position=position), ttl=None)
+        self.assertEqual((cache.get('balance'), cache.get('position')), (1, 1))
+        cache.invalidate('balance')
+        self.assertIsNone(cache.updated_at('balance'))
+        self.assertEqual((cache.get('balance'), cache.get('position')), (2, 1))
+        cache.invalidate()
+        self.assertEqual((cache.get('balance'), cache.get('position')), (3, 2))
+
+        cache.refresh(['position'])
+        self.assertEqual(position.calls, 3)
+        cache.set('balance', 'heartbeat')
+        self.assertEqual(cache.get('balance'), 'heartbeat')
+        self.assertEqual(balance.calls, 3)
+
+    def test_invalidate_during_load(self):
+        loader = Loader(block=True)
+        cache = AccountCache(dict(position=loader), ttl=None)
+        result = []
+        reader = threading.Thread(target=lambda: result.append(cache.get('position')))
+        reader.start()
+        self.assertTrue(loader.started.wait(5))
+        # 下载开始后下的单可能已成交, 本次下载的结果不能视为最新
+        cache.invalidate('position')
+        loader.release.set()
+        reader.join(5)
+        self.assertEqual(result, [1])
+        self.assertFalse(cache.is_fresh('position'))
+        self.assertEqual(cache.get('position'), 2)
+        self.assertTrue(cache.is_fresh('position'))
+
+    def test_invalidate_during_set(self):
+        cache = AccountCache(dict(balance=Loader()), ttl=None)
+        generation = cache.generation('balance')
+        # 心跳请求期间下了单
+        cache.invalidate('balance')
+        cache.set('balance', 'heartbeat', generation)
+        self.assertFalse(cache.is_fresh('balance'))
+        self.assertEqual(cache.get('balance'), 1)
+
+        cache.set('balance', 'heartbeat', cache.generation('balance'))
+        self.assertTrue(cache.is_fresh('balance'))
+        self.assertEqual(cache.get('balance'), 'heartbeat')
+
+    def test_load_error(self):
+        loader = FailingLoader()
+        cache = AccountCache(dict(position=loader), ttl=None)
+        self.assertRaises(RuntimeError, cache.get, 'position')
+        self.assertRaises(RuntimeError, cache.refresh, ['position'])
+        self.assertFalse(cache.is_fresh('position'))
+        self.assertIsNone(cache.updated_at('position'))
+        self.assertEqual(loader.calls, 2)
@@ -1,12 +1,11 @@
 # coding=utf-8
 
-from .yjbtrader import YJBTrader
-
 
 def use(broker, account_file):
     """用于生成特定的券商对象
     :param account_file:
     :param broker:券商名支持 ['ht', 'HT', '华泰’] ['yjb', 'YJB', ’佣金宝'] ['yh', 'YH', '银河'] ['gf', 'GF', '广发']
+        ['paper', '模拟'] 模拟交易, account_file 为 PaperTrader 参数的 json 文件, 可以不存在
     :param debug: 控制 debug 日志的显示, 默认为 True
     :param remove_zero: ht 可用参数，是否移除 08 账户开头的 0, 默认 True
     :return the class of trader
@@ -20,7 +19,11 @@ def use(broker, account_file):
     if broker.lower() in ['ht', '华泰']:
         raise RuntimeError('暂不支持!')
     if broker.lower() in ['yjb', '佣金宝']:
+        from .yjbtrader import YJBTrader
         return YJBTrader(account_file)
+    if broker.lower() in ['paper', '模拟']:
+        from .papertrader import PaperTrader
+        return PaperTrader.from_file(account_file)
     if broker.lower() in ['yh', '银河']:
         raise RuntimeError('暂不支持!')
     if broker.lower() in ['xq', '雪球']:
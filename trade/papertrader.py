@@ -0,0 +1,358 @@
+"""
+    模拟交易
+    与 YJBTrader 相同的交易接口, 不连接券商, 委托按最新行情的五档盘口撮合:
+        买入依次吃卖一至卖五中不高于委托价的挂单, 卖出依次吃买一至买五中不低于委托价的挂单
+        同一笔行情内已成交的挂单量会扣除, 多笔委托不会重复成交同一档挂单
+        未成交的部分留在当日委托中, 后续行情到达时继续撮合, 没有盘口的行情(如 K 线)按最新价不限量成交
+    成交价格按 slippage 向不利方向调整, 按 commission / min_commission / stamp_duty 收取费用
+        佣金按委托累计收取, 一笔委托分多次成交时最低佣金只收一次
+        买入时按委托价加滑点取整后的价格冻结资金及佣金, 成交金额和费用不会超过冻结的资金
+    当日买入的股票下一交易日才能卖出
+    撮合与下单在同一把锁内执行, 行情推送线程和策略线程可以同时调用
+
+    >>> user = trade.use('paper', 'paper.json')                                # doctest: +SKIP
+    >>> user.on_quotation(quotation.refresh())                                  # doctest: +SKIP
+    >>> user.buy('162411', 0.5, amount=1000)                                    # doctest: +SKIP
+"""
+import datetime
+import itertools
+import os
+import time
+from collections import namedtuple
+from threading import RLock
+
+from dateutil import tz
+
+import utils.commutil as cu
+import utils.stockutil as su
+from trade.basictrader import TradeError
+
+Balance = namedtuple('Balance', ['asset_balance', 'current_balance', 'market_value', 'enable_balance'])
+Position = namedtuple('Position', ['stock_code', 'stock_name', 'current_amount', 'enable_amount', 'cost_price',
+                                   'last_price', 'market_value', 'income_balance'])
+
+LEVELS = 5
+# 委托状态
+REPORTED = '已报'
+PARTIAL = '部成'
+FILLED = '已成'
+CANCELLED = '已撤'
+
+
+class _Holding:
+    __slots__ = ('current', 'enable', 'cost')
+
+    def __init__(self):
+        self.current = 0
+        self.enable = 0
+        self.cost = 0.0
+
+
+class PaperTrader:
+    # 每手股数
+    LOT = 100
+
+    def __init__(self, capital=100000, slippage=0.0, commission=0.00025, min_commission=5, stamp_duty=0.001,
+                 tzinfo=None):
+        """
+        :param capital: 初始资金
+        :param slippage: 滑点, 成交价格的比例, 买入时上浮, 卖出时下浮
+        :param commission: 佣金费率, 买卖双向收取
+        :param min_commission: 每笔委托的最低佣金
+        :param stamp_duty: 印花税率, 卖出时收取
+        :param tzinfo: 划分交易日的时区, 缺省为当地时区
+        """
+        self.slippage = slippage
+        self.commission = commission
+        self.min_commission = min_commission
+        self.stamp_duty = stamp_duty
+        self.tzinfo = tzinfo or tz.tzlocal()
+        self.cash = float(capital)
+        # 未成交的买入委托冻结的资金
+        self.frozen = 0.0
+        self.login_status = False
+        self.__lock = RLock()
+        self.__holdings = dict()
+        self.__prices = dict()
+        self.__names = dict()
+        # 股票代码 -> 本笔行情的 (买盘, 卖盘), 每档为 [价格, 剩余挂单量]
+        self.__books = dict()
+        # 委托编号 -> 委托, 包括当日全部委托
+        self.__entrusts = dict()
+        # 股票代码 -> 未成交的委托编号
+        self.__open = dict()
+        # 全部成交记录, 当日成交从 __day_start 开始
+        self.deals = []
+        self.__day_start = 0
+        self.__entrust_no = itertools.count(1)
+        self.__date = None
+        self.timestamp = None
+
+    @classmethod
+    def from_file(cls, account_file):
+        """
+        :param account_file: json 文件, 内容为 __init__ 的参数, 文件不存在时使用缺省参数
+        """
+        if account_file is not None and os.path.exists(account_file):
+            return cls(**cu.file2dict(account_file))
+        return cls()
+
+    def login(self, limit=10):
+        self.login_status = True
+
+    def is_login(self):
+        return self.login_status
+
+    def logout(self):
+        self.login_status = False
+
+    def on_quotation(self, data, timestamp=None):
+        """
+            更新行情并撮合未成交的委托
+        :param data: dict {code: 行情}, 行情为 dict 或 quotation.tick.Tick
+        :param timestamp: float 行情时间戳, 缺省为当前时间
+        """
+        with self.__lock:
+            self.__set_time(time.time() if timestamp is None else timestamp)
+            for code, quotation in data.items():
+                now = quotation.get('now')
+                if not now:
+                    continue
+                self.__prices[code] = float(now)
+                self.__books[code] = (self.__levels(quotation, 'bid'), self.__levels(quotation, 'ask'))
+                self.__names[code] = quotation.get('name') or ''
+                for entrust_no in self.__open.get(code, ()):
+                    self.__match(self.__entrusts[entrust_no])
+                self.__clean_open(code)
+
+    def __set_time(self, timestamp):
+        self.timestamp = timestamp
+        date = datetime.datetime.fromtimestamp(timestamp, self.tzinfo).date()
+        if date != self.__date:
+            # 新交易日: 未成交的委托失效, 昨日买入的股票可以卖出
+            for code in self.__open:
+                for entrust_no in self.__open[code]:
+                    self.__cancel(self.__entrusts[entrust_no])
+            self.__open.clear()
+            self.__entrusts.clear()
+            for holding in self.__holdings.values():
+                holding.enable = holding.current
+            self.__day_start = len(self.deals)
+            self.__date = date
+
+    @staticmethod
+    def __levels(quotation, side):
+        levels = []
+        for level in range(1, LEVELS + 1):
+            price = quotation.get('%s%d' % (side, level))
+            volume = quotation.get('%s%d_volume' % (side, level))
+            if price and volume:
+                levels.append([float(price), float(volume)])
+        return levels
+
+    def buy(self, stock_code, price, amount=0, volume=0, entrust_prop=0):
+        """买入股票
+        :param stock_code: 股票代码
+        :param price: 买入价格
+        :param amount: 买入股数, 向下取整到整手
+        :param volume: 买入总金额 由 volume / price 取整， 若指定 amount 则此参数无效
+        :param entrust_prop: 委托类型，暂未实现，默认为限价委托
+        :return: dict 委托, 见 get_entrust
+        """
+        entrust_amount = amount // self.LOT * self.LOT if amount else su.ensure_number(stock_code, volume, price)
+        with self.__lock:
+            return self.__trade(stock_code, price, entrust_amount, '买入')
+
+    def sell(self, stock_code, price, amount=0, volume=0, entrust_prop=0):
+        """卖出股票
+        :param stock_code: 股票代码
+        :param price: 卖出价格
+        :param amount: 卖出股数
+        :param volume: 卖出总金额 由 volume / price 取整， 若指定 amount 则此参数无效
+        :param entrust_prop: 委托类型，暂未实现，默认为限价委托
+        :return: dict 委托, 见 get_entrust
+        """
+        entrust_amount = amount if amount else su.ensure_number(stock_code, volume, price)
+        with self.__lock:
+            return self.__trade(stock_code, price, entrust_amount, '卖出')
+
+    def __trade(self, stock_code, price, entrust_amount, entrust_bs):
+        if entrust_amount <= 0:
+            raise TradeError('委托数量必须大于 0: {} {}'.format(stock_code, entrust_amount))
+        if self.timestamp is None:
+            self.__set_time(time.time())
+        price = float(price)
+        if entrust_bs == '买入':
+            # 成交价不高于委托价, 取整不改变大小顺序, 按委托价冻结即为最大的成交金额
+            freeze = su.ensure_price(stock_code, price * (1 + self.slippage)) * entrust_amount
+            freeze += self.__commission(freeze)
+            if freeze > self.cash - self.frozen:
+                raise TradeError('可用资金不足: 需要 {:.2f}, 可用 {:.2f}'.format(freeze, self.cash - self.frozen))
+            self.frozen += freeze
+        else:
+            freeze = 0.0
+            holding = self.__holdings.get(stock_code)
+            if holding is None or holding.enable < entrust_amount:
+                raise TradeError('可卖数量不足: {} 委托 {}, 可卖 {}'.format(
+                    stock_code, entrust_amount, 0 if holding is None else holding.enable))
+            holding.enable -= entrust_amount
+        entrust = dict(entrust_no=next(self.__entrust_no), stock_code=stock_code, entrust_bs=entrust_bs,
+                       entrust_price=price, entrust_amount=entrust_amount, business_amount=0, business_price=0.0,
+                       entrust_status=REPORTED, report_time=self.timestamp, frozen=freeze, commission=0.0)
+        self.__entrusts[entrust['entrust_no']] = entrust
+        self.__match(entrust)
+        if entrust['entrust_status'] in (REPORTED, PARTIAL):
+            self.__open.setdefault(stock_code, []).append(entrust['entrust_no'])
+        return entrust
+
+    def __match(self, entrust):
+        """
+            按盘口撮合委托未成交的部分
+        """
+        code = entrust['stock_code']
+        last = self.__prices.get(code)
+        if last is None:
+            return
+        buy = entrust['entrust_bs'] == '买入'
+        price = entrust['entrust_price']
+        bids, asks = self.__books[code]
+        levels = asks if buy else bids
+        remaining = entrust['entrust_amount'] - entrust['business_amount']
+        if not levels:
+            # 没有盘口时按最新价不限量成交
+            if (last <= price) if buy else (last >= price):
+                self.__fill(entrust, last, remaining)
+            return
+        for level in levels:
+            if remaining <= 0:
+                break
+            level_price, level_volume = level
+            if level_volume <= 0:
+                continue
+            if (level_price > price) if buy else (level_price < price):
+                break
+            num = min(remaining, level_volume)
+            level[1] -= num
+            self.__fill(entrust, level_price, num)
+            remaining -= num
+
+    def __fill(self, entrust, price, num):
+        code = entrust['stock_code']
+        buy = entrust['entrust_bs'] == '买入'
+        price = su.ensure_price(code, price * (1 + self.slippage if buy else 1 - self.slippage))
+        balance = price * num
+        total = entrust['business_price'] * entrust['business_amount'] + balance
+        # 本次成交补足委托累计成交金额对应的佣金
+        commission = self.__commission(total) - entrust['commission']
+        entrust['commission'] += commission
+        fee = commission if buy else commission + balance * self.stamp_duty
+        holding = self.__holdings.get(code)
+        if holding is None:
+            holding = self.__holdings[code] = _Holding()
+        if buy:
+            # 按成交释放冻结资金, 最后一笔释放剩余部分
+            done = entrust['business_amount'] + num >= entrust['entrust_amount']
+            release = entrust['frozen'] if done else min(entrust['frozen'], balance + fee)
+            entrust['frozen'] -= release
+            self.frozen -= release
+            self.cash -= balance + fee
+            holding.cost = (holding.cost * holding.current + balance + fee) / (holding.current + num)
+            holding.current += num
+        else:
+            self.cash += balance - fee
+            holding.current -= num
+            if holding.current == 0:
+                holding.cost = 0.0
+        entrust['business_amount'] += num
+        entrust['business_price'] = total / entrust['business_amount']
+        entrust['entrust_status'] = FILLED if entrust['business_amount'] >= entrust['entrust_amount'] else PARTIAL
+        self.deals.append(dict(entrust_no=entrust['entrust_no'], stock_code=code, stock_name=self.__names.get(code, ''),
+                               entrust_bs=entrust['entrust_bs'], entrust_amount=entrust['entrust_amount'],
+                               business_price=price, business_amount=num, business_balance=balance, fee=fee,
+                               business_time=self.timestamp))
+        if holding.current == 0 and holding.enable == 0:
+            self.__holdings.pop(code)
+
+    def __commission(self, balance):
+        """
+        :param balance: 一笔委托的累计成交金额
+        :return: 该委托应收的佣金
+        """
+        return max(balance * self.commission, self.min_commission) if balance else 0.0
+
+    def __clean_open(self, code):
+        pending = [no for no in self.__open.get(code, ())
+                   if self.__entrusts[no]['entrust_status'] in (REPORTED, PARTIAL)]
+        if pending:
+            self.__open[code] = pending
+        else:
+            self.__open.pop(code, None)
+
+    def __cancel(self, entrust):
+        remaining = entrust['entrust_amount'] - entrust['business_amount']
+        if entrust['entrust_bs'] == '买入':
+            self.frozen -= entrust['frozen']
+            entrust['frozen'] = 0.0
+        else:
+            holding = self.__holdings.get(entrust['stock_code'])
+            if holding is not None:
+                holding.enable += remaining
+        entrust['entrust_status'] = CANCELLED
+
+    def cancel_entrust(self, entrust_no, stock_code):
+        """撤单
+        :param entrust_no: 委托单号
+        :param stock_code: 股票代码
+        :return: 撤单成功返回 True"""
+        with self.__lock:
+            entrust = self.__entrusts.get(entrust_no)
+            if entrust is None or entrust['stock_code'] != stock_code:
+                raise TradeError('委托不存在: {} {}'.format(entrust_no, stock_code))
+            if entrust['entrust_status'] not in (REPORTED, PARTIAL):
+                raise TradeError('委托 {} 状态为 {}, 不能撤单'.format(entrust_no, entrust['entrust_status']))
+            self.__cancel(entrust)
+            self.__clean_open(stock_code)
+            return True
+
+    @property
+    def market_value(self):
+        return sum(holding.current * self.__prices.get(code, holding.cost)
+                   for code, holding in self.__holdings.items()) + 0.0
+
+    def get_balance(self):
+        """
+            获取账户资金状况, 与 YJBTrader.get_balance 相同
+        :return: list [Balance]
+        """
+        market_value = self.market_value
+        enable = self.cash - self.frozen
+        return [Balance(self.cash + market_value, enable, market_value, enable)]
+
+    def get_position(self, stock_code):
+        """
+            获取持仓, 与 YJBTrader.get_position 相同
+        :return: Position, 没有持仓时返回 None
+        """
+        holding = self.__holdings.get(stock_code)
+        if holding is None:
+            return None
+        last = self.__prices.get(stock_code, holding.cost)
+        market_value = holding.current * last
+        return Position(stock_code, self.__names.get(stock_code, ''), holding.current, holding.enable, holding.cost, last,
+                        market_value, market_value - holding.cost * holding.current)
+
+    @property
+    def position(self):
+        return [self.get_position(code) for code in self.__holdings]
+
+    def get_entrust(self):
+        """获取当日委托列表"""
+        return list(self.__entrusts.values())
+
+    @property
+    def current_deal(self):
+        return self.get_current_deal()
+
+    def get_current_deal(self):
+        """获取当日成交列表"""
+        return self.deals[self.__day_start:]
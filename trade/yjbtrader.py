@@ -13,6 +13,7 @@ import utils.stockutil as su
 from trade.basictrader import LoginError
 from trade.basictrader import TradeError
 from trade.basictrader import BasicTrader
+from trade.accountcache import AccountCache
 
 MESSAGES = {
     '-10003': '您已登录一股票帐户，重登陆前请先注销!',
@@ -47,10 +48,19 @@ def get_return_json(resp):
 class YJBTrader(BasicTrader):
     api_file = os.path.dirname(__file__) + '/config/yjb.json'
     market = {"sh": 1, "sz": 2}
+    # 资金 / 持仓 / 委托的缓存有效时间, 秒, 见 trade.accountcache
+    CacheTTL = 5
+    BalanceMeta = ('Balance', ['asset_balance', 'current_balance', 'market_value', 'enable_balance'])
+    PositionMeta = ('Position', ['stock_code', 'stock_name', 'current_amount', 'enable_amount', 'cost_price',
+                                 'last_price', 'market_value', 'income_balance'])
 
     def __init__(self, account_file):
         super(YJBTrader, self).__init__(api_file=self.api_file)
         self.account_info = cu.file2dict(path=account_file)
+        self.cache = AccountCache(dict(balance=self.fetch_balance,
+                                       position=self.fetch_position,
+                                       entrust=self.fetch_entrust),
+                                  ttl=self.CacheTTL)
 
     def _login(self, throw=False):
         self.do(directive="home")  # 生成cookies
@@ -88,7 +98,19 @@ class YJBTrader(BasicTrader):
             return False, return_json
 
     def _heartbeat(self):
-        return self.get_balance()
+        # 心跳只需要资金查询, 返回原始 response 由 _check_status 检查登录状态
+        # 请求前记录失效次数, 请求期间下单、撤单后返回的资金不视为最新
+        generation = self.cache.generation('balance')
+        resp = self.do(directive='balance', params=self.get_basic_params(), handle=lambda resp: resp)
+        # 返回错误时不写入缓存
+        self._check_status(resp)
+        # 顺带定时刷新资金 / 持仓 / 委托的缓存, 失败时只记录日志, 不影响心跳线程
+        try:
+            self.cache.set('balance', self._default_response_handle(resp, self.BalanceMeta), generation)
+            self.cache.refresh(['position', 'entrust'])
+        except Exception as e:
+            self.log.error('刷新账户缓存失败: {}'.format(e))
+        return resp
 
     def _check_status(self, func_data):
         """
@@ -110,8 +132,12 @@ class YJBTrader(BasicTrader):
         return True
 
     def get_balance(self):
+        """获取账户资金状况, 读取缓存, 见 fetch_balance"""
+        return self.cache.get('balance')
+
+    def fetch_balance(self):
         """
-            获取账户资金状况
+            下载账户资金状况
             "money_type": "币种",
             "asset_balance": "资产总值",
             "current_balance": "可取余额",
@@ -121,11 +147,20 @@ class YJBTrader(BasicTrader):
         """
         return self.do(directive='balance',
                        params=self.get_basic_params(),
-                       meta_data=('Balance', ['asset_balance', 'current_balance', 'market_value', 'enable_balance']))
+                       handle=self._checked_response_handle,
+                       meta_data=self.BalanceMeta)
 
     def get_position(self, stock_code):
+        """获取持仓, 读取缓存, 没有持仓时返回 None, 见 fetch_position"""
+        return self.cache.get('position').get(stock_code)
+
+    @property
+    def position(self):
+        return list(self.cache.get('position').values())
+
+    def fetch_position(self):
         """
-            获取持仓,数据结构如下
+            下载全部持仓, 按股票代码索引, 数据结构如下
             "enable_amount": "可卖数量",
             "current_amount": "当前数量",
             "position_str": "定位串",
@@ -137,22 +172,22 @@ class YJBTrader(BasicTrader):
             "income_balance": "摊薄浮动盈亏",
             "market_value": "证券市值"
         """
+        # 按 meta_data 转换时跳过第一行状态信息
         positions = self.do(directive='position',
                             params=self.get_basic_params(),
-                            meta_data=(
-                                'Position',
-                                ['stock_code', 'stock_name', 'current_amount', 'enable_amount', 'cost_price',
-                                 'last_price', 'market_value', 'income_balance']))
-
-        for pos in positions:
-            if pos.stock_code == stock_code:
-                return pos
-        return None
+                            handle=self._checked_response_handle,
+                            meta_data=self.PositionMeta)
+        return {pos.stock_code: pos for pos in positions}
 
     def get_entrust(self):
-        """获取当日委托列表"""
+        """获取当日委托列表, 读取缓存"""
+        return self.cache.get('entrust')
+
+    def fetch_entrust(self):
+        """下载当日委托列表"""
         return self.do(directive='entrust',
-                       params=self.get_basic_params())
+                       params=self.get_basic_params(),
+                       handle=self._checked_response_handle)
 
     def cancel_entrust(self, entrust_no, stock_code):
         """撤单
@@ -163,6 +198,7 @@ class YJBTrader(BasicTrader):
                            self.get_basic_params(),
                            entrust_no=entrust_no,
                            stock_code=stock_code))
+        self.cache.invalidate()
         return self._check_status(data)
 
     @property
@@ -232,7 +268,11 @@ class YJBTrader(BasicTrader):
         )
         params.update(account)
         params.update(basic_params)
-        return self.do(directive=directive, params=params)
+        try:
+            return self.do(directive=directive, params=params)
+        finally:
+            # 委托可能已经成交, 资金 / 持仓 / 委托在下次读取时重新下载
+            self.cache.invalidate()
 
     def ipo(self):
         """
@@ -274,6 +314,13 @@ class YJBTrader(BasicTrader):
         return basic_params
 
 
+    def _checked_response_handle(self, resp, meta_data=None):
+        """先检查返回状态再格式化, 返回错误时抛出异常, 避免把错误信息写入缓存
+        :param resp: response
+        """
+        self._check_status(resp)
+        return self._default_response_handle(resp, meta_data)
+
     def _default_response_handle(self, resp, meta_data=None):
         """格式化response
         :param resp: response
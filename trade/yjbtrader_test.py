@@ -0,0 +1,51 @@
+import importlib.util
+import json
+import logging
+import unittest
+
+import utils.commutil as cu
+from .accountcache import AccountCache
+from .basictrader import TradeError
+
+
+class Response:
+    def __init__(self, rows):
+        self.text = json.dumps(dict(returnJson=json.dumps(dict(function_id='405', Func405=rows))))
+
+
+@unittest.skipUnless(importlib.util.find_spec('demjson'), 'YJBTrader 需要 demjson')
+class HeartbeatTest(unittest.TestCase):
+    def trader(self, rows, during_request=None):
+        """不登录的 YJBTrader, 请求都返回 rows"""
+        from .yjbtrader import YJBTrader
+        trader = YJBTrader.__new__(YJBTrader)
+        trader.log = logging.getLogger('YJBTrader')
+        trader.config = cu.file2dict(YJBTrader.api_file)
+        trader.get_basic_params = dict
+
+        def do(directive, params=None, handle=None, meta_data=None):
+            if during_request is not None:
+                during_request(trader)
+            resp = Response([dict(row) for row in rows])
+            return handle(resp, meta_data) if meta_data else handle(resp)
+
+        trader.do = do
+        trader.cache = AccountCache(dict(balance=trader.fetch_balance,
+                                         position=trader.fetch_position,
+                                         entrust=trader.fetch_entrust), ttl=None)
+        return trader
+
+    def test_error_status(self):
+        trader = self.trader([dict(error_no='-51', error_info='查询失败')])
+        self.assertRaises(TradeError, trader._heartbeat)
+        self.assertRaises(TradeError, trader.cache.get, 'position')
+        for name in ('balance', 'position', 'entrust'):
+            self.assertFalse(trader.cache.is_fresh(name))
+            self.assertIsNone(trader.cache.updated_at(name))
+
+    def test_invalidate_during_heartbeat(self):
+        rows = [dict(error_no='0', error_info=''), dict(asset_balance='100', current_balance='100',
+                                                        market_value='0', enable_balance='100')]
+        trader = self.trader(rows, during_request=lambda trader: trader.cache.invalidate('balance'))
+        trader._heartbeat()
+        self.assertFalse(trader.cache.is_fresh('balance'))
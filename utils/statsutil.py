@@ -0,0 +1,185 @@
+import bisect
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from threading import Lock
+
+
+class LatencyStats:
+    """
+        耗时统计, 记录调用次数 / 总耗时 / 最大耗时 / 最近一次耗时, 单位秒
+        同时按 buckets 分桶计数, 用于查看耗时分布和估算分位数
+    """
+    # 分桶上限, 单位秒, 最后一个桶收集超过最大上限的耗时
+    Buckets = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10)
+
+    def __init__(self, buckets=None):
+        """
+        :param buckets: 升序的分桶上限, 缺省为 Buckets
+        """
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+        self.buckets = tuple(buckets or self.Buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.__lock = Lock()
+
+    def add(self, cost):
+        """
+        :param cost: float 单次耗时, 单位秒
+        :return:
+        """
+        with self.__lock:
+            self.count += 1
+            self.total += cost
+            self.last = cost
+            if cost > self.max:
+                self.max = cost
+            self.counts[bisect.bisect_left(self.buckets, cost)] += 1
+
+    def timer(self):
+        """
+            计时上下文
+            >>> stats = LatencyStats()
+            >>> with stats.timer():
+            ...     pass
+            >>> stats.count
+            1
+        """
+        return _Timer(self)
+
+    @property
+    def avg(self):
+        return self.total / self.count if self.count else 0.0
+
+    def histogram(self):
+        """
+            分桶计数
+            >>> stats = LatencyStats(buckets=(0.01, 0.1))
+            >>> for cost in (0.005, 0.05, 0.05, 1):
+            ...     stats.add(cost)
+            >>> stats.histogram()
+            OrderedDict([('<=10ms', 1), ('<=100ms', 2), ('>100ms', 1)])
+        """
+        labels = ['<={:g}ms'.format(bound * 1000) for bound in self.buckets]
+        labels.append('>{:g}ms'.format(self.buckets[-1] * 1000))
+        with self.__lock:
+            return OrderedDict(zip(labels, self.counts))
+
+    def percentile(self, percent):
+        """
+            按分桶估算分位数, 返回所在桶的上限, 落在最后一个桶时返回最大耗时
+        :param percent: 0 - 100
+        :return: float 单位秒
+        """
+        with self.__lock:
+            if not self.count:
+                return 0.0
+            rank = self.count * percent / 100
+            seen = 0
+            for bound, count in zip(self.buckets, self.counts):
+                seen += count
+                if seen >= rank:
+                    return min(bound, self.max)
+            return self.max
+
+    def to_dict(self):
+        """
+        :return: dict 耗时单位统一换算为毫秒
+        """
+        return dict(
+            count=self.count,
+            avg=round(self.avg * 1000, 3),
+            max=round(self.max * 1000, 3),
+            last=round(self.last * 1000, 3),
+        )
+
+
+class _Timer:
+    def __init__(self, stats):
+        self.stats = stats
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stats.add(time.perf_counter() - self.start)
+        return False
+
+
+class StartupProfile:
+    """
+        启动耗时分解, 同步阶段用 phase 计时, 网络相关的初始化用 background 放到线程池中并行执行
+        >>> profile = StartupProfile()
+        >>> with profile.phase('event_engine'):
+        ...     pass
+        >>> list(profile.report()['phases'])
+        ['event_engine']
+    """
+
+    def __init__(self, max_workers=4):
+        self.phases = OrderedDict()
+        self.errors = dict()
+        self.max_workers = max_workers
+        self.__futures = OrderedDict()
+        self.__executor = None
+        self.__lock = Lock()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.__record(name, time.perf_counter() - start)
+
+    def background(self, name, func, *args):
+        """
+            在后台线程中执行初始化任务
+        :return: concurrent.futures.Future
+        """
+        if self.__executor is None:
+            self.__executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='startup')
+        future = self.__executor.submit(self.__run, name, func, args)
+        self.__futures[name] = future
+        return future
+
+    def wait(self, timeout=None):
+        """
+            等待全部后台任务完成
+        :return: bool 是否全部完成
+        """
+        _, pending = wait(list(self.__futures.values()), timeout)
+        if not pending and self.__executor is not None:
+            self.__executor.shutdown(wait=False)
+        return not pending
+
+    def report(self):
+        """
+        :return: dict phases 各阶段耗时(毫秒), pending 未完成的后台任务, errors 失败的任务
+        """
+        with self.__lock:
+            phases = OrderedDict((name, round(cost * 1000, 3)) for name, cost in self.phases.items())
+        return dict(
+            phases=phases,
+            pending=[name for name, future in self.__futures.items() if not future.done()],
+            errors={name: repr(e) for name, e in self.errors.items()},
+        )
+
+    def __run(self, name, func, args):
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        except Exception as e:
+            self.errors[name] = e
+            raise
+        finally:
+            self.__record(name, time.perf_counter() - start)
+
+    def __record(self, name, cost):
+        with self.__lock:
+            self.phases[name] = cost
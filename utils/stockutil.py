@@ -1,5 +1,4 @@
 import re
-import requests
 
 
 def get_stock_type(stock_code):
@@ -24,6 +23,7 @@ def get_stock_type(stock_code):
 
 def get_all_stock_codes():
     """获取所有股票 ID 到 all_stock_code 目录下"""
+    import requests
     all_stock_codes_url = 'http://www.shdjt.com/js/lib/astock.js'
     grep_stock_codes = re.compile('~(\d+)`')
     response = requests.get(all_stock_codes_url)
@@ -85,6 +85,13 @@ def get_g():
 
 class StrategyTemplate(StrategyObject):
     name = 'DefaultStrategyTemplate'
+    # 关注的股票代码列表, 设置后 strategy 只会收到这些股票的行情, 可在 initialize 中赋值
+    symbols = None
+    # 关注的时钟事件列表, 如 [5, 'open', ('before_close', datetime.time(14, 50))], 设置后 clock 只会收到这些事件
+    # 元素为间隔分钟数 / 时刻事件名 / (自定义时刻事件名, datetime.time), 见 ClockEngine.register_clocks
+    clocks = None
+    # 策略进程模式下所在的进程组, 同组策略运行在同一个工作进程中, 缺省每个策略独占一个进程
+    process_group = None
 
     def __init__(self, user, log_handler, main_engine):
         self.user = user
@@ -134,6 +141,8 @@ class StrategyTemplate(StrategyObject):
          'sell': '0.493',
          'turnover': '420004912',
          'volume': '206390073.351'}}
+        设置了 symbols 时, event.data 只包含一只所关注股票的行情
+        获取失败或超时的股票沿用上一次的行情, 并带有 'stale': True; 从未获取成功的股票只有 {'stale': True}
         """
 
     def run(self, event):
@@ -146,8 +155,20 @@ class StrategyTemplate(StrategyObject):
                                                            exc_traceback)))
 
     def clock(self, event):
+        """
+        :param event: event.data.clock_event 为间隔分钟数或时刻事件名, 设置了 clocks 时只包含所关注的类型
+        """
         pass
 
+    def handover(self, g):
+        """
+        重新加载策略时调用, 接收旧策略实例的 g, 缺省直接沿用
+        :param g: 旧策略的 g, 旧策略没有 g 时为 None
+        :return:
+        """
+        if g is not None:
+            self.g = g
+
     def log_handler(self):
         """
         优先使用在此自定义 log 句柄, 否则返回None, 并使用主引擎日志句柄
@@ -0,0 +1,91 @@
+import datetime
+import os
+import tempfile
+import unittest
+
+from . import tradecalendar
+from .tradecalendar import TradeCalendar
+from .watcher import InotifyWatcher, PollingWatcher
+
+
+class TradeCalendarTest(unittest.TestCase):
+    def setUp(self):
+        # 2016 年国庆
+        self.calendar = TradeCalendar('20160901', '20161031', ['20161003', '20161004', '20161005', '20161006', '20161007'])
+
+    def test_is_trade_date(self):
+        self.assertTrue(self.calendar.is_trade_date('20160930'))
+        self.assertFalse(self.calendar.is_trade_date(datetime.date(2016, 10, 3)))
+        self.assertFalse(self.calendar.is_trade_date(datetime.datetime(2016, 10, 8, 9)))
+        # 超出范围按工作日处理, 并记录 error 日志
+        with self.assertLogs('calendar', 'ERROR'):
+            self.assertTrue(self.calendar.is_trade_date('20161101'))
+
+    def test_bundled_calendar(self):
+        calendar = TradeCalendar.load()
+        self.assertTrue(calendar.covers(datetime.date(2026, 12, 31)))
+        # 与交易所公布的全年交易日数一致
+        self.assertEqual([calendar.count('%d0101' % year, '%d1231' % year) for year in (2017, 2020, 2024, 2025)],
+                         [244, 243, 242, 243])
+        self.assertEqual(calendar.next('20250127'), datetime.date(2025, 2, 5))
+
+    def test_next_previous(self):
+        self.assertEqual(self.calendar.next('20160930'), datetime.date(2016, 10, 10))
+        self.assertEqual(self.calendar.previous('20161010'), datetime.date(2016, 9, 30))
+        self.assertEqual(self.calendar.next('20161031'), datetime.date(2016, 11, 1))
+        self.assertEqual(self.calendar.previous('20160901'), datetime.date(2016, 8, 31))
+        self.assertEqual(self.calendar.next('20160801'), datetime.date(2016, 8, 2))
+
+    def test_count(self):
+        self.assertEqual(self.calendar.count('20160926', '20161009'), 5)
+        self.assertEqual(self.calendar.count('20160901', '20161031'), 22 + 16)
+        self.assertEqual(self.calendar.count('20161031', '20161102'), 3)
+
+    def test_save_and_merge(self):
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, 'calendar.txt')
+            self.calendar.merge('20161101', '20161130', []).save(path)
+            calendar = TradeCalendar.load(path)
+        self.assertEqual(calendar.end, datetime.date(2016, 11, 30))
+        self.assertEqual(calendar.holidays, self.calendar.holidays)
+        with self.assertRaises(ValueError):
+            calendar.merge('20170101', '20170131', [])
+
+    def test_refresh_saves_to_user_file(self):
+        bundled = TradeCalendar.load()
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, 'calendar', 'trade_calendar.txt')
+            original = tradecalendar.USER_CALENDAR_FILE, tradecalendar.get_calendar()
+            tradecalendar.USER_CALENDAR_FILE = path
+            try:
+                end = bundled.end.replace(year=bundled.end.year + 1)
+                refreshed = tradecalendar.refresh(bundled.end + datetime.timedelta(days=1), end, [], path)
+                self.assertEqual(tradecalendar.get_calendar(), refreshed)
+                # 随代码发布的日历不变, 重新加载时使用覆盖到更晚日期的用户日历
+                self.assertEqual(TradeCalendar.load().end, bundled.end)
+                self.assertEqual(tradecalendar.load_calendar().end, end)
+            finally:
+                tradecalendar.USER_CALENDAR_FILE = original[0]
+                tradecalendar.set_calendar(original[1])
+
+
+class WatcherTest(unittest.TestCase):
+    def check(self, watcher_class, **kwargs):
+        with tempfile.TemporaryDirectory() as root:
+            watcher = watcher_class(root, '.py', **kwargs)
+            self.assertEqual(watcher.wait(timeout=0.1), set())
+            with open(os.path.join(root, 'a.py'), 'w') as f:
+                f.write('x = 1')
+            with open(os.path.join(root, 'b.txt'), 'w') as f:
+                f.write('x = 1')
+            self.assertEqual(watcher.wait(timeout=2), {'a.py'})
+            watcher.close()
+
+    def test_inotify(self):
+        try:
+            self.check(InotifyWatcher)
+        except OSError as e:
+            self.skipTest(str(e))
+
+    def test_polling(self):
+        self.check(PollingWatcher, interval=0.05)
@@ -1,17 +1,16 @@
 import datetime
 from datetime import timedelta, tzinfo
-from functools import lru_cache
-import requests
 import time
 
+from utils.tradecalendar import get_calendar
+
 
-@lru_cache()
 def is_holiday(day: str):
-    api = 'http://www.easybots.cn/api/holiday.php'
-    params = {'d': day}
-    rep = requests.get(api, params)
-    res = rep.json()[day if isinstance(day, str) else day[0]]
-    return True if res == "1" else False
+    """
+        是否休市日(含周末), 查询本地交易日历
+    :param day: str YYYYMMDD
+    """
+    return not get_calendar().is_trade_date(day)
 
 
 def is_holiday_today():
@@ -57,7 +56,7 @@ def is_weekend(now_time):
 
 
 def is_trade_date(now_time):
-    return not (is_holiday(now_time.strftime('%Y%m%d')) or is_weekend(now_time))
+    return get_calendar().is_trade_date(now_time)
 
 
 def get_next_trade_date(now_time):
@@ -68,19 +67,28 @@ def get_next_trade_date(now_time):
     >>> get_next_trade_date(datetime.date(2016, 5, 5))
     datetime.date(2016, 5, 6)
     """
-    now = now_time
-    max_days = 365
-    days = 0
-    while 1:
-        days += 1
-        now += datetime.timedelta(days=1)
-        if is_trade_date(now):
-            if isinstance(now, datetime.date):
-                return now
-            else:
-                return now.date()
-        if days > max_days:
-            raise ValueError('无法确定 %s 下一个交易日' % now_time)
+    return get_calendar().next(now_time)
+
+
+def get_previous_trade_date(now_time):
+    """
+    :param now_time: datetime.datetime
+    :return:
+    >>> import datetime
+    >>> get_previous_trade_date(datetime.date(2016, 10, 10))
+    datetime.date(2016, 9, 30)
+    """
+    return get_calendar().previous(now_time)
+
+
+def count_trade_dates(begin, end):
+    """
+        [begin, end] 闭区间内的交易日数
+    >>> import datetime
+    >>> count_trade_dates(datetime.date(2016, 9, 26), datetime.date(2016, 10, 9))
+    5
+    """
+    return get_calendar().count(begin, end)
 
 
 OPEN_TIME = (
@@ -0,0 +1,253 @@
+"""
+    交易日历
+    从本地日历文件加载, 按日期序号建立交易日位图、有序交易日列表和累计计数, 查询不再发起网络请求
+        is_trade_date            O(1)
+        next / previous          O(log n)
+        count                    O(1)
+    日历文件格式见 trade_calendar.txt, 随代码发布; 更新后的日历保存在用户目录 USER_CALENDAR_FILE, 不修改随代码发布的文件
+    加载时使用两者中覆盖到更晚日期的一个
+    覆盖区间之外无法判断节假日, 按周一至周五均为交易日处理并记录 error 日志, 加载时当天不在区间内也记录 error
+"""
+import bisect
+import datetime
+import itertools
+import logging
+import os
+import sys
+from threading import Lock
+
+CALENDAR_FILE = os.path.join(os.path.dirname(__file__), 'trade_calendar.txt')
+USER_CALENDAR_FILE = os.path.join(os.path.expanduser('~'), '.easyquant', 'trade_calendar.txt')
+HOLIDAY_API = 'http://www.easybots.cn/api/holiday.php'
+# 节假日接口的请求超时, 秒
+HOLIDAY_API_TIMEOUT = 5
+
+log = logging.getLogger('calendar')
+
+
+def to_date(day):
+    """
+    :param day: str YYYYMMDD / datetime.date / datetime.datetime / arrow.Arrow
+    :return: datetime.date
+    """
+    if isinstance(day, str):
+        return datetime.datetime.strptime(day, '%Y%m%d').date()
+    if hasattr(day, 'date'):
+        return day.date()
+    return day
+
+
+class TradeCalendar:
+    def __init__(self, start, end, holidays=()):
+        """
+        :param start: 覆盖区间的开始日期
+        :param end: 覆盖区间的结束日期
+        :param holidays: 区间内工作日休市的日期
+        """
+        self.start = to_date(start)
+        self.end = to_date(end)
+        self.holidays = sorted({to_date(day) for day in holidays if self.start <= to_date(day) <= self.end})
+        self.__first = self.start.toordinal()
+        ordinals = range(self.__first, self.end.toordinal() + 1)
+        # toordinal 中 0001-01-01 为周一
+        self.__bitmap = bytearray((ordinal - 1) % 7 < 5 for ordinal in ordinals)
+        for day in self.holidays:
+            self.__bitmap[day.toordinal() - self.__first] = 0
+        self.__trade_ordinals = [ordinal for ordinal, is_open in zip(ordinals, self.__bitmap) if is_open]
+        self.__counts = list(itertools.accumulate(self.__bitmap))
+        self.__warned = set()
+
+    @classmethod
+    def load(cls, path=CALENDAR_FILE):
+        start = end = None
+        holidays = []
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                if line.startswith('range'):
+                    _, start, end = line.split()
+                else:
+                    holidays.append(line)
+        if start is None:
+            raise ValueError('{} 缺少 range 行'.format(path))
+        return cls(start, end, holidays)
+
+    def save(self, path=USER_CALENDAR_FILE):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write('# 沪深交易所交易日历\n')
+            f.write('# range 开始日期 结束日期 为已覆盖的日期区间, 其余每行为区间内工作日休市的日期\n')
+            f.write('# 更新: python -m utils.tradecalendar 开始日期 结束日期\n')
+            f.write('range {:%Y%m%d} {:%Y%m%d}\n'.format(self.start, self.end))
+            for day in self.holidays:
+                f.write('{:%Y%m%d}\n'.format(day))
+        os.replace(tmp, path)
+
+    def merge(self, start, end, holidays):
+        """
+            合并新区间的休市日期, 返回新的日历
+        :return: TradeCalendar
+        """
+        start, end = to_date(start), to_date(end)
+        if start > self.end + datetime.timedelta(days=1) or end < self.start - datetime.timedelta(days=1):
+            raise ValueError('新区间 {:%Y%m%d}-{:%Y%m%d} 与日历 {:%Y%m%d}-{:%Y%m%d} 不连续'.format(
+                start, end, self.start, self.end))
+        kept = [day for day in self.holidays if not start <= day <= end]
+        return TradeCalendar(min(start, self.start), max(end, self.end), kept + [to_date(day) for day in holidays])
+
+    def covers(self, day):
+        return self.start <= to_date(day) <= self.end
+
+    def is_trade_date(self, day):
+        day = to_date(day)
+        offset = day.toordinal() - self.__first
+        if 0 <= offset < len(self.__bitmap):
+            return bool(self.__bitmap[offset])
+        self.__warn(day)
+        return day.weekday() < 5
+
+    def next(self, day):
+        """
+        :return: datetime.date 之后的第一个交易日
+        """
+        day = to_date(day)
+        i = bisect.bisect_right(self.__trade_ordinals, day.toordinal())
+        if i < len(self.__trade_ordinals) and day >= self.start - datetime.timedelta(days=1):
+            return datetime.date.fromordinal(self.__trade_ordinals[i])
+        if day >= self.start:
+            day = max(day, self.end)
+        while True:
+            day += datetime.timedelta(days=1)
+            if self.is_trade_date(day):
+                return day
+
+    def previous(self, day):
+        """
+        :return: datetime.date 之前的最后一个交易日
+        """
+        day = to_date(day)
+        i = bisect.bisect_left(self.__trade_ordinals, day.toordinal())
+        if 0 < i and day <= self.end + datetime.timedelta(days=1):
+            return datetime.date.fromordinal(self.__trade_ordinals[i - 1])
+        while True:
+            day -= datetime.timedelta(days=1)
+            if self.is_trade_date(day):
+                return day
+
+    def count(self, begin, end):
+        """
+        :return: int [begin, end] 闭区间内的交易日数
+        """
+        begin, end = to_date(begin), to_date(end)
+        if begin > end:
+            return 0
+        if self.start <= begin and end <= self.end:
+            low = begin.toordinal() - self.__first
+            high = end.toordinal() - self.__first
+            return self.__counts[high] - (self.__counts[low - 1] if low > 0 else 0)
+        return sum(self.is_trade_date(begin + datetime.timedelta(days=i)) for i in range((end - begin).days + 1))
+
+    def __warn(self, day):
+        if day.year in self.__warned:
+            return
+        self.__warned.add(day.year)
+        log.error('{:%Y%m%d} 超出交易日历范围 {:%Y%m%d}-{:%Y%m%d}, 节假日按交易日处理, '
+                  '请运行 python -m utils.tradecalendar 更新'.format(day, self.start, self.end))
+
+
+def fetch_holidays(start, end, timeout=HOLIDAY_API_TIMEOUT):
+    """
+        通过节假日接口查询区间内工作日休市的日期, 每个工作日一次请求, 只在更新日历时使用
+    :param timeout: 单次请求超时时间, 秒
+    :return: list datetime.date
+    """
+    import requests
+
+    start, end = to_date(start), to_date(end)
+    session = requests.session()
+    holidays = []
+    day = start
+    while day <= end:
+        if day.weekday() < 5:
+            key = day.strftime('%Y%m%d')
+            res = session.get(HOLIDAY_API, params={'d': key}, timeout=timeout).json()[key]
+            if res != '0':
+                holidays.append(day)
+        day += datetime.timedelta(days=1)
+    return holidays
+
+
+def read_holidays(path):
+    """
+        导入交易所公布的休市日期, 每行一个 YYYYMMDD, 忽略周末
+    :return: list datetime.date
+    """
+    with open(path, encoding='utf-8') as f:
+        days = [to_date(line.strip()) for line in f if line.strip() and not line.startswith('#')]
+    return [day for day in days if day.weekday() < 5]
+
+
+_calendar = None
+_lock = Lock()
+
+
+def load_calendar():
+    """
+        加载 CALENDAR_FILE 和 USER_CALENDAR_FILE 中覆盖到更晚日期的日历, 不发起网络请求
+    :return: TradeCalendar
+    """
+    calendar = TradeCalendar.load(CALENDAR_FILE)
+    if os.path.exists(USER_CALENDAR_FILE):
+        try:
+            updated = TradeCalendar.load(USER_CALENDAR_FILE)
+        except ValueError as e:
+            log.error('忽略格式错误的交易日历 {}: {}'.format(USER_CALENDAR_FILE, e))
+        else:
+            if updated.end > calendar.end:
+                calendar = updated
+    if not calendar.covers(datetime.date.today()):
+        log.error('交易日历只覆盖 {:%Y%m%d}-{:%Y%m%d}, 不含今天, 请运行 python -m utils.tradecalendar 更新'
+                  .format(calendar.start, calendar.end))
+    return calendar
+
+
+def get_calendar():
+    """
+    :return: TradeCalendar 首次调用时由 load_calendar 加载
+    """
+    global _calendar
+    if _calendar is None:
+        with _lock:
+            if _calendar is None:
+                _calendar = load_calendar()
+    return _calendar
+
+
+def set_calendar(calendar):
+    global _calendar
+    _calendar = calendar
+
+
+def refresh(start, end, holidays=None, path=USER_CALENDAR_FILE):
+    """
+        更新日历文件并替换当前使用的日历, 缺省保存到用户目录
+    :param holidays: 休市日期, 缺省通过节假日接口查询
+    :return: TradeCalendar
+    """
+    if holidays is None:
+        holidays = fetch_holidays(start, end)
+    calendar = get_calendar().merge(start, end, holidays)
+    calendar.save(path)
+    set_calendar(calendar)
+    return calendar
+
+
+if __name__ == '__main__':
+    # python -m utils.tradecalendar 开始日期 结束日期 [休市日期文件]
+    logging.basicConfig(level=logging.INFO)
+    holiday_file = sys.argv[3] if len(sys.argv) > 3 else None
+    refreshed = refresh(sys.argv[1], sys.argv[2], read_holidays(holiday_file) if holiday_file else None)
+    log.info('交易日历已更新 {:%Y%m%d}-{:%Y%m%d}'.format(refreshed.start, refreshed.end))
@@ -0,0 +1,123 @@
+"""
+    目录文件变化监视
+    Linux 下使用 inotify, 其它平台或 inotify 不可用时退化为按修改时间轮询
+    >>> watcher = create_watcher('strategies', '.py')                          # doctest: +SKIP
+    >>> changed = watcher.wait(timeout=1)                                      # doctest: +SKIP
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+# struct inotify_event: wd, mask, cookie, len, name[len]
+_EVENT = struct.Struct('iIII')
+
+
+class InotifyWatcher:
+    """
+        inotify 监视, 只关注写入完成和移入(编辑器先写临时文件再改名保存)的文件
+    """
+
+    def __init__(self, path, suffix=''):
+        if not sys.platform.startswith('linux'):
+            raise OSError('inotify 只支持 Linux')
+        self.path = path
+        self.suffix = suffix
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 失败')
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), IN_CLOSE_WRITE | IN_MOVED_TO)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, 'inotify_add_watch %s 失败' % path)
+
+    def wait(self, timeout=None):
+        """
+        :param timeout: 最长等待秒数, None 表示一直等待
+        :return: set 发生变化的文件名
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+        try:
+            buffer = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        changed = set()
+        offset = 0
+        while offset + _EVENT.size <= len(buffer):
+            _, _, _, length = _EVENT.unpack_from(buffer, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(buffer[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if name.endswith(self.suffix):
+                changed.add(name)
+        return changed
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class PollingWatcher:
+    """
+        按修改时间轮询
+    """
+
+    def __init__(self, path, suffix='', interval=1):
+        self.path = path
+        self.suffix = suffix
+        self.interval = interval
+        self._mtimes = self._scan()
+
+    def _scan(self):
+        mtimes = dict()
+        for name in os.listdir(self.path):
+            if name.endswith(self.suffix):
+                try:
+                    mtimes[name] = os.path.getmtime(os.path.join(self.path, name))
+                except OSError:
+                    continue
+        return mtimes
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            mtimes = self._scan()
+            changed = {name for name, mtime in mtimes.items() if self._mtimes.get(name) != mtime}
+            self._mtimes = mtimes
+            if changed:
+                return changed
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return set()
+                time.sleep(min(self.interval, remaining))
+            else:
+                time.sleep(self.interval)
+
+    def close(self):
+        pass
+
+
+def create_watcher(path, suffix='', interval=1):
+    """
+    :param path: 监视的目录
+    :param suffix: 只关注该后缀的文件
+    :param interval: 轮询间隔, 仅在退化为轮询时使用
+    :return: InotifyWatcher 或 PollingWatcher
+    """
+    try:
+        return InotifyWatcher(path, suffix)
+    except (OSError, AttributeError):
+        return PollingWatcher(path, suffix, interval)